@@ -0,0 +1,160 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import datetime
+import json
+import os
+
+import numpy as np
+
+from history_archive import query_range
+
+# Precomputed aggregates for clients and the push path:
+#   ohlc      daily / weekly (Monday start) / monthly [period, open, high, low, close]
+#   ma        simple moving averages over the last 7/30/90 records
+#   range     min/max over the last 7/30/90/365 records
+#   change    absolute and percent change against 1/7/30/90/365 records back
+SUMMARY_FILE = 'public/summary.json'
+METAL_KEYS = ('gold', 'tejabi', 'silver')
+MA_WINDOWS = (7, 30, 90)
+RANGE_WINDOWS = (7, 30, 90, 365)
+CHANGE_LAGS = (1, 7, 30, 90, 365)
+# Buckets kept per OHLC granularity
+OHLC_KEEP = {'daily': 90, 'weekly': 104, 'monthly': 60}
+# Records needed to recompute the rolling statistics
+STATS_TAIL = max(RANGE_WINDOWS + CHANGE_LAGS) + 1
+
+
+def _period_keys(date_str):
+    date = datetime.date.fromisoformat(date_str[:10])
+    week = date - datetime.timedelta(days=date.weekday())
+    return {'daily': date.isoformat(), 'weekly': week.isoformat(), 'monthly': date_str[:7]}
+
+
+def build_ohlc(dates, values):
+    """Vectorized OHLC for every granularity from date-sorted records.
+    Returns {granularity: [[period, open, high, low, close], ...]}.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return {g: [] for g in OHLC_KEEP}
+    keys = [_period_keys(d) for d in dates]
+    out = {}
+    for g in OHLC_KEEP:
+        period = np.array([k[g] for k in keys])
+        starts = np.concatenate(([0], np.flatnonzero(period[1:] != period[:-1]) + 1))
+        ends = np.concatenate((starts[1:], [len(values)])) - 1
+        highs = np.maximum.reduceat(values, starts)
+        lows = np.minimum.reduceat(values, starts)
+        out[g] = [[str(p), int(o), int(h), int(lo), int(c)]
+                  for p, o, h, lo, c in zip(period[starts], values[starts], highs, lows, values[ends])]
+        out[g] = out[g][-OHLC_KEEP[g]:]
+    return out
+
+
+def merge_ohlc(ohlc, dates, values):
+    """Recomputes the newest bucket of each granularity from the records in
+    it and appends it when it is a new period. `dates`/`values` are the
+    date-sorted tail of the history and must cover the newest month. Older
+    buckets are never touched, and a same-day record that replaced an
+    earlier one leaves no trace of the replaced price.
+    """
+    newest = _period_keys(dates[-1])
+    for g, keep in OHLC_KEEP.items():
+        period = []
+        for date_str, value in zip(reversed(dates), reversed(values)):
+            if _period_keys(date_str)[g] != newest[g]:
+                break
+            period.append(value)
+        period.reverse()
+        bucket = [newest[g], period[0], max(period), min(period), period[-1]]
+        buckets = ohlc.setdefault(g, [])
+        if buckets and buckets[-1][0] == newest[g]:
+            buckets[-1] = bucket
+        elif not buckets or buckets[-1][0] < newest[g]:
+            buckets.append(bucket)
+            del buckets[:-keep]
+    return ohlc
+
+
+def rebuild_start(date_str):
+    """First date the oldest kept monthly bucket can start on."""
+    year, month = int(date_str[:4]), int(date_str[5:7])
+    months = year * 12 + month - 1 - (OHLC_KEEP['monthly'] - 1)
+    return f"{months // 12:04d}-{months % 12 + 1:02d}-01"
+
+
+def rolling_stats(values):
+    """Moving averages, ranges and changes from the newest `STATS_TAIL` values."""
+    v = np.asarray(values, dtype=np.float64)
+    last = float(v[-1])
+    stats = {'last': int(v[-1]), 'ma': {}, 'range': {}, 'change': {}}
+    # Cumulative sums give every trailing mean in O(1) each
+    csum = np.concatenate(([0.0], np.cumsum(v)))
+    for w in MA_WINDOWS:
+        n = min(w, len(v))
+        stats['ma'][str(w)] = round(float((csum[-1] - csum[-1 - n]) / n), 2)
+    for w in RANGE_WINDOWS:
+        window = v[-w:]
+        stats['range'][f"{w}d"] = {'min': int(window.min()), 'max': int(window.max())}
+    for lag in CHANGE_LAGS:
+        if len(v) <= lag:
+            continue
+        prev = float(v[-1 - lag])
+        stats['change'][f"{lag}d"] = {
+            'abs': int(last - prev),
+            'pct': round((last - prev) / prev * 100, 2) if prev else 0.0,
+        }
+    return stats
+
+
+def load_summary(path=SUMMARY_FILE):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def update_summary(log, path=SUMMARY_FILE, archive=None):
+    """Refreshes public/summary.json after the newest record was written.
+
+    The newest OHLC buckets are recomputed from the tail; the rolling
+    statistics only need the last STATS_TAIL records. A missing or unreadable
+    summary is rebuilt from the archive and hot log, reading only the years
+    the kept buckets span. Returns True if rebuilt fully.
+    """
+    tail = log.tail(STATS_TAIL)
+    if not tail:
+        return False
+    newest = tail[-1]
+    summary = load_summary(path)
+    # Incremental merge is only valid if the summary already covers everything
+    # up to the newest record (same day re-run) or the record before it.
+    covered = {str(r.get('date', ''))[:10] for r in tail[-2:]}
+    rebuilt = summary is None or summary.get('v') != 1 or str(summary.get('asOf'))[:10] not in covered
+
+    if rebuilt:
+        records = list(query_range(rebuild_start(str(newest.get('date', ''))), '9999-12-31', log=log, archive=archive))
+        dates = [str(r.get('date', '')) for r in records]
+        summary = {'v': 1, 'metals': {}}
+        for key in METAL_KEYS:
+            summary['metals'][key] = {'ohlc': build_ohlc(dates, [r.get(key) or 0 for r in records])}
+    else:
+        dates = [str(r.get('date', '')) for r in tail]
+        for key in METAL_KEYS:
+            metal = summary['metals'].setdefault(key, {'ohlc': {}})
+            merge_ohlc(metal['ohlc'], dates, [int(r.get(key) or 0) for r in tail])
+
+    for key in METAL_KEYS:
+        summary['metals'][key].update(rolling_stats([r.get(key) or 0 for r in tail]))
+    summary['asOf'] = str(newest.get('date', ''))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(summary, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    return rebuilt
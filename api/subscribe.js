@@ -5,6 +5,33 @@
  */
 
 import { put, list } from '@vercel/blob'; // Fixed: Removed 'get'
+import { createHash } from 'crypto';
+
+// Optional per-metal alert preferences, mirrored by normalize_prefs() in
+// targeting.py: {"gold": {"abs": 500}, "silver": {"pct": 1.5}, "tejabi": {}}.
+// Listed metals only; a move qualifies when it reaches either threshold;
+// an empty object means any change. Returns undefined for "no preferences"
+// and null for an invalid value.
+const METALS = ['gold', 'tejabi', 'silver'];
+const LIMITS = { abs: 1000000, pct: 100 };
+
+function normalizePrefs(prefs) {
+  if (prefs === undefined || prefs === null) return undefined;
+  if (typeof prefs !== 'object' || Array.isArray(prefs)) return null;
+  const result = {};
+  for (const [metal, rule] of Object.entries(prefs)) {
+    if (!METALS.includes(metal) || !rule || typeof rule !== 'object' || Array.isArray(rule)) return null;
+    const clean = {};
+    for (const [key, limit] of Object.entries(LIMITS)) {
+      if (rule[key] === undefined) continue;
+      const value = rule[key];
+      if (typeof value !== 'number' || !Number.isFinite(value) || value < 0 || value > limit) return null;
+      clean[key] = value;
+    }
+    result[metal] = clean;
+  }
+  return Object.keys(result).length ? result : undefined;
+}
 
 export default async function handler(req, res) {
   if (req.method !== 'POST') {
@@ -24,6 +51,16 @@ export default async function handler(req, res) {
       return res.status(400).json({ error: 'Invalid subscription payload' });
     }
 
+    const prefs = normalizePrefs(subscription.prefs);
+    if (prefs === null) {
+      return res.status(400).json({ error: 'Invalid notification preferences' });
+    }
+    if (prefs) {
+      subscription.prefs = prefs;
+    } else {
+      delete subscription.prefs;
+    }
+
     const { endpoint, keys } = subscription;
     if (!endpoint || typeof endpoint !== 'string' || !endpoint.startsWith('https://')) {
       return res.status(400).json({ error: 'Invalid or missing push endpoint' });
@@ -38,16 +75,33 @@ export default async function handler(req, res) {
       return res.status(400).json({ error: 'Subscription payload too large' });
     }
 
-    const BLOB_PATH = 'subscriptions/data.json';
+    // Sharded layout shared with subscription_store.py: a subscriber lives in
+    // the shard picked by the first 32 bits of sha256(endpoint).
+    const MANIFEST_PATH = 'subscriptions/manifest.json';
+    const SHARD_COUNT = 16;
+    const shardPath = (i) => `subscriptions/shards/${String(i).padStart(3, '0')}.json`;
+
+    let manifest = null;
     let subscriptions = [];
+    let shardIndex = 0;
 
-    // 1. Try to fetch existing subscriptions from Blob
+    // 1. Fetch the manifest and this endpoint's shard from Blob
     try {
-      const { blobs } = await list({ prefix: 'subscriptions/' }); // Adjusted prefix to be more general
-      const existingBlob = blobs.find(b => b.pathname === BLOB_PATH);
-      
-      if (existingBlob) {
-        const response = await fetch(existingBlob.url);
+      const { blobs } = await list({ prefix: 'subscriptions/' });
+      const urls = Object.fromEntries(blobs.map(b => [b.pathname, b.url]));
+
+      if (urls[MANIFEST_PATH]) {
+        const response = await fetch(urls[MANIFEST_PATH]);
+        if (response.ok) {
+          manifest = await response.json();
+        }
+      }
+      const shardCount = (manifest && manifest.shards) || SHARD_COUNT;
+      const hash = createHash('sha256').update(endpoint).digest('hex');
+      shardIndex = parseInt(hash.slice(0, 8), 16) % shardCount;
+
+      if (urls[shardPath(shardIndex)]) {
+        const response = await fetch(urls[shardPath(shardIndex)]);
         if (response.ok) {
            subscriptions = await response.json();
         }
@@ -78,32 +132,64 @@ export default async function handler(req, res) {
     });
     
     // 3. Check if this new subscription already exists
-    const exists = cleanedSubscriptions.some(s => s.endpoint === subscription.endpoint);
+    const existing = cleanedSubscriptions.find(s => s.endpoint === subscription.endpoint);
+    const exists = Boolean(existing);
+    const counts = (manifest && Array.isArray(manifest.counts)) ? [...manifest.counts] : [];
+    const total = counts.reduce((sum, n, i) => sum + (i === shardIndex ? 0 : n), 0) + cleanedSubscriptions.length;
     
     if (!exists) {
       // Security: Limit total subscriptions to prevent storage exhaustion
-      if (cleanedSubscriptions.length >= 10000) {
+      if (total >= 10000) {
         return res.status(400).json({ error: 'Subscription limit reached' });
       }
 
       cleanedSubscriptions.push(subscription);
-      console.log('Subscription added. Total:', cleanedSubscriptions.length);
+      console.log('Subscription added. Total:', total + 1);
     } else {
+      // Re-subscribing is how a device changes its preferences
+      if (prefs) {
+        existing.prefs = prefs;
+      } else {
+        delete existing.prefs;
+      }
       console.log('Subscription already exists.');
     }
     
-    // 4. Save cleaned list back to Vercel Blob (always save to persist cleanup)
-    await put(BLOB_PATH, JSON.stringify(cleanedSubscriptions, null, 2), {
+    // 4. Save the cleaned shard and manifest back to Vercel Blob (always save to persist cleanup)
+    const blobOptions = {
       access: 'public',
       contentType: 'application/json',
       addRandomSuffix: false, // Keep the filename consistent
       allowOverwrite: true    // Allow overwriting the existing file to "append" data
-    });
+    };
+    await put(shardPath(shardIndex), JSON.stringify(cleanedSubscriptions), blobOptions);
+
+    const shardCount = (manifest && manifest.shards) || SHARD_COUNT;
+    while (counts.length < shardCount) counts.push(0);
+    counts[shardIndex] = cleanedSubscriptions.length;
+    // The broadcast's threshold summary for this shard is stale now (it may
+    // skip shards by it): clear it and bump the shard's version so a run that
+    // is in progress does not write back the summary it worked out
+    const reach = (manifest && Array.isArray(manifest.reach)) ? [...manifest.reach] : [];
+    const versions = (manifest && Array.isArray(manifest.versions)) ? [...manifest.versions] : [];
+    while (reach.length < shardCount) reach.push(null);
+    while (versions.length < shardCount) versions.push(0);
+    reach[shardIndex] = null;
+    versions[shardIndex] += 1;
+    await put(MANIFEST_PATH, JSON.stringify({
+      ...(manifest || {}),
+      version: 1,
+      shards: shardCount,
+      counts,
+      reach,
+      versions,
+      updated: Math.floor(Date.now() / 1000)
+    }), blobOptions);
     
     return res.status(200).json({ 
       success: true, 
       message: 'Subscription synchronized',
-      count: cleanedSubscriptions.length,
+      count: counts.reduce((sum, n) => sum + n, 0),
       cleaned: subscriptions.length !== cleanedSubscriptions.length
     });
   } catch (error) {
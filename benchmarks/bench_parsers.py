@@ -0,0 +1,76 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+"""Compares the streaming HTML extractor with the BeautifulSoup path.
+
+Usage: python benchmarks/bench_parsers.py [--repeat N] [--page FILE ...]
+
+Replays pages through both extractors, checks that they return identical
+candidates and prints per-call timings. Exits non-zero if the two paths
+disagree (tests/test_parsers.py holds the same check for CI).
+
+The bundled benchmarks/fixtures/ashesh_widget.html is synthetic. To measure
+the real markup, save the live widget page (scraper.ASHESH_WIDGET) and pass
+it with --page; every --page file is attributed to the widget URL.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scraper  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# (fixture, URL the page is attributed to)
+PAGES = [
+    ('ashesh_widget.html', 'https://www.ashesh.com.np/gold/widget.php?api=521224q192'),
+]
+
+
+def bench_page(path, url, repeat):
+    name = os.path.basename(path)
+    with open(path, encoding='utf-8') as f:
+        raw_html = scraper.preprocess_html(f.read())
+
+    fast = scraper.extract_candidates_fast(raw_html, url)
+    soup = scraper.extract_candidates_soup(raw_html, url)
+
+    fast_s = min(timeit.repeat(lambda: scraper.extract_candidates_fast(raw_html, url), number=repeat, repeat=3)) / repeat
+    soup_s = min(timeit.repeat(lambda: scraper.extract_candidates_soup(raw_html, url), number=repeat, repeat=3)) / repeat
+    return {
+        'page': name,
+        'bytes': len(raw_html),
+        'fast_ms': fast_s * 1000,
+        'soup_ms': soup_s * 1000,
+        'speedup': soup_s / fast_s if fast_s else 0,
+        'match': fast == soup,
+        'candidates': fast,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--page', action='append', default=[],
+                        help="captured Ashesh widget page to replay instead of the bundled fixture (repeatable)")
+    args = parser.parse_args()
+    pages = ([(path, scraper.ASHESH_WIDGET) for path in args.page]
+             or [(os.path.join(FIXTURES, name), url) for name, url in PAGES])
+
+    ok = True
+    for path, url in pages:
+        r = bench_page(path, url, args.repeat)
+        ok = ok and r['match']
+        print(f"{r['page']:<22} {r['bytes']:>7} B  fast {r['fast_ms']:7.3f} ms  "
+              f"soup {r['soup_ms']:7.3f} ms  x{r['speedup']:.1f}  "
+              f"{'MATCH' if r['match'] else 'MISMATCH'}  {r['candidates']}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+"""Push fan-out load test against local fake push services.
+
+Usage: python benchmarks/bench_push.py [--sizes 1000,10000] [--paths scraper,send_notifications,processes]
+                                       [--origins N] [--workers N] [--push-timeout S]
+                                       [--origin-rate R] [--retry-after S] [--processes N]
+                                       [--batch-size N]
+                                       [--no-memory] [--output FILE]
+                                       [fake service profile options, see --help]
+
+For every size and push path, seeds a local subscription store
+(SUBSCRIPTION_STORE_DIR) with synthetic subscriptions spread over `--origins`
+fake push services, runs the real send path with a throwaway VAPID key and
+reports sends/second, the tracemalloc peak (a second, traced run) and whether
+the stored failureCount values after the run match what the services'
+deterministic per-endpoint outcomes imply. Exits non-zero on any mismatch.
+"""
+
+import argparse
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+from fake_push import FakePushService, add_profile_args, generate_subscriptions, outcome_for, profile_rates  # noqa: E402
+
+PATHS = ('scraper', 'send_notifications', 'processes')
+
+
+def configure(scratch, args):
+    """Environment read by the push modules at import time."""
+    from py_vapid import Vapid02
+    vapid = Vapid02()
+    vapid.generate_keys()
+    os.environ['VAPID_PRIVATE_KEY'] = vapid.private_pem().decode('ascii')
+    os.environ['SUBSCRIPTION_STORE_DIR'] = os.path.join(scratch, 'store')
+    os.environ['PUSH_WORKERS'] = str(args.workers)
+    os.environ['PUSH_TIMEOUT'] = str(args.push_timeout)
+    os.environ['PUSH_ORIGIN_RATE'] = str(args.origin_rate)
+    if args.batch_size:
+        os.environ['PUSH_BATCH_SIZE'] = str(args.batch_size)
+    os.environ['HTTP_POOL_SIZE'] = str(max(32, args.workers))
+    os.environ.pop('BLOB_READ_WRITE_TOKEN', None)
+
+
+def expected_state(subscriptions, rates, threshold):
+    """endpoint -> failureCount after one send, or None if it should be pruned."""
+    expected = {}
+    for sub in subscriptions:
+        # Throttled endpoints are requeued after Retry-After and then delivered
+        if outcome_for(sub['endpoint'], rates) in ('ok', 'throttle'):
+            expected[sub['endpoint']] = 0
+            continue
+        count = sub.get('failureCount', 0) + 1
+        expected[sub['endpoint']] = count if count < threshold else None
+    return expected
+
+
+def check_pruning(store, expected):
+    stored = {sub['endpoint']: sub.get('failureCount', 0) for sub in store.load()}
+    report = {'kept': len(stored), 'expected_kept': sum(1 for v in expected.values() if v is not None),
+              'wrongly_removed': 0, 'wrongly_kept': 0, 'wrong_count': 0}
+    for endpoint, count in expected.items():
+        if count is None:
+            report['wrongly_kept'] += endpoint in stored
+        elif endpoint not in stored:
+            report['wrongly_removed'] += 1
+        elif stored[endpoint] != count:
+            report['wrong_count'] += 1
+    report['ok'] = not (report['wrongly_removed'] or report['wrongly_kept'] or report['wrong_count'])
+    return report
+
+
+def run_path(path, scratch, processes=4):
+    """Runs one push path end to end with its output silenced. 'processes' is
+    send_notifications with `processes` shards in a local process pool."""
+    if path == 'scraper':
+        import scraper
+        scraper.send_push_notification(316800, 313600, 4990, 100, 100, 5)
+    else:
+        # main() reads the last two records of the history log
+        log_dir = os.path.join(scratch, 'data')
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, 'history.ndjson'), 'w') as f:
+            for gold in (316700, 316800):
+                f.write(json.dumps({'date': '2026-01-01', 'gold': gold, 'tejabi': 313500, 'silver': 4985}) + '\n')
+        import send_notifications
+        cwd = os.getcwd()
+        os.chdir(scratch)
+        try:
+            if path == 'processes':
+                send_notifications.broadcast_processes(processes)
+            else:
+                send_notifications.broadcast()
+        finally:
+            os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def silenced_fd(fd):
+    """Points `fd` at /dev/null, so spawned worker processes are quiet too."""
+    sys.stdout.flush()
+    saved = os.dup(fd)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, fd)
+        yield
+    finally:
+        os.dup2(saved, fd)
+        os.close(devnull)
+        os.close(saved)
+
+
+def measure(path, subscriptions, services, scratch, traced, processes=4):
+    from subscription_store import SHARD_COUNT, LocalBackend, SubscriptionStore, split_count
+    store_dir = os.environ['SUBSCRIPTION_STORE_DIR']
+    shutil.rmtree(store_dir, ignore_errors=True)
+    # Seed at the split shard count, so the run measures the steady state rather than a one-off split
+    shards = split_count(SHARD_COUNT, [-(-len(subscriptions) // SHARD_COUNT)])
+    SubscriptionStore(LocalBackend(store_dir), shard_count=shards).save(copy.deepcopy(subscriptions))
+    for service in services:
+        service.reset()
+
+    if traced:
+        tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()), silenced_fd(1):
+        start = time.perf_counter()
+        run_path(path, scratch, processes)
+        elapsed = time.perf_counter() - start
+    peak = None
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, SubscriptionStore(LocalBackend(store_dir))
+
+
+def merge_statuses(counters):
+    total = {}
+    for counter in counters:
+        for status, count in counter.items():
+            total[str(status)] = total.get(str(status), 0) + count
+    return dict(sorted(total.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000', help="subscriber counts (default 1000,10000)")
+    parser.add_argument('--paths', default=','.join(PATHS), help="push paths to run")
+    parser.add_argument('--origins', type=int, default=2, help="number of fake push services")
+    parser.add_argument('--workers', type=int, default=16, help="PUSH_WORKERS for the run")
+    parser.add_argument('--push-timeout', type=float, default=1.0, help="PUSH_TIMEOUT for the run")
+    parser.add_argument('--origin-rate', type=float, default=0, help="PUSH_ORIGIN_RATE for the run (0: unlimited)")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds on throttled requests")
+    parser.add_argument('--batch-size', type=int, help="PUSH_BATCH_SIZE for the run")
+    parser.add_argument('--processes', type=int, default=4, help="shards for the 'processes' path (default 4)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    parser.add_argument('--output', help="results file (default benchmarks/results/push-<UTC time>.json)")
+    add_profile_args(parser)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    paths = [p for p in args.paths.split(',') if p in PATHS]
+    if args.hang <= args.push_timeout:
+        parser.error("--hang must exceed --push-timeout for hanging endpoints to time out")
+
+    scratch = tempfile.mkdtemp(prefix='goldview-push-')
+    configure(scratch, args)
+    from push_engine import FAILURE_THRESHOLD
+
+    rates = profile_rates(args)
+    services = [FakePushService(rates, args.latency, args.jitter, args.hang, args.retry_after).start() for _ in range(args.origins)]
+    results = {}
+    ok = True
+    try:
+        for n in sizes:
+            subscriptions = generate_subscriptions(n, [s.url for s in services])
+            expected = expected_state(subscriptions, rates, FAILURE_THRESHOLD)
+            for path in paths:
+                elapsed, _, store = measure(path, subscriptions, services, scratch, traced=False, processes=args.processes)
+                statuses = merge_statuses(s.statuses for s in services)
+                duplicates = sum(1 for s in services for count in s.deliveries.values() if count > 1)
+                pruning = check_pruning(store, expected)
+                result = {
+                    'subscriptions': n,
+                    'elapsed_s': round(elapsed, 3),
+                    'sends_per_s': round(n / elapsed, 1) if elapsed else None,
+                    'statuses': statuses,
+                    'duplicate_deliveries': duplicates,
+                    'pruning': pruning,
+                }
+                if not args.no_memory:
+                    _, peak, _ = measure(path, subscriptions, services, scratch, traced=True, processes=args.processes)
+                    result['peak_mb'] = round(peak / 2 ** 20, 2)
+                ok = ok and pruning['ok'] and not duplicates
+                results[f"{path}.{n}"] = result
+                print(f"{path:<19} {n:>7} subs  {result['elapsed_s']:8.2f} s  {result['sends_per_s']:>8} sends/s  "
+                      f"peak {result.get('peak_mb', '-')} MB  statuses {statuses}  "
+                      f"pruning {'OK' if pruning['ok'] else 'MISMATCH'} ({pruning['kept']} kept)")
+    finally:
+        for service in services:
+            service.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    output = args.output or os.path.join(RESULTS_DIR, 'push-' + now.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {'time': now.isoformat(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'args': vars(args)},
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+"""Offline benchmarks for the scrape pipeline.
+
+Usage: python benchmarks/bench_update.py [--repeat N] [--sizes 1000,10000,...]
+                                         [--legacy-max N] [--output FILE]
+                                         [--compare FILE]
+
+Serves the FENEGOSIDA, Ashesh widget, NRB and Yahoo responses in
+benchmarks/fixtures from a local HTTP stand-in (with ETags, so the
+conditional-GET cache gets 304s on warm runs), points the scraper's source
+URLs at it and times the stages below. The fixtures are synthetic, written
+to the structure the scraper's parsers expect from each source, not
+captured responses: timings show relative costs, and parsing timings only
+carry over to production to the extent real pages look like them. Replace
+a fixture with a capture under the same name to measure the real markup.
+
+  parse.*      get_all_candidates() against the Ashesh widget
+  nrb.*        NRB payload processing, and fetch_nrb_currencies() cold/warm
+  backfill     backfill_currencies() over the update() tail
+  history.N.*  log tail/append/replace/compact for N records, the history
+               index (build + snapshot, mmap open, month range, latest 2,
+               weekly resample), and the old full data.json read + rewrite
+               and month scan (up to --legacy-max records)
+  update.*     a full update() in a scratch directory, cold and warm cache,
+               and the source requests one warm update() makes
+
+Results are written as JSON (default benchmarks/results/<UTC time>.json).
+--compare prints each timing against an earlier results file.
+"""
+
+import argparse
+import calendar
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+# Everything the pipeline writes goes to a scratch directory; the response
+# cache location and push credentials are read when the modules are imported.
+SCRATCH = tempfile.mkdtemp(prefix='goldview-bench-')
+CACHE_DIR = os.path.join(SCRATCH, 'cache')
+os.environ['HTTP_CACHE_DIR'] = CACHE_DIR
+for var in ('VAPID_PRIVATE_KEY', 'BLOB_READ_WRITE_TOKEN', 'SUBSCRIPTION_STORE_DIR'):
+    os.environ.pop(var, None)
+
+import scraper  # noqa: E402
+from history_index import HistoryIndex  # noqa: E402
+from history_log import HistoryLog  # noqa: E402
+
+# path on the stand-in -> (fixture, content type). The Ashesh path keeps
+# "ashesh.com.np" in the URL so the widget row matcher still applies.
+ROUTES = {
+    '/api/website/v1/Dashboard/today': ('fenegosida_today.json', 'application/json'),
+    '/ashesh.com.np/gold/widget.php': ('ashesh_widget.html', 'text/html; charset=utf-8'),
+    '/api/forex/v1/app-rate': ('nrb_app_rate.json', 'application/json'),
+    '/api/forex/v1/rates': ('nrb_rates.json', 'application/json'),
+    '/v8/finance/chart/USDNPR=X': ('yahoo_usdnpr.json', 'application/json'),
+}
+
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    bodies = {}
+    requests = 0
+
+    def do_GET(self):
+        FixtureHandler.requests += 1
+        route = ROUTES.get(self.path.split('?', 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        name, content_type = route
+        if name not in self.bodies:
+            with open(os.path.join(FIXTURES, name), 'rb') as f:
+                body = f.read()
+            self.bodies[name] = (body, '"%s"' % hashlib.sha256(body).hexdigest()[:16])
+        body, etag = self.bodies[name]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in():
+    """Starts the fixture server and points the scraper's source URLs at it."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    scraper.FENEGOSIDA_API = base + '/api/website/v1/Dashboard/today'
+    scraper.ASHESH_WIDGET = base + '/ashesh.com.np/gold/widget.php?api=521224q192'
+    scraper.NRB_APP_RATE = base + '/api/forex/v1/app-rate'
+    scraper.NRB_HISTORY = base + '/api/forex/v1/rates'
+    scraper.YAHOO_USD_CHART = base + '/v8/finance/chart/USDNPR=X'
+    return server
+
+
+def timed(fn, repeat, setup=None):
+    """Runs fn(setup()) `repeat` times with the pipeline's output silenced.
+    Returns {'min_ms', 'median_ms', 'runs'}; setup time is not counted."""
+    samples = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn(arg) if setup else fn()
+            samples.append((time.perf_counter() - start) * 1000)
+    return {'min_ms': round(min(samples), 4), 'median_ms': round(statistics.median(samples), 4), 'runs': repeat}
+
+
+def clear_cache():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def bench_sources(repeat):
+    results = {}
+    url = f"{scraper.ASHESH_WIDGET}&t=0"
+    results['parse.get_all_candidates'] = timed(lambda: scraper.get_all_candidates(url), repeat)
+
+    with open(os.path.join(FIXTURES, 'nrb_rates.json'), 'rb') as f:
+        payload = json.loads(f.read())['data']['payload']
+    results['nrb.parse_payload'] = timed(lambda: scraper.parse_nrb_history_payload(payload, {}), repeat)
+    results['nrb.fetch.cold'] = timed(lambda _: scraper.fetch_nrb_currencies(95), repeat, setup=clear_cache)
+    results['nrb.fetch.warm'] = timed(lambda: scraper.fetch_nrb_currencies(95), repeat)
+    return results
+
+
+def bench_backfill(repeat):
+    """backfill_currencies() over the real update() tail with its rates stripped."""
+    tail = HistoryLog(os.path.join(ROOT, 'data', 'history.ndjson')).tail(scraper.HISTORY_TAIL)
+    _, currency_history = scraper.fetch_nrb_currencies(95)
+    # Shift the fixture's NRB days onto the tail's dates so every entry matches
+    offset = (datetime.date.fromisoformat(tail[-1]['date'][:10]) - datetime.date.fromisoformat(max(currency_history))).days
+    shifted = {(datetime.date.fromisoformat(d) + datetime.timedelta(days=offset)).isoformat(): v
+               for d, v in currency_history.items()}
+
+    def setup():
+        return [{k: v for k, v in r.items() if k != 'currencies'} for r in tail]
+
+    result = timed(lambda history: scraper.backfill_currencies(history, shifted), repeat, setup=setup)
+    result['filled'] = scraper.backfill_currencies(setup(), shifted)
+    return {'backfill': result}
+
+
+def synthetic_log(path, n, template):
+    """Writes n records with ascending dates ending today."""
+    end = datetime.date.today()
+    span = min(n, 200000)  # ~550 years of days; larger logs repeat dates
+    with open(path, 'wb') as f:
+        for i in range(n):
+            day = end - datetime.timedelta(days=span - 1 - (i * span) // n)
+            record = dict(template, date=f"{day.isoformat()} {i % 24:02d}:00", gold=template['gold'] + i % 997)
+            f.write((json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+
+
+def bench_history(sizes, repeat, legacy_max):
+    template = HistoryLog(os.path.join(ROOT, 'data', 'history.ndjson')).last()
+    results = {}
+    for n in sizes:
+        work = os.path.join(SCRATCH, f"history-{n}")
+        os.makedirs(work, exist_ok=True)
+        log = HistoryLog(os.path.join(work, 'history.ndjson'))
+        synthetic_log(log.path, n, template)
+        snapshot = os.path.join(work, 'data.json')
+        key = f"history.{n}"
+        results[f"{key}.bytes"] = os.path.getsize(log.path)
+        results[f"{key}.tail"] = timed(lambda: log.tail(scraper.HISTORY_TAIL), repeat)
+        results[f"{key}.append_replace"] = timed(lambda: (log.append(template), log.replace_tail(1, [template])), repeat)
+
+        def drop_state():
+            if os.path.exists(log.state_path):
+                os.remove(log.state_path)
+        results[f"{key}.compact"] = timed(lambda _: log.compact(snapshot), repeat, setup=drop_state)
+        results[f"{key}.compact_unchanged"] = timed(lambda: log.compact(snapshot), repeat)
+
+        index_path = os.path.join(work, 'history.bin')
+        results[f"{key}.index_build"] = timed(lambda: HistoryIndex.from_records(log.iter_records()).save(index_path),
+                                              max(1, min(repeat, 3)))
+        results[f"{key}.index_open"] = timed(lambda: HistoryIndex.open_snapshot(index_path), repeat)
+        index = HistoryIndex.open_snapshot(index_path)
+        month = index.record(len(index) // 2)['date'][:7]
+        month_end = f"{month}-{calendar.monthrange(int(month[:4]), int(month[5:]))[1]:02d}"
+        results[f"{key}.index_range_month"] = timed(lambda: index.range(f"{month}-01", month_end), repeat)
+        results[f"{key}.index_latest2"] = timed(lambda: index.latest(2), repeat)
+        year_ago = index.record(max(0, len(index) - 365 * 5))['date'][:10]
+        results[f"{key}.index_resample_weekly"] = timed(lambda: index.resample('weekly', start=year_ago), repeat)
+        index = None
+
+        if n <= legacy_max:
+            # The pre-log pipeline: parse the whole data.json, rewrite the whole file
+            legacy = os.path.join(work, 'legacy.json')
+            with open(legacy, 'w') as f:
+                json.dump(list(log.iter_records()), f, indent=4)
+
+            def legacy_update():
+                with open(legacy, 'r') as f:
+                    history = json.load(f)
+                history[-1] = template
+                with open(legacy, 'w') as f:
+                    json.dump(history, f, indent=4)
+            results[f"{key}.legacy_read_rewrite"] = timed(legacy_update, max(1, min(repeat, 3)))
+
+            def legacy_range():
+                with open(legacy, 'r') as f:
+                    return [r for r in json.load(f) if f"{month}-01" <= r['date'][:10] <= month_end]
+            results[f"{key}.legacy_range_month"] = timed(legacy_range, max(1, min(repeat, 3)))
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def bench_update(repeat):
+    """Full update() against the stand-in, in a scratch copy of the repo data."""
+    work = os.path.join(SCRATCH, 'update')
+    os.makedirs(os.path.join(work, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(work, 'public'), exist_ok=True)
+    shutil.copy(os.path.join(ROOT, 'data', 'history.ndjson'), os.path.join(work, 'data', 'history.ndjson'))
+    shutil.copy(os.path.join(ROOT, 'public', 'data.json'), os.path.join(work, 'public', 'data.json'))
+
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        results = {'update.cold': timed(lambda _: scraper.update(), repeat, setup=clear_cache)}
+        before = FixtureHandler.requests
+        results['update.warm'] = timed(scraper.update, repeat)
+        results['update.requests'] = (FixtureHandler.requests - before) // repeat
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def compare(results, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = json.load(f)['results']
+    print(f"\n{'benchmark':<42} {'before':>11} {'after':>11} {'ratio':>7}")
+    for name, value in results.items():
+        old = previous.get(name)
+        if not isinstance(value, dict) or not isinstance(old, dict):
+            continue
+        ratio = value['min_ms'] / old['min_ms'] if old['min_ms'] else float('inf')
+        print(f"{name:<42} {old['min_ms']:>9.3f}ms {value['min_ms']:>9.3f}ms {ratio:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"history sizes (default {DEFAULT_SIZES})")
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help="largest history for the full data.json rewrite (it holds everything in memory)")
+    parser.add_argument('--output', help="results file (default benchmarks/results/<UTC time>.json)")
+    parser.add_argument('--compare', metavar='FILE', help="earlier results file to compare against")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    server = start_stand_in()
+    results = {}
+    try:
+        for stage in (lambda: bench_sources(args.repeat),
+                      lambda: bench_backfill(args.repeat),
+                      lambda: bench_history(sizes, args.repeat, args.legacy_max),
+                      lambda: bench_update(args.repeat)):
+            for name, value in stage().items():
+                results[name] = value
+                if isinstance(value, dict):
+                    print(f"{name:<42} min {value['min_ms']:10.3f} ms  median {value['median_ms']:10.3f} ms")
+                else:
+                    print(f"{name:<42} {value}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    output = args.output or os.path.join(RESULTS_DIR, now.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {'time': now.isoformat(), 'python': platform.python_version(),
+                     'platform': platform.platform(), 'repeat': args.repeat, 'sizes': sizes},
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
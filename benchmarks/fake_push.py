@@ -0,0 +1,223 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+"""Local Web Push service stand-in and synthetic subscription generator.
+
+Usage: python benchmarks/fake_push.py generate N --origin URL [--origin URL ...] [--out FILE]
+       python benchmarks/fake_push.py serve [--port P] [--latency MS] [--gone RATE] ...
+
+The service accepts encrypted Web Push POSTs on /push/<id> and answers each
+endpoint with a fixed outcome picked from its hash, so a run's expected
+pruning can be computed up front:
+
+  ok        201 after `latency` (+ up to `jitter`) ms
+  gone      410 (subscription expired)
+  notfound  404 (subscription never existed)
+  throttle  429 with Retry-After on the first request, 201 after that
+  timeout   holds the request `hang` seconds before answering
+"""
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+OUTCOMES = ('gone', 'notfound', 'throttle', 'timeout')
+
+
+def outcome_for(endpoint, rates):
+    """Deterministic outcome for an endpoint given {outcome: fraction}."""
+    point = int(hashlib.sha256(endpoint.encode('utf-8')).hexdigest()[:8], 16) / 2 ** 32
+    edge = 0.0
+    for outcome in OUTCOMES:
+        edge += rates.get(outcome, 0.0)
+        if point < edge:
+            return outcome
+    return 'ok'
+
+
+class PushServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # Clients give up on 'timeout' endpoints; the late write then fails
+        pass
+
+
+class PushHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        endpoint = service.url + self.path
+        outcome = outcome_for(endpoint, service.rates)
+        authorized = (self.headers.get('Authorization', '').startswith('vapid t=')
+                      and self.headers.get('Content-Encoding') == 'aes128gcm' and body)
+
+        time.sleep((service.latency + random.uniform(0, service.jitter)) / 1000.0)
+        if not authorized:
+            status = 400
+        elif outcome == 'gone':
+            status = 410
+        elif outcome == 'notfound':
+            status = 404
+        elif outcome == 'throttle' and service.first_attempt(endpoint):
+            status = 429
+        elif outcome == 'timeout':
+            time.sleep(service.hang)
+            status = 201
+        else:
+            status = 201
+        service.record(status, endpoint)
+
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', str(service.retry_after))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakePushService:
+    """Threaded fake push service on 127.0.0.1; one instance is one origin."""
+
+    def __init__(self, rates=None, latency=20.0, jitter=10.0, hang=5.0, retry_after=1, port=0):
+        self.rates = dict(rates or {})
+        self.latency = latency
+        self.jitter = jitter
+        self.hang = hang
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._throttled = set()
+        self.statuses = collections.Counter()
+        self.deliveries = collections.Counter()  # endpoint -> successful deliveries
+        self.server = PushServer(('127.0.0.1', port), PushHandler)
+        self.server.service = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def first_attempt(self, endpoint):
+        with self._lock:
+            if endpoint in self._throttled:
+                return False
+            self._throttled.add(endpoint)
+            return True
+
+    def record(self, status, endpoint):
+        with self._lock:
+            self.statuses[status] += 1
+            if status == 201:
+                self.deliveries[endpoint] += 1
+
+    def reset(self):
+        with self._lock:
+            self._throttled.clear()
+            self.statuses.clear()
+            self.deliveries.clear()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _b64url(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def key_pool(size, seed=0):
+    """`size` real P-256 receiver keys as (p256dh, auth). Encryption needs valid
+    points, but generating one per subscriber would dominate large runs."""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(size):
+        public = ec.generate_private_key(ec.SECP256R1()).public_key()
+        point = public.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+        pool.append((_b64url(point), _b64url(rng.getrandbits(128).to_bytes(16, 'big'))))
+    return pool
+
+
+def generate_subscriptions(n, origins, keys=64, failing=0.2, max_failures=5, seed=0):
+    """`n` subscriptions spread over `origins`. A `failing` fraction starts with
+    1..max_failures previous failures so threshold pruning is exercised."""
+    rng = random.Random(seed)
+    pool = key_pool(keys, seed)
+    subscriptions = []
+    for i in range(n):
+        p256dh, auth = pool[i % len(pool)]
+        sub = {
+            'endpoint': f"{origins[i % len(origins)]}/push/{i:08d}{rng.getrandbits(48):012x}",
+            'expirationTime': None,
+            'keys': {'p256dh': p256dh, 'auth': auth},
+        }
+        if rng.random() < failing:
+            sub['failureCount'] = rng.randint(1, max_failures)
+        subscriptions.append(sub)
+    return subscriptions
+
+
+def profile_rates(args):
+    return {'gone': args.gone, 'notfound': args.notfound, 'throttle': args.throttle, 'timeout': args.timeouts}
+
+
+def add_profile_args(parser):
+    parser.add_argument('--latency', type=float, default=20.0, help="base response latency in ms")
+    parser.add_argument('--jitter', type=float, default=10.0, help="extra random latency in ms")
+    parser.add_argument('--gone', type=float, default=0.02, help="fraction of endpoints answering 410")
+    parser.add_argument('--notfound', type=float, default=0.01, help="fraction of endpoints answering 404")
+    parser.add_argument('--throttle', type=float, default=0.01, help="fraction throttled (429) on first request")
+    parser.add_argument('--timeouts', type=float, default=0.005, help="fraction of endpoints that hang")
+    parser.add_argument('--hang', type=float, default=5.0, help="seconds a hanging endpoint holds the request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    gen = commands.add_parser('generate', help="write synthetic subscriptions as JSON")
+    gen.add_argument('count', type=int)
+    gen.add_argument('--origin', action='append', required=True, help="push service origin (repeatable)")
+    gen.add_argument('--keys', type=int, default=64, help="size of the receiver key pool")
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--out', default='-')
+    serve = commands.add_parser('serve', help="run the fake push service")
+    serve.add_argument('--port', type=int, default=8790)
+    add_profile_args(serve)
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        subs = generate_subscriptions(args.count, args.origin, keys=args.keys, seed=args.seed)
+        body = json.dumps(subs, separators=(',', ':'))
+        if args.out == '-':
+            print(body)
+        else:
+            with open(args.out, 'w') as f:
+                f.write(body)
+        return
+
+    service = FakePushService(profile_rates(args), args.latency, args.jitter, args.hang, port=args.port).start()
+    print(f"Fake push service on {service.url}/push/<id> (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(dict(service.statuses))
+    except KeyboardInterrupt:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
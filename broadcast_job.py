@@ -0,0 +1,161 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import hashlib
+import json
+import os
+import time
+
+from subscription_store import PREFIX, endpoint_hash
+
+# Progress of the current broadcast, stored next to the subscription shards:
+#   subscriptions/broadcast.json           header (broadcast-<i>of<n>.json for shard i of n)
+#     {"version", "job", "payloadHash", "created", "updated", "done", "segments"}
+#   subscriptions/broadcast/<seq>.json     append-only result segments (broadcast-<i>of<n>/...)
+#     {"job", "results": {"<endpoint hash[:16]>": [success, failureCount]}}
+# Each flush uploads only the results recorded since the previous one as the
+# next segment, then the small header, so a broadcast uploads O(subscribers)
+# bytes in total. Segment paths are reused by the next job; the header's
+# segment count says which ones belong to it. A run whose job ID matches an
+# unfinished header skips the endpoints recorded in its segments and reuses
+# their results, so failureCount updates survive a crash and nobody is
+# notified twice.
+CHECKPOINT_PATH = f"{PREFIX}broadcast.json"
+CHECKPOINT_EVERY = int(os.getenv('PUSH_CHECKPOINT_EVERY', '5000'))
+CHECKPOINT_INTERVAL = float(os.getenv('PUSH_CHECKPOINT_INTERVAL', '15'))
+
+
+def checkpoint_path(shard):
+    return f"{PREFIX}broadcast-{shard[0]}of{shard[1]}.json"
+
+
+def segment_path(header_path, seq):
+    return f"{header_path[:-len('.json')]}/{seq:05d}.json"
+
+
+def payload_hash(data):
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def job_id(key, data):
+    """Stable ID for one broadcast: what it is for (e.g. the price date) plus
+    the payload, so a rerun of the same alert resumes the same job."""
+    return f"{key}-{payload_hash(data)[:12]}"
+
+
+class BroadcastJob:
+    """Checkpointed progress of one push broadcast.
+
+    record() is called with each send result as fan_out() collects it and
+    flushes a checkpoint segment every CHECKPOINT_EVERY results or
+    CHECKPOINT_INTERVAL seconds. finish() marks the job done after the
+    subscriptions have been written back.
+    """
+
+    def __init__(self, backend, key, data, shard=None):
+        self.backend = backend
+        # Each shard of a sharded broadcast keeps its own checkpoint
+        self.path = CHECKPOINT_PATH if shard is None else checkpoint_path(shard)
+        self.id = job_id(key, data)
+        self.payload_hash = payload_hash(data)
+        self.done = False
+        self.created = int(time.time())
+        self.results = {}
+        self.resumed = 0
+        self.segments = 0
+        self._unsaved = {}
+        self._flushed_at = time.monotonic()
+
+        try:
+            body = backend.read(self.path)
+            checkpoint = json.loads(body) if body else None
+        except Exception as e:
+            print(f"WARNING: Could not read broadcast checkpoint: {e}")
+            checkpoint = None
+        if checkpoint and checkpoint.get('job') == self.id and checkpoint.get('payloadHash') == self.payload_hash:
+            self.done = bool(checkpoint.get('done'))
+            self.created = checkpoint.get('created', self.created)
+            self.segments = checkpoint.get('segments', 0)
+            if not self.done:
+                self._load_segments()
+            print(f"INFO: Resuming broadcast {self.id}: {len(self.results)} endpoint(s) already sent"
+                  f"{' (job finished)' if self.done else ''}")
+
+    def _load_segments(self):
+        for seq in range(self.segments):
+            try:
+                body = self.backend.read(segment_path(self.path, seq))
+                segment = json.loads(body) if body else None
+            except Exception as e:
+                print(f"WARNING: Could not read broadcast checkpoint segment {seq}: {e}")
+                segment = None
+            if not segment or segment.get('job') != self.id:
+                # Those endpoints are sent again rather than skipped
+                print(f"WARNING: Broadcast checkpoint segment {seq} is missing or stale")
+                continue
+            self.results.update((h, tuple(r)) for h, r in segment.get('results', {}).items())
+
+    @staticmethod
+    def _key(sub):
+        return endpoint_hash(sub.get('endpoint', ''))[:16]
+
+    def pending(self, subscriptions, indices):
+        """Splits `indices` into those still to send and a list of results
+        (aligned with `subscriptions`) recorded by the interrupted run."""
+        previous = [None] * len(subscriptions)
+        remaining = []
+        for i in indices:
+            result = self.results.get(self._key(subscriptions[i]))
+            if result is None:
+                remaining.append(i)
+            else:
+                previous[i] = (bool(result[0]), result[1])
+        self.resumed = len(indices) - len(remaining)
+        return remaining, previous
+
+    def record(self, sub, result):
+        key = self._key(sub)
+        self.results[key] = self._unsaved[key] = (bool(result[0]), result[1])
+        if len(self._unsaved) >= CHECKPOINT_EVERY or time.monotonic() - self._flushed_at >= CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def _write(self, path, value):
+        try:
+            return self.backend.write(path, json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        except Exception as e:
+            print(f"WARNING: Could not write broadcast checkpoint {path}: {e}")
+            return False
+
+    def flush(self):
+        """Writes the unsaved results as the next segment, then the header.
+        Failures are logged, never raised: losing a checkpoint only means a
+        crash would re-send. Results whose segment failed stay unsaved and
+        go into the next one."""
+        if self._unsaved:
+            segment = {'job': self.id, 'results': {h: [int(r[0]), r[1]] for h, r in self._unsaved.items()}}
+            if not self._write(segment_path(self.path, self.segments), segment):
+                self._flushed_at = time.monotonic()
+                return False
+            self.segments += 1
+            self._unsaved = {}
+        saved = self._write(self.path, {
+            'version': 2,
+            'job': self.id,
+            'payloadHash': self.payload_hash,
+            'created': self.created,
+            'updated': int(time.time()),
+            'done': self.done,
+            'segments': self.segments,
+        })
+        self._flushed_at = time.monotonic()
+        return saved
+
+    def finish(self):
+        self.done = True
+        return self.flush()
+
+
+def merge_results(results, previous):
+    """fan_out() results with the resumed ones filled in."""
+    return [prev if result is None else result for result, prev in zip(results, previous)]
@@ -0,0 +1,134 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import datetime
+import json
+import os
+
+import numpy as np
+
+# Chart ranges as the frontend slices them: the last N records
+RANGES = (('7d', 7), ('1m', 30), ('3m', 90), ('1y', 365))
+RANGES_DIR = 'public/ranges'
+
+METAL_KEYS = ('gold', 'tejabi', 'silver')
+# Rates are stored as integer paisa so they can be delta-encoded exactly
+RATE_SCALE = 100
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def delta_encode(values, present=None):
+    """First value absolute, then differences to the previous present value.
+    Missing positions (present == False) become null.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if present is None:
+        present = np.ones(len(values), dtype=bool)
+    out = [None] * len(values)
+    idx = np.flatnonzero(present)
+    if len(idx):
+        kept = values[idx]
+        deltas = np.empty_like(kept)
+        deltas[0] = kept[0]
+        deltas[1:] = np.diff(kept)
+        for i, d in zip(idx.tolist(), deltas.tolist()):
+            out[i] = d
+    return out
+
+
+def build_columns(records, currencies):
+    """Converts row-oriented history records into parallel NumPy columns in one pass."""
+    n = len(records)
+    day = np.zeros(n, dtype=np.int64)
+    metals = {key: np.zeros(n, dtype=np.int64) for key in METAL_KEYS}
+    usd = np.zeros(n, dtype=np.float64)
+    fx = {code: {'buy': np.zeros(n), 'sell': np.zeros(n), 'present': np.zeros(n, dtype=bool), 'unit': 1}
+          for code in currencies}
+
+    for i, r in enumerate(records):
+        date = datetime.date.fromisoformat(str(r.get('date', ''))[:10])
+        day[i] = (date - _EPOCH).days
+        for key in METAL_KEYS:
+            metals[key][i] = r.get(key) or 0
+        usd[i] = r.get('usd') or 0
+        for c in r.get('currencies') or ():
+            col = fx.get(c.get('code'))
+            if col is None:
+                continue
+            col['buy'][i] = c.get('buy') or 0
+            col['sell'][i] = c.get('sell') or 0
+            col['present'][i] = True
+            col['unit'] = c.get('unit') or 1
+
+    return {
+        'day': day,
+        'metals': metals,
+        'usd': np.rint(usd * RATE_SCALE).astype(np.int64),
+        'usd_present': usd > 0,
+        'fx': {code: {'unit': col['unit'],
+                      'buy': np.rint(col['buy'] * RATE_SCALE).astype(np.int64),
+                      'sell': np.rint(col['sell'] * RATE_SCALE).astype(np.int64),
+                      'present': col['present']}
+               for code, col in fx.items()},
+    }
+
+
+def build_range_payloads(records, currencies):
+    """Returns {range name: columnar payload} for every entry in RANGES.
+
+    Payload layout (all integer arrays delta-encoded, null = missing):
+      day            days since 1970-01-01
+      gold/tejabi/silver   price per tola in NPR
+      usd            NPR per USD x RATE_SCALE
+      fx[code]       {unit, buy, sell}, NPR per `unit` x RATE_SCALE
+    """
+    longest = max(size for _, size in RANGES)
+    records = records[-longest:]
+    cols = build_columns(records, currencies)
+
+    payloads = {}
+    for name, size in RANGES:
+        s = slice(max(0, len(records) - size), None)
+        payload = {
+            'v': 1,
+            'range': name,
+            'n': len(records[s]),
+            'scale': RATE_SCALE,
+            'day': delta_encode(cols['day'][s]),
+        }
+        for key in METAL_KEYS:
+            payload[key] = delta_encode(cols['metals'][key][s])
+        payload['usd'] = delta_encode(cols['usd'][s], cols['usd_present'][s])
+        payload['fx'] = {}
+        for code, col in cols['fx'].items():
+            present = col['present'][s]
+            if not present.any():
+                continue
+            payload['fx'][code] = {
+                'unit': col['unit'],
+                'buy': delta_encode(col['buy'][s], present),
+                'sell': delta_encode(col['sell'][s], present),
+            }
+        payloads[name] = payload
+    return payloads
+
+
+def write_range_files(records, currencies, out_dir=RANGES_DIR):
+    """Writes public/ranges/<range>.json, skipping files whose contents are unchanged.
+    Returns the number of files written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    for name, payload in build_range_payloads(records, currencies).items():
+        body = json.dumps(payload, separators=(',', ':'))
+        path = os.path.join(out_dir, f"{name}.json")
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                if f.read() == body:
+                    continue
+        with open(path, 'w') as f:
+            f.write(body)
+        written += 1
+    return written
@@ -0,0 +1,154 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import os
+import statistics
+import time
+
+import metrics
+
+# Lazy source consensus for update(): sources are tried in priority order,
+# in waves, and a quantity (gold, silver, usd, ...) is settled as soon as
+# SOURCE_QUORUM of its sources agree within TOLERANCE. The first wave holds
+# just enough sources to reach every quorum; later waves add the next
+# untried sources only for quantities that are still unsettled because a
+# source failed, disagreed or reported an outlier. Sources nothing needed
+# are never fetched.
+#
+# Outliers are judged against the recent history of the quantity: a value
+# whose move from the last record is further from the median daily move
+# than OUTLIER_K robust standard deviations (1.4826 * MAD), and at least
+# OUTLIER_FLOOR of the price, does not count alone. Sources that agree on
+# it still settle it (the market really moved).
+SOURCE_QUORUM = int(os.getenv('SOURCE_QUORUM', '2'))
+TOLERANCE = {'usd': 0.02}
+DEFAULT_TOLERANCE = 0.05
+OUTLIER_WINDOW = 30
+OUTLIER_MIN_HISTORY = 5
+OUTLIER_K = 8.0
+OUTLIER_FLOOR = 0.10
+MAD_SCALE = 1.4826
+
+
+class Source:
+    """One upstream source: fetch with fn(*args) (`default` when it fails),
+    then read(result) -> {quantity: value} for the quantities it `provides`;
+    a missing or non-positive value means "no answer"."""
+
+    def __init__(self, name, fn, args, default, provides, read):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.default = default
+        self.provides = tuple(provides)
+        self.read = read
+
+
+def is_outlier(value, recent):
+    """True if `value` is implausibly far from the recent non-zero values."""
+    recent = [v for v in recent if v and v > 0][-(OUTLIER_WINDOW + 1):]
+    if len(recent) < OUTLIER_MIN_HISTORY:
+        return False
+    changes = [b - a for a, b in zip(recent, recent[1:])]
+    centre = statistics.median(changes)
+    mad = statistics.median([abs(c - centre) for c in changes])
+    band = max(OUTLIER_K * MAD_SCALE * mad, OUTLIER_FLOOR * recent[-1])
+    return abs(value - recent[-1] - centre) > band
+
+
+def vote(candidates, quorum, tolerance, recent=()):
+    """Picks a value from [(source, value), ...] given in priority order.
+
+    Returns (value, source, verified). verified means at least `quorum`
+    sources agree with the chosen value within `tolerance`; the value is
+    then the highest-priority one of them. Otherwise the highest-priority
+    non-outlier value is returned unverified, or (0, None, False).
+    """
+    outliers = {name for name, value in candidates if is_outlier(value, recent)}
+    for name, value in candidates:
+        agreeing = [n for n, v in candidates if abs(v - value) <= tolerance * value]
+        if len(agreeing) >= quorum and (name not in outliers or len(agreeing) >= 2):
+            return value, name, True
+    for name, value in candidates:
+        if name not in outliers:
+            return value, name, False
+    return 0, None, False
+
+
+def resolve(sources, quantities, history, fetch, quorum=None, required=(), deadline=None):
+    """Fetches `sources` lazily until every quantity is settled.
+
+    `sources` are Source objects in priority order; `required` names sources
+    to fetch in the first wave regardless (e.g. for data that is not voted
+    on). `fetch(jobs, deadline)` runs one wave, as scraper.fetch_sources().
+    `history` is a list of recent records used for the outlier check, and
+    the whole resolution shares one `deadline` in seconds (default: none).
+
+    Returns ({quantity: (value, source, verified)}, {source: result}); a
+    source that was not needed reports its default.
+    """
+    quorum = SOURCE_QUORUM if quorum is None else quorum
+    end = None if deadline is None else time.monotonic() + deadline
+    order = {source.name: i for i, source in enumerate(sources)}
+    by_name = {source.name: source for source in sources}
+    providers = {q: [s.name for s in sources if q in s.provides] for q in quantities}
+    # A quantity with fewer sources than the quorum needs all of them
+    needed = {q: max(1, min(quorum, len(providers[q]))) for q in quantities}
+    recent = {q: [record.get(q) or 0 for record in history] for q in quantities}
+    candidates = {q: [] for q in quantities}
+    fetched = {}
+    decisions = {}
+
+    with metrics.span('consensus', quorum=quorum) as span:
+        wave = set(required)
+        for q in quantities:
+            wave.update(providers[q][:needed[q]])
+        waves = 0
+        while wave:
+            names = sorted(wave, key=order.get)
+            waves += 1
+            print(f"DEBUG: Consensus wave {waves}: {', '.join(names)}")
+            remaining = None if end is None else max(0.0, end - time.monotonic())
+            results = fetch({n: (by_name[n].fn, by_name[n].args, by_name[n].default) for n in names}, remaining)
+            for name in names:
+                fetched[name] = results[name]
+                try:
+                    values = by_name[name].read(results[name]) or {}
+                except Exception as e:
+                    print(f"WARNING: Could not read {name} result: {e}")
+                    values = {}
+                for q in quantities:
+                    value = values.get(q) if q in by_name[name].provides else None
+                    if value and value > 0:
+                        candidates[q].append((name, value))
+
+            wave = set()
+            for q in quantities:
+                candidates[q].sort(key=lambda c: order[c[0]])
+                decisions[q] = vote(candidates[q], needed[q], TOLERANCE.get(q, DEFAULT_TOLERANCE), recent[q])
+                if decisions[q][2]:
+                    continue
+                untried = [n for n in providers[q] if n not in fetched]
+                wave.update(untried[:max(1, needed[q] - len(candidates[q]))])
+
+        for q in quantities:
+            value, name, verified = decisions.get(q, (0, None, False))
+            if verified and is_outlier(value, recent[q]):
+                print(f"WARNING: {q} {value} is far from recent history but agreed by its sources")
+            elif not verified:
+                rejected = [f"{n} {v}" for n, v in candidates[q] if n != name]
+                if name and rejected:
+                    print(f"VERIFICATION WARNING: {q} from {name} ({value}) not confirmed by {', '.join(rejected)}")
+                elif rejected:
+                    print(f"VERIFICATION WARNING: {q} rejected as outliers: {', '.join(rejected)}")
+
+        skipped = [s.name for s in sources if s.name not in fetched]
+        for name in skipped:
+            metrics.count('source.result', source=name, result='skipped')
+            fetched[name] = by_name[name].default
+        if skipped:
+            print(f"INFO: Consensus reached without {', '.join(skipped)}")
+        span.update(waves=waves, skipped=skipped,
+                    verified=sorted(q for q, d in decisions.items() if d[2]))
+    return decisions, fetched
@@ -0,0 +1,184 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from chart_ranges import METAL_KEYS, RATE_SCALE as COLUMN_SCALE, build_columns, delta_encode
+from history_archive import HistoryArchive
+
+# Cross rates and metal prices in every tracked currency, for all days on
+# which NRB rates were recorded. Rates are normalised to NPR per *single*
+# unit (NRB quotes JPY per 10 and KRW per 100) using the buy/sell midpoint.
+FX_FILE = 'public/fx.json'
+BASE = 'NPR'
+# NPR per unit x RATE_SCALE (KRW is ~0.11 NPR, so four decimals are needed)
+RATE_SCALE = 10000
+# Metal prices per tola in the foreign currency x PRICE_SCALE
+PRICE_SCALE = 100
+# Significant digits kept in each cross-rate column
+CROSS_DIGITS = 6
+FX_METALS = ('gold', 'silver')
+# Archived records with NRB quotes, trimmed to what the payload needs. The
+# archive is only re-read when the content of its index.json changes.
+ARCHIVE_CACHE = os.getenv('FX_ARCHIVE_CACHE', '.cache/fx-archive.json')
+
+
+def normalized_rates(cols, currencies):
+    """(days, 1 + len(currencies)) array of NPR per single unit; column 0 is
+    NPR itself (1.0). Missing quotes are NaN."""
+    rates = np.full((len(cols['day']), len(currencies) + 1), np.nan)
+    rates[:, 0] = 1.0
+    for j, code in enumerate(currencies, start=1):
+        col = cols['fx'][code]
+        # build_columns() stores buy/sell as integer paisa per `unit`
+        mid = (col['buy'] + col['sell']) / (2.0 * col['unit'] * COLUMN_SCALE)
+        rates[col['present'], j] = mid[col['present']]
+    return rates
+
+
+def cross_rate_matrix(rates):
+    """Cross rates for each row of `rates`: m[d, i, j] is how many of
+    currency j buy one of currency i on day d (NaN where either side is
+    missing)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rates[:, :, None] / rates[:, None, :]
+
+
+def _scaled(values, scale):
+    present = ~np.isnan(values)
+    ints = np.zeros(len(values), dtype=np.int64)
+    ints[present] = np.rint(values[present] * scale)
+    return delta_encode(ints, present)
+
+
+def _cross_columns(matrix, codes):
+    """{"I/J": {"scale", "v"}} for every pair of foreign currencies, I
+    before J in `codes`: J per one I for each day x scale, delta-encoded.
+    scale is a power of ten (at least 1) that keeps CROSS_DIGITS significant
+    digits of the column's largest value, since pairs differ by orders of
+    magnitude (KRW per KWD vs. USD per JPY)."""
+    rows, cols = np.triu_indices(len(codes), 1)
+    keep = rows > 0  # Pairs with NPR are `rates`
+    rows, cols = rows[keep], cols[keep]
+    values = matrix[:, rows, cols]  # (days, pairs)
+    with np.errstate(invalid='ignore'):
+        peak = np.nanmax(np.where(np.isnan(values), -np.inf, np.abs(values)), axis=0)
+    exponents = np.zeros(len(rows), dtype=np.int64)
+    finite = np.isfinite(peak) & (peak > 0)
+    exponents[finite] = np.maximum(CROSS_DIGITS - 1 - np.floor(np.log10(peak[finite])), 0)
+    return {
+        f"{codes[i]}/{codes[j]}": {'scale': 10 ** int(e), 'v': _scaled(values[:, k], 10 ** int(e))}
+        for k, (i, j, e) in enumerate(zip(rows.tolist(), cols.tolist(), exponents.tolist()))
+    }
+
+
+def build_fx_payload(records, currencies):
+    """Columnar payload over every record with at least one NRB quote.
+
+    Layout (integer arrays delta-encoded, null = missing):
+      day            days since 1970-01-01
+      rates[code]    NPR per single unit x rateScale
+      gold/silver    {code: price per tola in that currency x priceScale}
+      cross          {"I/J": {scale, v}}: J per one I x scale for every day
+                     and pair of foreign currencies (see _cross_columns());
+                     J/I is the reciprocal, I/NPR is rates[I]
+      latest         {day, cross}: full cross-rate matrix for the newest day,
+                     rows/columns in `codes` order
+    """
+    records = [r for r in records if any(c.get('code') in currencies for c in r.get('currencies') or ())]
+    codes = [BASE] + list(currencies)
+    payload = {'v': 1, 'base': BASE, 'codes': codes, 'n': len(records),
+               'rateScale': RATE_SCALE, 'priceScale': PRICE_SCALE}
+    if not records:
+        return payload
+
+    cols = build_columns(records, currencies)
+    rates = normalized_rates(cols, currencies)
+    matrix = cross_rate_matrix(rates)
+
+    payload['day'] = delta_encode(cols['day'])
+    payload['rates'] = {code: _scaled(rates[:, j], RATE_SCALE) for j, code in enumerate(codes) if j}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for key in FX_METALS:
+            prices = cols['metals'][key][:, None] / rates
+            payload[key] = {code: _scaled(prices[:, j], PRICE_SCALE) for j, code in enumerate(codes)}
+    payload['cross'] = _cross_columns(matrix, codes)
+    payload['latest'] = {
+        'day': int(cols['day'][-1]),
+        'cross': [[None if np.isnan(x) else float(f"{x:.6g}") for x in row] for row in matrix[-1]],
+    }
+    return payload
+
+
+def _fx_record(record, currencies):
+    """`record` with only the fields build_fx_payload() reads, or None if it
+    has no tracked NRB quote."""
+    quotes = [c for c in record.get('currencies') or () if c.get('code') in currencies]
+    if not quotes:
+        return None
+    slim = {key: record.get(key) for key in ('date', 'usd') + METAL_KEYS}
+    slim['currencies'] = quotes
+    return slim
+
+
+def archived_fx_records(archive, currencies, path=ARCHIVE_CACHE):
+    """The archive's records with tracked quotes, from the cache at `path`
+    while the archive index is unchanged. A failed cache write is only a
+    warning."""
+    try:
+        with open(archive.index_path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return []
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('index') == fingerprint and cached.get('currencies') == list(currencies):
+            return cached['records']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    records = [r for r in (_fx_record(r, currencies) for r in archive.query('0000-01-01', '9999-12-31')) if r]
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'index': fingerprint, 'currencies': list(currencies), 'records': records},
+                      f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"WARNING: Could not write {path}: {e}")
+    return records
+
+
+def fx_records(log, currencies, archive=None, cache_path=ARCHIVE_CACHE):
+    """Every record with tracked quotes: the cached archive part plus the hot
+    log's records newer than the archive."""
+    archive = archive or HistoryArchive()
+    archived_until = archive.last_date()
+    records = archived_fx_records(archive, currencies, cache_path)
+    for record in log.iter_records():
+        if str(record.get('date', ''))[:10] > archived_until:
+            slim = _fx_record(record, currencies)
+            if slim:
+                records.append(slim)
+    return records
+
+
+def write_fx_file(records, currencies, path=FX_FILE):
+    """Writes public/fx.json unless its contents are unchanged. Returns True if written."""
+    body = json.dumps(build_fx_payload(records, currencies), separators=(',', ':'))
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if f.read() == body:
+                return False
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(body)
+    os.replace(tmp, path)
+    return True
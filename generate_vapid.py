@@ -1,28 +1,65 @@
-from pywebpush import vapid_supported_curves
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
+import argparse
 import base64
 
-def generate_vapid_keys():
-    # Generate a private key for use with ECDSA
-    private_key = ec.generate_private_key(ec.SECP256R1())
-    
+def serialize_private_key(private_key, fmt):
+    """Serializes the private key for VAPID_PRIVATE_KEY.
+
+    raw: 32-byte scalar (base64url). The public point has to be re-derived on load.
+    der: PKCS#8 DER (base64url, single line). Carries the public key, so it loads
+         without the extra curve multiplication.
+    pem: PKCS#8 PEM. Same content as der; can also be saved to a file and the
+         path passed as VAPID_PRIVATE_KEY.
+    """
+    if fmt == 'raw':
+        private_bytes = private_key.private_numbers().private_value.to_bytes(32, byteorder='big')
+        return base64.urlsafe_b64encode(private_bytes).decode('utf-8').strip('=')
+    encoding = serialization.Encoding.PEM if fmt == 'pem' else serialization.Encoding.DER
+    key_bytes = private_key.private_bytes(
+        encoding=encoding,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    if fmt == 'pem':
+        return key_bytes.decode('utf-8')
+    return base64.urlsafe_b64encode(key_bytes).decode('utf-8').strip('=')
+
+def generate_vapid_keys(fmt='raw', existing_key=None):
+    if existing_key:
+        # Re-encode an existing raw VAPID_PRIVATE_KEY (public key stays the same)
+        padded = existing_key + '=' * (-len(existing_key) % 4)
+        private_value = int.from_bytes(base64.urlsafe_b64decode(padded), byteorder='big')
+        private_key = ec.derive_private_key(private_value, ec.SECP256R1())
+    else:
+        # Generate a private key for use with ECDSA
+        private_key = ec.generate_private_key(ec.SECP256R1())
+
     # Get the public key
     public_key = private_key.public_key()
-    
-    # Serialize private key to base64
-    private_bytes = private_key.private_numbers().private_value.to_bytes(32, byteorder='big')
-    private_base64 = base64.urlsafe_b64encode(private_bytes).decode('utf-8').strip('=')
-    
+
+    # Serialize private key
+    private_encoded = serialize_private_key(private_key, fmt)
+
     # Serialize public key to base64 (Uncompressed point format)
     public_bytes = public_key.public_bytes(
         encoding=serialization.Encoding.X962,
         format=serialization.PublicFormat.UncompressedPoint
     )
     public_base64 = base64.urlsafe_b64encode(public_bytes).decode('utf-8').strip('=')
-    
+
     print(f"VAPID_PUBLIC_KEY={public_base64}")
-    print(f"VAPID_PRIVATE_KEY={private_base64}")
+    if fmt == 'pem':
+        print("VAPID_PRIVATE_KEY=")
+        print(private_encoded, end='')
+    else:
+        print(f"VAPID_PRIVATE_KEY={private_encoded}")
 
 if __name__ == "__main__":
-    generate_vapid_keys()
+    parser = argparse.ArgumentParser(description="Generate VAPID keys for Web Push")
+    parser.add_argument('--format', choices=['raw', 'der', 'pem'], default='raw',
+                        help="Private key encoding (der/pem load faster than raw)")
+    parser.add_argument('--convert', metavar='RAW_KEY',
+                        help="Re-encode an existing raw VAPID_PRIVATE_KEY instead of generating a new one")
+    args = parser.parse_args()
+    generate_vapid_keys(args.format, args.convert)
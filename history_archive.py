@@ -0,0 +1,151 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+import os
+
+# Tiered retention:
+#   hot      data/history.ndjson keeps the newest HOT_RECORDS records
+#   archive  public/archive/<year>.ndjson, append-only yearly partitions
+#   index    public/archive/index.json, date range, size and per-month byte
+#            offsets of every partition
+ARCHIVE_DIR = 'public/archive'
+INDEX_FILE = 'index.json'
+HOT_RECORDS = 1000
+# Records are moved out of the hot log in batches so the hot log is only
+# rewritten once every ARCHIVE_BATCH runs.
+ARCHIVE_BATCH = 100
+
+
+def _date_key(record):
+    return str(record.get('date', ''))[:10]
+
+
+class HistoryArchive:
+    """Yearly NDJSON partitions plus a small index manifest.
+
+    Partitions are only ever appended to, and only the newest year receives
+    new records, so a closed year's file never changes. Range queries use the
+    index to open just the overlapping partitions and seek to the first month.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {'version': 1, 'partitions': {}}
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+    def last_date(self, index=None):
+        index = index or self.load_index()
+        return max((p['last'] for p in index['partitions'].values()), default='')
+
+    def append(self, lines):
+        """Appends raw NDJSON lines (oldest first) to their year partitions.
+        Lines already archived (date <= archive's last date) are skipped, so an
+        interrupted run can safely be repeated. Returns the number appended.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        index = self.load_index()
+        last = self.last_date(index)
+        appended = 0
+        handles = {}
+        try:
+            for line in lines:
+                record = json.loads(line)
+                date = _date_key(record)
+                if not date or date <= last:
+                    continue
+                year = date[:4]
+                part = index['partitions'].setdefault(year, {
+                    'file': f"{year}.ndjson", 'first': date, 'last': date,
+                    'count': 0, 'bytes': 0, 'months': {}})
+                if year not in handles:
+                    handles[year] = open(os.path.join(self.root, part['file']), 'ab')
+                month = date[:7]
+                if month not in part['months']:
+                    part['months'][month] = part['bytes']
+                data = line if line.endswith(b'\n') else line + b'\n'
+                handles[year].write(data)
+                part['bytes'] += len(data)
+                part['count'] += 1
+                part['last'] = date
+                last = date
+                appended += 1
+        finally:
+            for f in handles.values():
+                f.close()
+        if appended:
+            self._save_index(index)
+        return appended
+
+    def query(self, start, end):
+        """Yields archived records with start <= date <= end ('YYYY-MM-DD'),
+        reading only the partitions whose range overlaps.
+        """
+        index = self.load_index()
+        for year in sorted(index['partitions']):
+            part = index['partitions'][year]
+            if part['last'] < start or part['first'] > end:
+                continue
+            offset = 0
+            for month in sorted(part['months']):
+                if month <= start[:7]:
+                    offset = part['months'][month]
+            with open(os.path.join(self.root, part['file']), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    record = json.loads(line)
+                    date = _date_key(record)
+                    if date > end:
+                        return
+                    if date >= start:
+                        yield record
+
+
+def archive_overflow(log, archive=None, hot_records=HOT_RECORDS, batch=ARCHIVE_BATCH):
+    """Moves the oldest records out of the hot log once it holds more than
+    hot_records + batch of them. Only the hot log is read and rewritten; the
+    archive is appended to. Returns the number of records moved.
+    """
+    if not log.exists():
+        return 0
+    with open(log.path, 'rb') as f:
+        lines = [line for line in f.read().splitlines(keepends=True) if line.strip()]
+    overflow = len(lines) - hot_records
+    if overflow <= batch:
+        return 0
+
+    archive = archive or HistoryArchive()
+    archive.append(lines[:overflow])
+
+    tmp = log.path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.writelines(lines[overflow:])
+    os.replace(tmp, log.path)
+    return overflow
+
+
+def query_range(start, end, log=None, archive=None):
+    """Records with start <= date <= end across the archive and the hot log."""
+    archive = archive or HistoryArchive()
+    archived_until = archive.last_date()
+    if start <= archived_until:
+        yield from archive.query(start, end)
+    if log is not None and end > archived_until:
+        for record in log.iter_records():
+            date = _date_key(record)
+            if date > end:
+                break
+            if date >= start and date > archived_until:
+                yield record
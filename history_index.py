@@ -0,0 +1,284 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import bisect
+import datetime
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from history_archive import ARCHIVE_DIR, INDEX_FILE, query_range
+from history_log import HISTORY_LOG, open_history_log
+
+# In-process, read-only view of the price history: parallel typed arrays
+# sorted by time, with "YYYY-MM-DD" and "YYYY-MM-DD HH:MM" dates both mapped
+# to minutes since 1970-01-01 (a bare date sorts as 00:00). Only the metal
+# prices and USD are indexed; currency tables stay in the log.
+#
+# Binary snapshot (native byte order, 8-byte aligned columns):
+#   header   MAGIC, version, byte order, count, source fingerprint (4 x int64)
+#   columns  minutes, gold, tejabi, silver (int64), usd (float64), has_time (int8)
+#
+# The fingerprint hashes file contents rather than mtimes, so a snapshot
+# restored from a CI cache still matches a fresh checkout of the same data.
+SNAPSHOT_BIN = os.getenv('HISTORY_INDEX_PATH', '.cache/history.bin')
+MAGIC = b'GVHX'
+VERSION = 1
+FIELDS = ('gold', 'tejabi', 'silver')
+_HEADER = struct.Struct('=4sHcxq4q')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+
+def to_minutes(date_str):
+    """Minutes since 1970-01-01 for 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'.
+    Raises ValueError for anything else."""
+    s = str(date_str)
+    if len(s) not in (10, 16) or s[4] != '-' or s[7] != '-':
+        raise ValueError(f"bad history date {date_str!r}")
+    day = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal() - _EPOCH_ORDINAL
+    minutes = day * 24 * 60
+    if len(s) == 16:
+        hours, mins = int(s[11:13]), int(s[14:16])
+        if s[13] != ':' or hours > 23 or mins > 59:
+            raise ValueError(f"bad history date {date_str!r}")
+        minutes += hours * 60 + mins
+    return minutes
+
+
+def from_minutes(minutes, has_time=True):
+    moment = _EPOCH + datetime.timedelta(minutes=minutes)
+    return moment.strftime('%Y-%m-%d %H:%M' if has_time else '%Y-%m-%d')
+
+
+def _bound(value, end=False):
+    """Range bound as minutes. A bare end date includes that whole day."""
+    if isinstance(value, int):
+        return value
+    minutes = to_minutes(value)
+    if end and len(str(value)) <= 10:
+        minutes += 24 * 60 - 1
+    return minutes
+
+
+def _content_digest(path):
+    """(size, first 60 bits of the SHA-256) of a file, (-1, -1) if missing."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return (-1, -1)
+    return (len(data), int(hashlib.sha256(data).hexdigest()[:15], 16))
+
+
+def source_fingerprint(log_path=HISTORY_LOG, archive_dir=ARCHIVE_DIR):
+    """Size and content hash of the hot log and the archive index; any
+    append, rewrite or archiving run changes it."""
+    return _content_digest(log_path) + _content_digest(os.path.join(archive_dir, INDEX_FILE))
+
+
+class HistoryIndex:
+    """Sorted, array-backed price history with O(log n) date lookups.
+
+    Columns are array('q')/array('d') when built from records, or zero-copy
+    memoryviews over a memory-mapped snapshot (see open_snapshot()).
+    """
+
+    def __init__(self, minutes, prices, usd, has_time, fingerprint=None):
+        self.minutes = minutes
+        self.prices = prices  # field -> int column
+        self.usd = usd
+        self.has_time = has_time
+        self.fingerprint = fingerprint
+        self._mmap = None
+
+    @classmethod
+    def from_records(cls, records, fingerprint=None):
+        rows = []
+        for record in records:
+            try:
+                rows.append((to_minutes(record.get('date', '')), record))
+            except ValueError:
+                continue
+        if any(rows[i][0] > rows[i + 1][0] for i in range(len(rows) - 1)):
+            rows.sort(key=lambda row: row[0])  # Stable: same-minute records keep log order
+        return cls(
+            array('q', [m for m, _ in rows]),
+            {field: array('q', [int(r.get(field) or 0) for _, r in rows]) for field in FIELDS},
+            array('d', [float(r.get('usd') or 0) for _, r in rows]),
+            array('b', [len(str(r.get('date', ''))) > 10 for _, r in rows]),
+            fingerprint,
+        )
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def with_tail(self, records, replaced=0, fingerprint=None):
+        """A copy with the last `replaced` rows dropped and `records` appended,
+        mirroring HistoryLog.replace_tail(replaced, records). The kept rows are
+        copied as raw bytes. Returns None if `records` would not sort after
+        the kept rows (the caller rebuilds instead)."""
+        keep = len(self) - replaced
+        tail = HistoryIndex.from_records(records)
+        if keep < 0 or (keep and len(tail) and tail.minutes[0] < self.minutes[keep - 1]):
+            return None
+
+        def joined(code, head, extra):
+            column = array(code)
+            column.frombytes(head[:keep].tobytes())
+            column.extend(extra)
+            return column
+
+        return HistoryIndex(
+            joined('q', self.minutes, tail.minutes),
+            {field: joined('q', self.prices[field], tail.prices[field]) for field in FIELDS},
+            joined('d', self.usd, tail.usd),
+            joined('b', self.has_time, tail.has_time),
+            fingerprint,
+        )
+
+    def record(self, i):
+        """Record i as a dict shaped like a history log record (without currencies)."""
+        record = {'date': from_minutes(self.minutes[i], bool(self.has_time[i]))}
+        for field in FIELDS:
+            record[field] = self.prices[field][i]
+        record['usd'] = self.usd[i]
+        return record
+
+    def span(self, start=None, end=None):
+        """(lo, hi) positions of records with start <= date <= end; bounds are
+        date strings or minutes, and a bare end date includes that day."""
+        lo = 0 if start is None else bisect.bisect_left(self.minutes, _bound(start))
+        hi = len(self) if end is None else bisect.bisect_right(self.minutes, _bound(end, end=True))
+        return lo, max(lo, hi)
+
+    def range(self, start=None, end=None):
+        lo, hi = self.span(start, end)
+        return [self.record(i) for i in range(lo, hi)]
+
+    def latest(self, n=1):
+        """The newest `n` records, oldest first."""
+        return [self.record(i) for i in range(max(0, len(self) - n), len(self))]
+
+    def resample(self, period='daily', field='gold', start=None, end=None):
+        """[[period, open, high, low, close], ...] per day or per week (Monday
+        start, labelled with its Monday), in the format of analytics.build_ohlc()."""
+        if field not in FIELDS:
+            raise ValueError(f"unknown field {field!r}")
+        if period == 'daily':
+            size, shift = 24 * 60, 0
+        elif period == 'weekly':
+            size, shift = 7 * 24 * 60, 3 * 24 * 60  # 1970-01-01 was a Thursday
+        else:
+            raise ValueError(f"unknown period {period!r}")
+        lo, hi = self.span(start, end)
+        values = self.prices[field]
+        rows = []
+        bucket = None
+        for i in range(lo, hi):
+            key = (self.minutes[i] + shift) // size
+            value = values[i]
+            if key != bucket:
+                bucket = key
+                label = from_minutes(key * size - shift, has_time=False)
+                rows.append([label, value, value, value, value])
+            else:
+                row = rows[-1]
+                row[2] = max(row[2], value)
+                row[3] = min(row[3], value)
+                row[4] = value
+        return rows
+
+    def save(self, path=SNAPSHOT_BIN):
+        """Writes the binary snapshot (atomically)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fingerprint = tuple(self.fingerprint or (-1, -1, -1, -1))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode('ascii'), len(self), *fingerprint))
+            for column in (self.minutes, *(self.prices[field] for field in FIELDS), self.usd, self.has_time):
+                f.write(bytes(memoryview(column).cast('B')))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def open_snapshot(cls, path=SNAPSHOT_BIN):
+        """Memory-maps a snapshot; columns are views into the mapping, so
+        opening costs the same for any history length. Returns None if the
+        file is missing or was written by an incompatible version/platform."""
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapped) < _HEADER.size:
+            mapped.close()
+            return None
+        magic, version, order, count, *fingerprint = _HEADER.unpack_from(mapped, 0)
+        if (magic != MAGIC or version != VERSION or order != sys.byteorder[0].encode('ascii')
+                or len(mapped) != _HEADER.size + count * (5 * 8 + 1)):
+            mapped.close()
+            return None
+        view = memoryview(mapped)
+        columns = []
+        offset = _HEADER.size
+        for code, width in (('q', 8), ('q', 8), ('q', 8), ('q', 8), ('d', 8), ('b', 1)):
+            columns.append(view[offset:offset + count * width].cast(code))
+            offset += count * width
+        minutes, gold, tejabi, silver, usd, has_time = columns
+        index = cls(minutes, dict(zip(FIELDS, (gold, tejabi, silver))), usd, has_time, tuple(fingerprint))
+        index._mmap = mapped
+        return index
+
+
+def load_history(path=SNAPSHOT_BIN, log=None, archive=None):
+    """The whole history (archive + hot log) as a HistoryIndex.
+
+    Uses the memory-mapped snapshot at `path` when it was built from the
+    current log and archive; otherwise rebuilds it from them and rewrites the
+    snapshot (a failed write is only a warning).
+    """
+    log = log or open_history_log()
+    archive_dir = archive.root if archive is not None else ARCHIVE_DIR
+    fingerprint = source_fingerprint(log.path, archive_dir)
+    if path:
+        index = HistoryIndex.open_snapshot(path)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+    index = HistoryIndex.from_records(query_range('0000-01-01', '9999-12-31', log=log, archive=archive),
+                                      fingerprint)
+    if path:
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"WARNING: Could not write history index {path}: {e}")
+    return index
+
+
+def update_history(records, replaced=0, previous=None, path=SNAPSHOT_BIN, log=None, archive=None):
+    """Brings the snapshot up to date after the log's tail changed.
+
+    `previous` is source_fingerprint() from before the change. If the
+    snapshot matched it, its last `replaced` rows are dropped and `records`
+    appended (moving records into the archive does not change the history),
+    without reading the archive or the log. Otherwise this is load_history().
+    """
+    log = log or open_history_log()
+    archive_dir = archive.root if archive is not None else ARCHIVE_DIR
+    fingerprint = source_fingerprint(log.path, archive_dir)
+    index = HistoryIndex.open_snapshot(path) if path else None
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+    if index is not None and previous is not None and index.fingerprint == tuple(previous):
+        updated = index.with_tail(records, replaced, fingerprint)
+        if updated is not None:
+            try:
+                updated.save(path)
+            except OSError as e:
+                print(f"WARNING: Could not write history index {path}: {e}")
+            return updated
+    return load_history(path, log=log, archive=archive)
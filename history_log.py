@@ -0,0 +1,152 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import hashlib
+import json
+import os
+
+# One JSON record per line, oldest first. This is the source of truth; the
+# published public/data.json snapshot is rebuilt from its tail by compact().
+HISTORY_LOG = 'data/history.ndjson'
+SNAPSHOT = 'public/data.json'
+SNAPSHOT_LIMIT = 1000
+
+_BLOCK = 8192
+
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class HistoryLog:
+    """Append-only NDJSON price history.
+
+    Appends and last-line replacements touch only the end of the file, and
+    tail() reads backwards from the end, so the cost of a scrape run does not
+    grow with the length of the history.
+    """
+
+    def __init__(self, path=HISTORY_LOG):
+        self.path = path
+        self.state_path = path + '.state'
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def seed(self, records):
+        """Creates the log from an existing list of records (one-time migration)."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'wb') as f:
+            for record in records:
+                f.write(_encode(record))
+
+    def _tail_offset(self, f, n):
+        """Byte offset where the last `n` lines start."""
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        if n <= 0:
+            return pos
+        newlines = 0
+        # The final newline terminates the last line; it doesn't start one
+        end = pos
+        while pos > 0:
+            step = min(_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            if pos + step == end and chunk.endswith(b'\n'):
+                chunk = chunk[:-1]
+            i = len(chunk)
+            while True:
+                i = chunk.rfind(b'\n', 0, i)
+                if i < 0:
+                    break
+                newlines += 1
+                if newlines == n:
+                    return pos + i + 1
+        return 0
+
+    def tail(self, n):
+        """Returns the last `n` records, oldest first, without reading the rest."""
+        if not self.exists():
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._tail_offset(f, n))
+            return [json.loads(line) for line in f.read().splitlines() if line.strip()]
+
+    def last(self):
+        records = self.tail(1)
+        return records[0] if records else None
+
+    def iter_records(self):
+        """Streams every record, oldest first."""
+        if not self.exists():
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def append(self, record):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(_encode(record))
+
+    def replace_tail(self, k, records):
+        """Replaces the last `k` records with `records` (k=1 is a last-line replace)."""
+        if not self.exists():
+            self.seed(records)
+            return
+        with open(self.path, 'r+b') as f:
+            f.truncate(self._tail_offset(f, k))
+            f.seek(0, os.SEEK_END)
+            for record in records:
+                f.write(_encode(record))
+
+    def _fingerprint(self, limit):
+        """Identifies the snapshot contents: a hash of the log's last `limit` lines.
+        Independent of older lines, so archiving them doesn't force a rebuild."""
+        with open(self.path, 'rb') as f:
+            f.seek(self._tail_offset(f, limit))
+            return {'limit': limit, 'tail': hashlib.sha256(f.read()).hexdigest()}
+
+    def compact(self, snapshot_path=SNAPSHOT, limit=SNAPSHOT_LIMIT):
+        """Rebuilds the published snapshot from the last `limit` records, but
+        only when the log changed since the previous compaction.
+        Returns True if the snapshot was rewritten.
+        """
+        if not self.exists():
+            return False
+        fingerprint = self._fingerprint(limit)
+        state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+        if state == fingerprint and os.path.exists(snapshot_path):
+            return False
+
+        tmp = snapshot_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.tail(limit), f, indent=4)
+        os.replace(tmp, snapshot_path)
+        with open(self.state_path, 'w') as f:
+            json.dump(fingerprint, f)
+        return True
+
+
+def open_history_log(path=HISTORY_LOG, snapshot_path=SNAPSHOT):
+    """Opens the log, seeding it from the published snapshot on first use."""
+    log = HistoryLog(path)
+    if not log.exists() and os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'r') as f:
+                content = f.read().strip()
+            log.seed(json.loads(content) if content else [])
+            print(f"INFO: Seeded {path} from {snapshot_path}")
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not seed history log from {snapshot_path}: {e}")
+    return log
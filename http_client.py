@@ -0,0 +1,130 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Single time budget (seconds) shared by every budgeted request in a run:
+# the scraper's source fetches. Subscription storage reads and writes opt
+# out (budgeted=False) so a slow scrape can never block the write-back.
+RUN_BUDGET = float(os.getenv('HTTP_RUN_BUDGET', '300'))
+# Connections kept alive per host; sized for the push fan-out workers
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 20.0
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class BudgetExceeded(requests.RequestException):
+    """The run's HTTP time budget is spent; no further requests are made."""
+
+
+_lock = threading.Lock()
+_session = None
+_deadline = None
+
+
+def session():
+    """The shared, connection-pooling Session (created on first use)."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def start_run(budget=None):
+    """Starts the run's time budget. Called once at the top of a run."""
+    global _deadline
+    _deadline = time.monotonic() + (RUN_BUDGET if budget is None else budget)
+
+
+def remaining():
+    if _deadline is None:
+        start_run()
+    return _deadline - time.monotonic()
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def request(method, url, attempts=MAX_ATTEMPTS, timeout=15, retry_statuses=RETRY_STATUSES,
+            budgeted=True, **kwargs):
+    """Sends a request on the shared session.
+
+    Connection errors, timeouts and `retry_statuses` are retried up to
+    `attempts` times with jittered exponential backoff, or after the server's
+    Retry-After when it sends one. Each attempt's timeout and every wait are
+    capped by the run budget; with budgeted=False the budget is ignored and
+    each wait is capped at BACKOFF_CAP instead. Returns the last response;
+    raises the last connection error, or BudgetExceeded once the budget is
+    spent.
+    """
+    host = urlsplit(url).netloc
+    for attempt in range(attempts):
+        left = remaining() if budgeted else timeout
+        if left <= 0:
+            raise BudgetExceeded(f"HTTP budget exhausted before {method} {url}")
+        retry_after = None
+        started = time.perf_counter()
+        try:
+            resp = session().request(method, url, timeout=min(timeout, left), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.count('http.requests', host=host, status=type(e).__name__)
+            if attempt == attempts - 1:
+                raise
+            reason = f"{type(e).__name__}: {e}"
+        else:
+            metrics.observe('http.latency_ms', round((time.perf_counter() - started) * 1000, 3), host=host)
+            metrics.count('http.requests', host=host, status=resp.status_code)
+            if resp.status_code not in retry_statuses or attempt == attempts - 1:
+                return resp
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            reason = f"HTTP {resp.status_code}"
+
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        if not budgeted:
+            delay = min(delay, BACKOFF_CAP)
+        elif delay >= remaining():
+            raise BudgetExceeded(f"HTTP budget too small to retry {method} {url} after {delay:.1f}s")
+        print(f"DEBUG: Attempt {attempt+1} failed for {url} ({reason}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
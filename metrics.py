@@ -0,0 +1,163 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import bisect
+import contextlib
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+# One JSON file per run: <METRICS_DIR>/<kind>-<UTC time>.json with
+#   spans       [{name, start_ms, duration_ms, ok, ...attributes}] in start order
+#   counters    {name: {"label=value,...": count}}
+#   histograms  {name: {"label=value,...": {bounds, counts, count, sum, min, max}}}
+METRICS_DIR = os.getenv('METRICS_DIR', '.metrics')
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+LATENCY_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _labels(labels):
+    return ','.join(f"{k}={labels[k]}" for k in sorted(labels))
+
+
+class Run:
+    """Spans, counters and histograms for one scrape or push run. Thread-safe."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Times the block. Yields the span's attribute dict so the block can add
+        results; an exception marks the span failed and propagates."""
+        start = time.perf_counter()
+        record = {'name': name, 'start_ms': round((start - self._t0) * 1000, 3)}
+        with self._lock:
+            self.spans.append(record)
+        ok = False
+        try:
+            yield attrs
+            ok = True
+        except BaseException as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            record['ok'] = ok
+            record.update(attrs)
+
+    def count(self, name, n=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + n
+
+    def observe(self, name, value_ms, **labels):
+        key = _labels(labels)
+        with self._lock:
+            hist = self.histograms.setdefault(name, {}).setdefault(key, {
+                'bounds': list(LATENCY_BOUNDS_MS),
+                'counts': [0] * (len(LATENCY_BOUNDS_MS) + 1),
+                'count': 0, 'sum': 0.0, 'min': None, 'max': None,
+            })
+            hist['counts'][bisect.bisect_left(LATENCY_BOUNDS_MS, value_ms)] += 1
+            hist['count'] += 1
+            hist['sum'] = round(hist['sum'] + value_ms, 3)
+            hist['min'] = value_ms if hist['min'] is None else min(hist['min'], value_ms)
+            hist['max'] = value_ms if hist['max'] is None else max(hist['max'], value_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'kind': self.kind,
+                'started': self.started.isoformat(),
+                'duration_ms': round((time.perf_counter() - self._t0) * 1000, 3),
+                'spans': [dict(s) for s in self.spans],
+                'counters': json.loads(json.dumps(self.counters)),
+                'histograms': json.loads(json.dumps(self.histograms)),
+            }
+
+    def write(self, directory=METRICS_DIR):
+        """Writes the run's metrics file and returns its path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.kind}-{self.started.strftime('%Y%m%dT%H%M%S.%fZ')}.json")
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
+
+
+_run = None
+
+
+def start_run(kind):
+    """Starts collecting metrics for a new run (replacing any previous one)."""
+    global _run
+    _run = Run(kind)
+    return _run
+
+
+def current():
+    global _run
+    if _run is None:
+        _run = Run('adhoc')
+    return _run
+
+
+def span(name, **attrs):
+    return current().span(name, **attrs)
+
+
+def count(name, n=1, **labels):
+    current().count(name, n, **labels)
+
+
+def observe(name, value_ms, **labels):
+    current().observe(name, value_ms, **labels)
+
+
+def timed(name):
+    """Decorator: records every call of the function as a span called `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def run(kind):
+    """start_run(kind) around the block, with finish() on every exit: early
+    returns and exceptions included (counted as run.error, then re-raised)."""
+    current_run = start_run(kind)
+    try:
+        yield current_run
+    except BaseException as e:
+        current_run.count('run.error', type=type(e).__name__)
+        raise
+    finally:
+        finish()
+
+
+def finish():
+    """Writes the current run's metrics file. Returns its path, or None if the
+    file could not be written (metrics never fail a run)."""
+    try:
+        path = current().write()
+    except OSError as e:
+        print(f"WARNING: Could not write metrics: {e}")
+        return None
+    print(f"INFO: Metrics written to {path}")
+    return path
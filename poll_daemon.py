@@ -0,0 +1,151 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import http_client
+
+# `scraper.py --daemon`: poll FENEGOSIDA's Dashboard/today cheaply and run
+# the full update() (and its push) only when the published rates change.
+#
+#   inside the publication window, nothing seen yet today   POLL_FAST
+#   market hours otherwise, or after today's change          POLL_MARKET / POLL_AFTER_CHANGE
+#   outside market hours                                     sleep until the next opening (at most POLL_MAX)
+#   failed polls                                             exponential backoff (at most MAX_FAILURE_DELAY)
+#
+# Times are Nepal time (UTC+05:45). FENEGOSIDA publishes Sunday-Friday.
+NEPAL_OFFSET = datetime.timedelta(hours=5, minutes=45)
+MARKET_DAYS = (6, 0, 1, 2, 3, 4)  # date.weekday(): Sunday..Friday
+MARKET_OPEN = datetime.time(9, 0)
+MARKET_CLOSE = datetime.time(18, 0)
+
+
+def _clock(value):
+    hours, minutes = value.split(':')
+    return datetime.time(int(hours), int(minutes))
+
+
+WINDOW_START, WINDOW_END = (_clock(t) for t in os.getenv('DAEMON_WINDOW', '10:15-12:30').split('-'))
+POLL_FAST = float(os.getenv('DAEMON_POLL_FAST', '60'))
+POLL_MARKET = float(os.getenv('DAEMON_POLL_MARKET', '600'))
+POLL_AFTER_CHANGE = float(os.getenv('DAEMON_POLL_AFTER_CHANGE', '1800'))
+POLL_MAX = 3600.0
+MAX_FAILURE_DELAY = 900.0
+
+# Only these fields of each rate row feed the hash, so response metadata
+# cannot look like a new publication
+HASH_FIELDS = ('rateType', 'todayBaseRatePerGram', 'effectiveDate')
+
+
+def nepal_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + NEPAL_OFFSET
+
+
+def content_hash(payload):
+    """SHA-256 over the rate rows of a Dashboard/today payload."""
+    rows = payload if isinstance(payload, list) else []
+    rows = sorted(
+        [[str(row.get(field)) for field in HASH_FIELDS] for row in rows if isinstance(row, dict)])
+    return hashlib.sha256(json.dumps(rows, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def in_market_hours(now):
+    return now.weekday() in MARKET_DAYS and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def seconds_to_open(now):
+    """Seconds until the next market opening after `now`."""
+    day = now.date()
+    for _ in range(8):
+        opening = datetime.datetime.combine(day, MARKET_OPEN)
+        if opening > now and day.weekday() in MARKET_DAYS:
+            return (opening - now).total_seconds()
+        day += datetime.timedelta(days=1)
+    return POLL_MAX
+
+
+def poll_interval(now, changed_on, failures=0):
+    """Seconds to wait before the next poll. `changed_on` is the Nepal date
+    of the last change seen (or None); `failures` counts failed polls in a row."""
+    if not in_market_hours(now):
+        delay = min(POLL_MAX, max(POLL_FAST, seconds_to_open(now)))
+    elif changed_on == now.date():
+        delay = POLL_AFTER_CHANGE
+    elif WINDOW_START <= now.time() <= WINDOW_END:
+        delay = POLL_FAST
+    else:
+        delay = POLL_MARKET
+    if failures:
+        delay = max(delay, min(MAX_FAILURE_DELAY, POLL_FAST * 2 ** failures))
+    return delay
+
+
+class Watcher:
+    """Remembers the last validators and hash of one URL between polls."""
+
+    def __init__(self, url):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        self.hash = None
+
+    def poll(self):
+        """Returns True if the content changed since the previous poll (the
+        first poll always counts as a change). Errors propagate."""
+        headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        http_client.start_run(budget=60)
+        resp = http_client.get(self.url, headers=headers, timeout=25, verify=False, attempts=1)
+        if resp.status_code == 304 and self.hash:
+            return False
+        resp.raise_for_status()
+        self.etag = resp.headers.get('ETag')
+        self.last_modified = resp.headers.get('Last-Modified')
+        digest = content_hash(resp.json())
+        changed = digest != self.hash
+        self.hash = digest
+        return changed
+
+
+def run(url, update, max_polls=None, sleep=time.sleep, now=nepal_now):
+    """Polls `url` and calls update() whenever its content hash changes,
+    until interrupted (or after `max_polls` polls)."""
+    watcher = Watcher(url)
+    changed_on = None
+    failures = 0
+    polls = 0
+    print(f"INFO: Daemon polling {url} (window {WINDOW_START:%H:%M}-{WINDOW_END:%H:%M} NPT)")
+    try:
+        while max_polls is None or polls < max_polls:
+            polls += 1
+            first = watcher.hash is None
+            try:
+                changed = watcher.poll()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                print(f"WARNING: Poll failed ({failures} in a row): {e}")
+                changed = False
+            if changed:
+                print(f"INFO: Dashboard/today {'fetched' if first else 'changed'} (hash {watcher.hash[:12]}); running update")
+                try:
+                    update()
+                except Exception as e:
+                    print(f"ERROR: update() failed: {e}")
+                if not first:
+                    # The first successful poll only catches up; it is not today's publication
+                    changed_on = now().date()
+            delay = poll_interval(now(), changed_on, failures)
+            print(f"DEBUG: Next poll in {int(delay)} s")
+            if max_polls is None or polls < max_polls:
+                sleep(delay)
+    except KeyboardInterrupt:
+        print("INFO: Daemon stopped.")
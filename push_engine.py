@@ -0,0 +1,326 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import collections
+import heapq
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import http_client
+import metrics
+from broadcast_job import merge_results
+
+# Remove subscription after 6 consecutive failures
+FAILURE_THRESHOLD = 6
+
+# Number of concurrent webpush() round trips. PUSH_WORKERS=1 restores the
+# old one-at-a-time behaviour.
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', '16'))
+
+# Seconds to wait on one push service round trip. webpush() has no timeout
+# of its own, so a stalled push service would otherwise hold a worker forever.
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT', '10'))
+
+# send_by_shard() loads whole store shards until a batch holds this many
+# subscriptions, sends to the batch, then writes those shards back
+PUSH_BATCH_SIZE = int(os.getenv('PUSH_BATCH_SIZE', '20000'))
+
+# Per push-service origin (FCM, Mozilla autopush, Apple, ...): requests in
+# flight and request starts per second. The in-flight cap defaults to
+# PUSH_WORKERS, so a list that is mostly FCM still uses every worker; the
+# cap only tightens (AIMD) while an origin throttles.
+ORIGIN_CONCURRENCY = int(os.getenv('PUSH_ORIGIN_CONCURRENCY', str(PUSH_WORKERS)))
+ORIGIN_RATE = float(os.getenv('PUSH_ORIGIN_RATE', '100'))
+
+# Push service answers that mean "slow down", not "this subscription is bad"
+THROTTLE_STATUSES = frozenset([429, 503])
+MAX_REQUEUES = 3
+MAX_REQUEUE_DELAY = 120.0
+# fan_out() result for a subscription given up on while still throttled: it
+# never got the push, which is neither a success nor a failure
+DEFERRED = 'deferred'
+
+# How long the push service keeps an undelivered alert (webpush() defaults
+# to 0: dropped unless the device is online right now)
+PUSH_TTL = int(os.getenv('PUSH_TTL', str(6 * 3600)))
+PUSH_URGENCY = 'normal'
+PUSH_TOPIC = 'price-update'
+
+
+class PushThrottled(Exception):
+    """Raised by a send function when the push service answered 429/503.
+    fan_out() requeues the subscription instead of counting a failure."""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def origin_of(endpoint):
+    url = urlsplit(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def delivery_headers(vapid_headers):
+    """VAPID headers plus Urgency and Topic. With a Topic, a newer price alert
+    replaces an older one the push service is still holding for an offline device."""
+    return dict(vapid_headers, Urgency=PUSH_URGENCY, Topic=PUSH_TOPIC)
+
+
+class _Origin:
+    """Scheduling state for one push service."""
+
+    def __init__(self, limit):
+        self.queue = collections.deque()
+        self.in_flight = 0
+        self.limit = limit        # current concurrency, lowered while throttled
+        self.next_slot = 0.0      # earliest start allowed by the rate limit
+
+
+def fan_out(subscriptions, send, workers=None, skip=None, indices=None,
+            concurrency=None, rate=None, on_result=None, on_deferred=None):
+    """Runs send(sub) for every subscription on a bounded thread pool.
+
+    `send` must not mutate the subscription; it returns (success, failure_count)
+    where failure_count is the new consecutive-failure count on failure, or
+    raises PushThrottled. `indices` limits the run to those positions (e.g.
+    targeting.select_targets()). `on_result(sub, result)` is called on the calling
+    thread as each final result comes in (e.g. BroadcastJob.record);
+    `on_deferred(sub)` instead for a subscription given up on because it
+    stayed throttled, which never got the push.
+
+    Subscriptions are grouped by push-service origin. Each origin gets at most
+    `concurrency` requests in flight and `rate` starts per second, and is
+    served healthiest subscriptions (lowest failureCount) first. A throttled
+    send is requeued after Retry-After (or a jittered backoff) and halves its
+    origin's concurrency, which grows back by one per success; a subscription
+    that stays throttled is given up on (DEFERRED) with its failureCount
+    unchanged.
+
+    Returns a list aligned with `subscriptions` (None for skipped entries,
+    DEFERRED for throttled give-ups), so results are collected in input order
+    no matter which push finishes first.
+    """
+    workers = max(1, workers or PUSH_WORKERS)
+    concurrency = max(1, concurrency or ORIGIN_CONCURRENCY)
+    rate = ORIGIN_RATE if rate is None else rate
+    interval = 1.0 / rate if rate > 0 else 0.0
+    results = [None] * len(subscriptions)
+    if indices is None:
+        indices = range(len(subscriptions))
+    pending = [i for i in indices if not (skip and skip(subscriptions[i]))]
+    pending.sort(key=lambda i: subscriptions[i].get('failureCount', 0))
+
+    origins = {}
+    for i in pending:
+        origins.setdefault(origin_of(subscriptions[i].get('endpoint', '')), _Origin(concurrency)).queue.append(i)
+    delayed = []   # heap of (ready_at, seq, index, origin)
+    requeues = collections.Counter()
+    seq = 0
+
+    # Keep only a small window of futures in flight so memory stays bounded
+    # for large subscriber lists.
+    max_in_flight = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        while True:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, i, name = heapq.heappop(delayed)
+                origins[name].queue.append(i)
+
+            wake = delayed[0][0] if delayed else None
+            for name, origin in origins.items():
+                while origin.queue and origin.in_flight < origin.limit and len(in_flight) < max_in_flight:
+                    if origin.next_slot > now:
+                        wake = origin.next_slot if wake is None else min(wake, origin.next_slot)
+                        break
+                    i = origin.queue.popleft()
+                    in_flight[pool.submit(send, subscriptions[i])] = (i, name)
+                    origin.in_flight += 1
+                    origin.next_slot = max(origin.next_slot, now) + interval
+
+            if not in_flight:
+                if wake is None:
+                    break
+                time.sleep(max(0.0, wake - now))
+                continue
+
+            timeout = None if wake is None else max(0.0, wake - now)
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, name = in_flight.pop(future)
+                origin = origins[name]
+                origin.in_flight -= 1
+                try:
+                    results[i] = future.result()
+                    origin.limit = min(concurrency, origin.limit + 1)
+                except PushThrottled as e:
+                    requeues[i] += 1
+                    delay = e.retry_after if e.retry_after is not None else http_client.backoff_delay(requeues[i])
+                    if requeues[i] > MAX_REQUEUES or delay > MAX_REQUEUE_DELAY:
+                        print(f"Push throttled ({e}) {requeues[i]} time(s) by {name}; giving up for this run")
+                        results[i] = DEFERRED
+                        if on_deferred:
+                            on_deferred(subscriptions[i])
+                        continue
+                    else:
+                        origin.limit = max(1, origin.limit // 2)
+                        seq += 1
+                        heapq.heappush(delayed, (time.monotonic() + delay, seq, i, name))
+                        metrics.count('push.requeued', origin=name)
+                        continue
+                except Exception as e:
+                    print(f"Unexpected push error: {type(e).__name__}: {e}")
+                    results[i] = (False, subscriptions[i].get('failureCount', 0) + 1)
+                if on_result:
+                    on_result(subscriptions[i], results[i])
+    return results
+
+
+def record_send(endpoint, started, status):
+    """Records one push round trip: latency per push-service origin and the
+    outcome (HTTP status, or the exception name when there was no response).
+    `started` is the time.perf_counter() value taken before the send."""
+    metrics.observe('push.latency_ms', round((time.perf_counter() - started) * 1000, 3),
+                    origin=origin_of(endpoint))
+    metrics.count('push.status', status=status)
+
+
+def apply_results(subscriptions, results, threshold=FAILURE_THRESHOLD):
+    """Applies fan_out() results to the failureCount bookkeeping.
+    Returns (updated_subscriptions, success_count, failed_count, has_changes).
+    """
+    success_count = 0
+    failed_count = 0
+    updated_subscriptions = []  # Track subscriptions with updated failure counts
+    has_changes = False  # Track if any failure counts changed
+
+    for sub, result in zip(subscriptions, results):
+        if result is None or result is DEFERRED:
+            # Skipped (dummy or not targeted) or still throttled: keep it but
+            # ensure failureCount is initialized
+            if 'failureCount' not in sub:
+                sub['failureCount'] = 0
+            updated_subscriptions.append(sub)
+            continue
+
+        success, failure_count = result
+        if success:
+            success_count += 1
+            if sub.get('failureCount', 0) != 0:
+                has_changes = True
+            sub['failureCount'] = 0  # Reset on success
+            updated_subscriptions.append(sub)
+        else:
+            failed_count += 1
+            sub['failureCount'] = failure_count
+            has_changes = True
+            # Keep subscription only if below threshold
+            if failure_count < threshold:
+                updated_subscriptions.append(sub)
+            else:
+                print(f"Removing subscription after {failure_count} consecutive failures")
+
+    return updated_subscriptions, success_count, failed_count, has_changes
+
+
+def send_by_shard(store, send, select=None, skip=None, job=None, write_manifest=True, batch_size=None,
+                  wanted=None):
+    """Streams a broadcast through a SubscriptionStore in batches of whole
+    shards: read shards until about `batch_size` subscriptions are loaded,
+    pick the targets with select(subscriptions) (default: everyone),
+    fan_out() to them, apply the results and write each shard back before
+    reading more. Peak memory is about one batch (at most batch_size plus
+    one shard, and the store caps shards at SHARD_MAX) no matter how many
+    subscribers there are. Results are recorded in `job` (BroadcastJob) when
+    given, except throttled give-ups (counted as deferred), so a rerun
+    sends to those again. The caller calls job.finish() only if nothing was
+    deferred and no shard failed to save. Shards whose recorded threshold
+    summary `wanted(reach)` rejects are not read at all (see
+    SubscriptionStore.iter_shards()).
+
+    Returns totals: subscriptions, targeted, resumed, sent, failed, deferred,
+    removed, shards_written, shards_skipped, save_errors.
+    """
+    batch_size = batch_size or PUSH_BATCH_SIZE
+    totals = dict.fromkeys(('subscriptions', 'targeted', 'resumed', 'sent', 'failed', 'deferred', 'removed',
+                            'shards_written', 'shards_skipped', 'save_errors'), 0)
+
+    def defer(sub):
+        totals['deferred'] += 1
+
+    def send_batch(batch):
+        subscriptions = [sub for _, shard in batch for sub in shard]
+        shard_ids = [index for index, _ in batch]
+        totals['subscriptions'] += len(subscriptions)
+        with metrics.span('push.target', shards=shard_ids) as span:
+            targets = list(range(len(subscriptions))) if select is None else select(subscriptions)
+            span['targeted'] = len(targets)
+        totals['targeted'] += len(targets)
+        previous = None
+        if job is not None:
+            targets, previous = job.pending(subscriptions, targets)
+            totals['resumed'] += job.resumed
+
+        with metrics.span('push.send', shards=shard_ids, subscriptions=len(targets)) as span:
+            results = fan_out(subscriptions, send, skip=skip, indices=targets,
+                              on_result=job.record if job is not None else None, on_deferred=defer)
+            if previous is not None:
+                results = merge_results(results, previous)
+            outcomes = [r[0] for r in results if r is not None and r is not DEFERRED]
+            span.update(sent=sum(1 for ok in outcomes if ok), failed=sum(1 for ok in outcomes if not ok),
+                        deferred=sum(1 for r in results if r is DEFERRED))
+            outcomes = None
+
+        offset = 0
+        for index, shard in batch:
+            updated, sent, failed, _ = apply_results(shard, results[offset:offset + len(shard)])
+            offset += len(shard)
+            totals['sent'] += sent
+            totals['failed'] += failed
+            totals['removed'] += len(shard) - len(updated)
+            try:
+                with metrics.span('push.write_back', shard=index) as span:
+                    span['written'] = store.save_shard(index, updated)
+                totals['shards_written'] += span['written']
+            except Exception as e:
+                print(f"ERROR: Failed to update subscription shard {index}: {e}")
+                totals['save_errors'] += 1
+
+    batch = []
+    loaded = 0
+    shards = store.iter_shards(wanted)
+    while True:
+        with metrics.span('push.load') as span:
+            item = next(shards, None)
+            if item is not None:
+                span.update(shard=item[0], subscriptions=len(item[1]))
+        if item is None:
+            break
+        batch.append(item)
+        loaded += len(item[1])
+        item = None
+        if loaded >= batch_size:
+            send_batch(batch)
+            batch = []
+            loaded = 0
+    if batch:
+        send_batch(batch)
+    batch = None
+    totals['subscriptions'] += sum(store.skipped.values())
+    totals['shards_skipped'] = len(store.skipped)
+
+    if job is not None:
+        job.flush()
+    if write_manifest:
+        try:
+            store.save_manifest(totals['shards_written'])
+        except Exception as e:
+            print(f"ERROR: Failed to update subscription manifest: {e}")
+            totals['save_errors'] += 1
+    return totals
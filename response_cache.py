@@ -0,0 +1,139 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import hashlib
+import json
+import os
+import time
+
+import http_client
+import metrics
+
+# On-disk cache of upstream responses, keyed by URL. Each entry keeps the
+# validators (ETag / Last-Modified), a hash of the body and the *parsed*
+# result, so an unchanged upstream costs neither a download nor a parse.
+CACHE_DIR = os.getenv('HTTP_CACHE_DIR', '.cache/http')
+MAX_AGE = float(os.getenv('HTTP_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(20 * 1024 * 1024)))
+
+
+class ResponseCache:
+    """Conditional-GET cache with age and total-size eviction."""
+
+    def __init__(self, root=CACHE_DIR, max_age=MAX_AGE, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    def _path(self, url):
+        return os.path.join(self.root, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        path = self._path(url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or time.time() - entry.get('stored', 0) > self.max_age:
+            return None
+        return entry
+
+    def put(self, url, entry):
+        os.makedirs(self.root, exist_ok=True)
+        entry = dict(entry, url=url)
+        path = self._path(url)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def touch(self, url):
+        """Marks an entry as recently used (drives size eviction order)."""
+        path = self._path(url)
+        if os.path.exists(path):
+            os.utime(path)
+
+    def evict(self):
+        """Drops entries older than max_age, then least-recently-used entries
+        until the cache fits in max_bytes. Returns the number removed."""
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                os.remove(path)
+                removed += 1
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+_default = None
+
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = ResponseCache()
+    return _default
+
+
+def cached_get(url, parse, cache=None, headers=None, **kwargs):
+    """GETs `url` through the cache and returns parse(response).
+
+    Sends If-None-Match / If-Modified-Since from the previous response. A 304,
+    or a 200 whose body hashes the same as last time, returns the previously
+    parsed result without calling `parse`. `parse` must return JSON-serializable
+    data. Other errors propagate as with http_client.get().
+    """
+    cache = cache or default_cache()
+    entry = cache.get(url)
+    headers = dict(headers or {})
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    resp = http_client.get(url, headers=headers, **kwargs)
+    if resp.status_code == 304 and entry:
+        print(f"DEBUG: Cache hit (304) for {url}")
+        metrics.count('http_cache', result='not_modified')
+        cache.touch(url)
+        return entry['parsed']
+    resp.raise_for_status()
+
+    digest = hashlib.sha256(resp.content).hexdigest()
+    if entry and entry.get('hash') == digest:
+        print(f"DEBUG: Cache hit (unchanged body) for {url}")
+        metrics.count('http_cache', result='unchanged')
+        parsed = entry['parsed']
+    else:
+        metrics.count('http_cache', result='miss')
+        parsed = parse(resp)
+    cache.put(url, {
+        'etag': resp.headers.get('ETag'),
+        'last_modified': resp.headers.get('Last-Modified'),
+        'hash': digest,
+        'stored': time.time(),
+        'parsed': parsed,
+    })
+    return parsed
@@ -2,14 +2,30 @@
 # This software is proprietary and may not be copied, modified, or distributed.
 # See LICENSE file for details.
 
-import requests
 import json
 import datetime
 import os
 import re
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import time
 import urllib3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import metrics
+from broadcast_job import BroadcastJob
+from consensus import Source, resolve
+from history_archive import ARCHIVE_DIR, archive_overflow
+from history_index import load_history, source_fingerprint, update_history
+from history_log import SNAPSHOT, SNAPSHOT_LIMIT, open_history_log
+from push_engine import (FAILURE_THRESHOLD, PUSH_TIMEOUT, PUSH_TTL, THROTTLE_STATUSES, PushThrottled,
+                         delivery_headers, record_send, send_by_shard)
+from response_cache import cached_get, default_cache
+from subscription_store import SubscriptionStore, open_backend
+from targeting import moves, reaches, select_targets
+from vapid_signer import VapidSigner
 
 # Suppress SSL warnings for FENEGOSIDA (expired certificates are common)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -35,7 +51,7 @@ def format_indian(n):
         res = ",".join(reversed(parts)) + "," + last_three
     return "-" + res if is_neg else res
 
-def send_push_notification(new_gold, new_tejabi, new_silver, change_g, change_t, change_s):
+def send_push_notification(new_gold, new_tejabi, new_silver, change_g, change_t, change_s, job_key=None):
     """Broadcasts native device notifications via Web Push"""
     if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
         print("PUSH SKIPPED: VAPID keys missing in GitHub Secrets.")
@@ -64,52 +80,11 @@ def send_push_notification(new_gold, new_tejabi, new_silver, change_g, change_t,
     
     full_msg = f"{gold_str}\n{tejabi_str}\n{silver_str}"
     
-    blob_token = os.getenv('BLOB_READ_WRITE_TOKEN')
-    if not blob_token:
+    backend = open_backend()
+    if not backend:
         print("PUSH SKIPPED: BLOB_READ_WRITE_TOKEN missing.")
         return
 
-    subscriptions = []
-    try:
-        headers = {"Authorization": f"Bearer {blob_token}"}
-        list_url = "https://blob.vercel-storage.com"
-        resp = requests.get(list_url, headers=headers, timeout=10)
-        
-        if resp.status_code == 200:
-            blobs = resp.json().get('blobs', [])
-            target = next((b for b in blobs if b['pathname'] == 'subscriptions/data.json'), None)
-            
-            if target:
-                sub_resp = requests.get(target['url'], timeout=10)
-                if sub_resp.status_code == 200:
-                    subscriptions = sub_resp.json()
-                    print(f"DEBUG: Successfully loaded {len(subscriptions)} subscriptions from Blob.")
-            else:
-                print("DEBUG: 'subscriptions/data.json' not found in Blob storage. Initializing with dummy data.")
-                # Initialize with dummy data if not exists
-                dummy_data = [{"endpoint":"https://fcm.googleapis.com/fcm/send/dummy-endpoint","keys":{"p256dh":"dummy-p256dh","auth":"dummy-auth"}}]
-                put_url = "https://blob.vercel-storage.com/subscriptions/data.json"
-                put_resp = requests.put(put_url, headers=headers, data=json.dumps(dummy_data), timeout=10)
-                if put_resp.status_code in [200, 201]:
-                    print("DEBUG: Successfully initialized 'subscriptions/data.json' in Blob.")
-                    subscriptions = dummy_data
-                else:
-                    print(f"DEBUG: Failed to initialize Blob data: {put_resp.status_code}")
-        else:
-            print(f"DEBUG: Blob API returned error {resp.status_code}")
-
-        if not subscriptions and os.path.exists('subscriptions.json'):
-            with open('subscriptions.json', 'r') as f:
-                subscriptions = json.load(f)
-                print(f"DEBUG: Using local subscriptions.json fallback: {len(subscriptions)}")
-                
-    except Exception as e:
-        print(f"PUSH ERROR: Could not fetch subscriptions: {e}")
-
-    if not subscriptions:
-        print("PUSH SKIPPED: No subscribers found.")
-        return
-
     payload = {
         "title": "Current Rates",
         "body": full_msg,
@@ -120,44 +95,47 @@ def send_push_notification(new_gold, new_tejabi, new_silver, change_g, change_t,
         "renotify": True
     }
 
-    print(f"Sending push to {len(subscriptions)} devices...")
-    
-    FAILURE_THRESHOLD = 6  # Remove subscription after 6 consecutive failures
-    success_count = 0
-    updated_subscriptions = []  # Track subscriptions with updated failure counts
-    has_changes = False  # Track if any failure counts changed
-    
-    for sub in subscriptions:
-        # Skip dummy endpoints but ensure failureCount is initialized
-        if "dummy-endpoint" in sub.get('endpoint', ''):
-            if 'failureCount' not in sub:
-                sub['failureCount'] = 0
-            updated_subscriptions.append(sub)
-            continue
-        
+    # Parse the VAPID key once; JWTs are signed once per push-service origin
+    try:
+        signer = VapidSigner(VAPID_PRIVATE_KEY, VAPID_EMAIL)
+    except Exception as e:
+        print(f"PUSH SKIPPED: Could not load VAPID_PRIVATE_KEY: {e}")
+        return
+    data = json.dumps(payload)
+
+    # One job per alert and Nepal day (unless the caller names it); a rerun
+    # after a crash resumes it
+    if job_key is None:
+        job_key = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=5, minutes=45)).strftime("%Y-%m-%d")
+    job = BroadcastJob(backend, job_key, data)
+    if job.done:
+        print(f"PUSH SKIPPED: Broadcast {job.id} already completed.")
+        return
+
+    def push_one(sub):
+        """Sends to a single device. Returns (success, failure_count) without mutating sub."""
+        started = time.perf_counter()
         try:
-            # Ensure proper VAPID claims format
-            vapid_claims = {"sub": VAPID_EMAIL}
-            
-            webpush(
+            resp = webpush(
                 subscription_info=sub,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=vapid_claims
+                data=data,
+                headers=delivery_headers(signer.headers_for(sub['endpoint'])),
+                ttl=PUSH_TTL,
+                requests_session=http_client.session(),
+                timeout=PUSH_TIMEOUT
             )
-            success_count += 1
-            # Reset failure count on success
-            if sub.get('failureCount', 0) != 0:
-                has_changes = True
-                sub['failureCount'] = 0
-            updated_subscriptions.append(sub)
+            record_send(sub['endpoint'], started, resp.status_code)
+            return True, 0
         except WebPushException as ex:
+            response = getattr(ex, 'response', None)
+            record_send(sub['endpoint'], started, response.status_code if response is not None else 'error')
+            if response is not None and response.status_code in THROTTLE_STATUSES:
+                # Rate limited by the push service: fan_out() requeues, no failure counted
+                raise PushThrottled(response.status_code, http_client.parse_retry_after(response.headers.get('Retry-After')))
             print(f"Push failed for one device: WebPushException: {ex}")
             # Increment failure count for any push failure
             failure_count = sub.get('failureCount', 0) + 1
-            sub['failureCount'] = failure_count
-            has_changes = True
-            
+
             # Log response details if available
             if hasattr(ex, 'response') and ex.response:
                 try:
@@ -168,41 +146,64 @@ def send_push_notification(new_gold, new_tejabi, new_silver, change_g, change_t,
                     print(f"Could not parse response details (failure count: {failure_count})")
             else:
                 print(f"No response available (failure count: {failure_count})")
-            
-            # Keep subscription only if below threshold
-            if failure_count < FAILURE_THRESHOLD:
-                updated_subscriptions.append(sub)
-            else:
-                print(f"Removing subscription after {failure_count} consecutive failures")
+            return False, failure_count
         except Exception as e:
+            record_send(sub.get('endpoint', ''), started, type(e).__name__)
             print(f"Unexpected push error: {type(e).__name__}: {e}")
             # For unexpected errors, increment failure count
             failure_count = sub.get('failureCount', 0) + 1
-            sub['failureCount'] = failure_count
-            has_changes = True
             print(f"Failure count: {failure_count}/{FAILURE_THRESHOLD}")
-            if failure_count < FAILURE_THRESHOLD:
-                updated_subscriptions.append(sub)
+            return False, failure_count
 
-    print(f"PUSH STATUS: Sent to {success_count} active devices.")
-    
-    # Save updated subscriptions with failure counts
-    removed_count = len(subscriptions) - len(updated_subscriptions)
-    if removed_count > 0:
-        print(f"Removed {removed_count} subscription(s) after {FAILURE_THRESHOLD}+ consecutive failures")
-    
-    # Save if there are changes (removals or failure count updates)
-    if removed_count > 0 or has_changes:
-        try:
-            headers_with_ct = {"Authorization": f"Bearer {blob_token}", "Content-Type": "application/json"}
-            put_url = "https://blob.vercel-storage.com/subscriptions/data.json"
-            put_resp = requests.put(put_url, headers=headers_with_ct, data=json.dumps(updated_subscriptions, indent=2), timeout=10)
-            if put_resp.status_code in [200, 201]:
-                print(f"DEBUG: Successfully updated subscriptions. Total: {len(updated_subscriptions)}")
-            else:
-                print(f"DEBUG: Failed to update subscriptions: {put_resp.status_code}")
-        except Exception as e:
-            print(f"ERROR: Failed to update subscriptions: {e}")
+    # Only subscribers whose metal/threshold preferences this move reaches;
+    # shards nobody in which it reaches are not even read
+    changes = {'gold': change_g, 'tejabi': change_t, 'silver': change_s}
+    prices = {'gold': new_gold, 'tejabi': new_tejabi, 'silver': new_silver}
+    moved = moves(changes, prices)
+
+    def select(subscriptions):
+        return select_targets(subscriptions, changes, prices)
+
+    def wanted(reach):
+        return reaches(reach, moved)
+
+    # Each store shard is loaded, sent to and written back before the next.
+    # Dummy endpoints are skipped (failureCount is still initialized by apply_results)
+    def is_dummy(sub):
+        return "dummy-endpoint" in sub.get('endpoint', '')
+
+    store = SubscriptionStore(backend)
+    try:
+        totals = send_by_shard(store, push_one, select, skip=is_dummy, job=job, wanted=wanted)
+        if not totals['subscriptions'] and os.path.exists('subscriptions.json'):
+            with open('subscriptions.json', 'r') as f:
+                fallback = json.load(f)
+            print(f"DEBUG: Using local subscriptions.json fallback: {len(fallback)}")
+            store.save(fallback, write_manifest=False)
+            fallback = None
+            totals = send_by_shard(store, push_one, select, skip=is_dummy, job=job, wanted=wanted)
+    except Exception as e:
+        print(f"PUSH ERROR: Could not send to subscriptions: {e}")
+        return
+
+    if not totals['subscriptions']:
+        print("PUSH SKIPPED: No subscribers found.")
+        return
+
+    print(f"DEBUG: {totals['targeted']} of {totals['subscriptions']} subscribers matched this move's thresholds.")
+    if totals['resumed']:
+        print(f"DEBUG: Skipped {totals['resumed']} subscriber(s) already sent to by an interrupted run.")
+    print(f"PUSH STATUS: Sent to {totals['sent']} active devices.")
+    if totals['removed'] > 0:
+        print(f"Removed {totals['removed']} subscription(s) after {FAILURE_THRESHOLD}+ consecutive failures")
+
+    if totals['deferred']:
+        print(f"PUSH STATUS: {totals['deferred']} device(s) still throttled; a rerun sends to them.")
+    # Shards were written back only where contents changed (removals or failure count updates)
+    if not totals['save_errors'] and not totals['deferred']:
+        job.finish()
+    print(f"DEBUG: Subscriptions updated. Total: {totals['subscriptions'] - totals['removed']}, "
+          f"shards written: {totals['shards_written']}")
 
 # Currencies tracked in the data history.
 # INR is excluded per requirement: it is a fixed 1.6 NPR peg official rate.
@@ -211,276 +212,497 @@ TRACKED_CURRENCIES = ['USD', 'GBP', 'AUD', 'JPY', 'KRW', 'AED', 'EUR']
 FENEGOSIDA_API = 'https://api.fenegosida.org/api/website/v1/Dashboard/today'
 NRB_APP_RATE = 'https://www.nrb.org.np/api/forex/v1/app-rate'
 NRB_HISTORY = 'https://www.nrb.org.np/api/forex/v1/rates'
+NRB_PER_PAGE = 100
+YAHOO_USD_CHART = 'https://query2.finance.yahoo.com/v8/finance/chart/USDNPR=X'
+ASHESH_WIDGET = 'https://www.ashesh.com.np/gold/widget.php?api=521224q192'
+
+# Overall wall-clock budget for fetching every source in update()
+SOURCE_DEADLINE = float(os.getenv('SCRAPE_DEADLINE', '90'))
+
+@metrics.timed('parse.fenegosida')
+def parse_fenegosida(resp):
+    """Extracts gold/silver (per tola) and USD from a Dashboard/today response."""
+    data = resp.json()
+    result = {'gold': 0, 'silver': 0, 'usd': 0}
+    if not isinstance(data, list):
+        return result
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        label = str(item.get('rateType', ''))
+        value = item.get('todayBaseRatePerGram')
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if 'छापावाल' in label and 'तोला' in label:
+            result['gold'] = int(round(value))
+        elif 'चाँदी' in label and 'तोला' in label:
+            result['silver'] = int(round(value))
+        elif 'ollar' in label:
+            result['usd'] = round(value, 2)
+    return result
 
 def fetch_fenegosida():
     """Fetches today's rates from the FENEGOSIDA JSON API (no HTML/UI dependency)."""
     headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
-    for attempt in range(3):
+    try:
+        return cached_get(FENEGOSIDA_API, parse_fenegosida, headers=headers, timeout=25, verify=False)
+    except Exception as e:
+        print(f"WARNING: FENEGOSIDA API failed: {e}")
+        return {'gold': 0, 'silver': 0, 'usd': 0}
+
+def parse_nrb_history_payload(payload, history_map):
+    """Merges one page of NRB history rows into {date: {code: {buy, sell, unit}}}."""
+    for day in payload:
+        date_key = str(day.get('date', ''))[:10]
+        if not date_key:
+            continue
+        day_map = {}
+        for row in (day.get('rates') or []):
+            cur = row.get('currency') or {}
+            code = cur.get('iso3')
+            if code not in TRACKED_CURRENCIES:
+                continue
+            try:
+                day_map[code] = {
+                    'buy': float(row.get('buy')),
+                    'sell': float(row.get('sell')),
+                    'unit': int(cur.get('unit') or 1)
+                }
+            except (TypeError, ValueError):
+                continue
+        if day_map:
+            history_map[date_key] = day_map
+
+@metrics.timed('parse.nrb_history')
+def parse_nrb_history_page(resp):
+    """One page of NRB history -> {'days': {date: {code: ...}}, 'pages': total pages}."""
+    body = resp.json()
+    days_map = {}
+    parse_nrb_history_payload((body.get('data') or {}).get('payload') or [], days_map)
+    return {'days': days_map, 'pages': (body.get('pagination') or {}).get('pages') or 1}
+
+@metrics.timed('parse.nrb_app_rate')
+def parse_nrb_app_rate(resp):
+    """NRB app-rate feed -> {code: {buy, sell, unit}} for TRACKED_CURRENCIES."""
+    data = resp.json()
+    if isinstance(data, list) and data:
+        data = data[0]
+    live_map = {}
+    for row in (data.get('rates') or []):
+        code = row.get('iso3')
+        if code not in TRACKED_CURRENCIES:
+            continue
         try:
-            r = requests.get(FENEGOSIDA_API, headers=headers, timeout=25, verify=False)
-            r.raise_for_status()
-            data = r.json()
-            result = {'gold': 0, 'silver': 0, 'usd': 0}
-            if not isinstance(data, list):
-                return result
-            for item in data:
-                if not isinstance(item, dict):
-                    continue
-                label = str(item.get('rateType', ''))
-                value = item.get('todayBaseRatePerGram')
-                try:
-                    value = float(value)
-                except (TypeError, ValueError):
-                    continue
-                if 'छापावाल' in label and 'तोला' in label:
-                    result['gold'] = int(round(value))
-                elif 'चाँदी' in label and 'तोला' in label:
-                    result['silver'] = int(round(value))
-                elif 'ollar' in label:
-                    result['usd'] = round(value, 2)
-            return result
-        except Exception as e:
-            print(f"DEBUG: Attempt {attempt+1} failed for FENEGOSIDA API: {e}")
-            if attempt < 2:
-                time.sleep(5)
-    return {'gold': 0, 'silver': 0, 'usd': 0}
+            live_map[code] = {
+                'buy': float(row.get('buy')),
+                'sell': float(row.get('sell')),
+                'unit': int(row.get('unit') or 1)
+            }
+        except (TypeError, ValueError):
+            continue
+    return live_map
 
-def fetch_nrb_currencies(days=95):
+def fetch_nrb_currencies(days=95, since=None):
     """Fetches NPR buy/sell rates for TRACKED_CURRENCIES.
     Returns (live_map, history_map) where:
       live_map: {code: {buy, sell, unit}} for today
-      history_map: {date: {code: {buy, sell, unit}}} for the last `days` days
+      history_map: {date: {code: {buy, sell, unit}}} from `since` (a date
+        already stored with currencies) or the last `days` days, whichever is
+        shorter
     """
     headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
     history_map = {}
     live_map = {}
 
     try:
-        r = requests.get(NRB_APP_RATE, headers=headers, timeout=25, verify=False)
-        r.raise_for_status()
-        data = r.json()
-        if isinstance(data, list) and data:
-            data = data[0]
-        for row in (data.get('rates') or []):
-            code = row.get('iso3')
-            if code not in TRACKED_CURRENCIES:
-                continue
-            try:
-                live_map[code] = {
-                    'buy': float(row.get('buy')),
-                    'sell': float(row.get('sell')),
-                    'unit': int(row.get('unit') or 1)
-                }
-            except (TypeError, ValueError):
-                continue
+        live_map = cached_get(NRB_APP_RATE, parse_nrb_app_rate, headers=headers, timeout=25, verify=False)
     except Exception as e:
         print(f"WARNING: NRB app-rate failed: {e}")
 
     try:
         end = datetime.date.today()
         start = end - datetime.timedelta(days=days)
-        url = f"{NRB_HISTORY}?from={start}&to={end}&per_page=100&page=1"
-        r = requests.get(url, headers=headers, timeout=30, verify=False)
-        r.raise_for_status()
-        payload = (r.json().get('data') or {}).get('payload') or []
-        for day in payload:
-            date_key = str(day.get('date', ''))[:10]
-            if not date_key:
-                continue
-            day_map = {}
-            for row in (day.get('rates') or []):
-                cur = row.get('currency') or {}
-                code = cur.get('iso3')
-                if code not in TRACKED_CURRENCIES:
-                    continue
-                try:
-                    day_map[code] = {
-                        'buy': float(row.get('buy')),
-                        'sell': float(row.get('sell')),
-                        'unit': int(cur.get('unit') or 1)
-                    }
-                except (TypeError, ValueError):
-                    continue
-            if day_map:
-                history_map[date_key] = day_map
+        if since and since > start:
+            start = since
+        # NRB returns one payload row per day, so the page count is known up front
+        window = (end - start).days + 1
+        pages = max(1, -(-window // NRB_PER_PAGE))
+
+        def fetch_page(page):
+            url = f"{NRB_HISTORY}?from={start}&to={end}&per_page={NRB_PER_PAGE}&page={page}"
+            parsed = cached_get(url, parse_nrb_history_page, headers=headers, timeout=30, verify=False)
+            return parsed['days'], parsed['pages']
+
+        if pages == 1:
+            results = [fetch_page(1)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(pages, 4)) as pool:
+                results = list(pool.map(fetch_page, range(1, pages + 1)))
+        # The API may split the window into more pages than expected
+        reported = max(r[1] for r in results)
+        for page in range(pages + 1, reported + 1):
+            results.append(fetch_page(page))
+        for days_map, _ in results:
+            history_map.update(days_map)
+        print(f"INFO: NRB history synced from {start} ({window} days, {len(history_map)} with rates)")
     except Exception as e:
         print(f"WARNING: NRB history failed: {e}")
 
     return live_map, history_map
 
-def get_candidates(url, metal):
+def latest_currency_date(history):
+    """Newest date (datetime.date) in history that already has currency rates."""
+    for entry in reversed(history):
+        if entry.get('currencies'):
+            try:
+                return datetime.date.fromisoformat(str(entry.get('date', ''))[:10])
+            except ValueError:
+                return None
+    return None
+
+def backfill_currencies(history, currency_history):
+    """Fills `currencies` into past entries that lack them via a date index.
+    Only the tail of history covered by currency_history is indexed.
+    Returns the number of entries filled.
+    """
+    if not currency_history:
+        return 0
+    oldest = min(currency_history)
+    by_date = {}
+    for entry in reversed(history):
+        date_key = str(entry.get('date', ''))[:10]
+        if date_key < oldest:
+            break
+        by_date.setdefault(date_key, []).append(entry)
+
+    backfilled = 0
+    for date_key, day_map in currency_history.items():
+        for entry in by_date.get(date_key, ()):
+            if 'currencies' in entry:
+                continue
+            entry['currencies'] = [{'code': code, **day_map[code]} for code in TRACKED_CURRENCIES if code in day_map]
+            backfilled += 1
+    return backfilled
+
+METALS = ('gold', 'tejabi', 'silver')
+
+# Numbers on the page that look like prices but are purity marks, weights,
+# office phone numbers or years
+PURITY_MARKS = [999, 9999, 9990, 9167, 9583, 916, 750]
+WEIGHTS = [1166, 11664]
+OFFICE_NUMS = [453227, 453228, 4532270]
+CANDIDATE_BLACKLIST = frozenset(PURITY_MARKS + WEIGHTS + OFFICE_NUMS + list(range(2000, 2101)))
+
+WHITESPACE_RE = re.compile(r'\s+')
+TOLA_PRICE_RE = re.compile(r'(\d{5,6})')
+SILVER_PRICE_RE = re.compile(r'(\d{4,5})')
+
+# Ashesh widget rows: labels that identify each metal's "Tola" row
+ASHESH_ROW_LABELS = {
+    'gold': ("Gold Hallmark", "छापावाल"),
+    'tejabi': ("Gold Tajabi", "Gold Tejabi", "तेजाबी"),
+    'silver': ("Silver", "चाँदी"),
+}
+ASHESH_ROW_PRICE_RE = {'gold': TOLA_PRICE_RE, 'tejabi': TOLA_PRICE_RE, 'silver': SILVER_PRICE_RE}
+
+# Generic page-text fallback: (label pattern, bare-number pattern, min, max)
+TEXT_PATTERNS = {
+    'gold': (re.compile(r"(?:FINE|Hallmark|Tola|छापावाल).{0,100}?(\d{5,6})", re.IGNORECASE | re.DOTALL),
+             TOLA_PRICE_RE, 100000, 1000000),
+    'tejabi': (re.compile(r"(?:Tejabi|Tajabi|तेजाबी|Tola).{0,100}?(\d{5,6})", re.IGNORECASE | re.DOTALL),
+               TOLA_PRICE_RE, 100000, 1000000),
+    'silver': (re.compile(r"(?:SILVER|Tola|चाँदी).{0,100}?(\d{4,5})", re.IGNORECASE | re.DOTALL),
+               SILVER_PRICE_RE, 1000, 15000),
+}
+
+class CountryRowParser(HTMLParser):
+    """Streaming fast path for extract_candidates().
+
+    Walks the page once with the stdlib event parser and keeps only what the
+    matchers need: the text of every div.country row and the page text outside
+    script/style/footer/header/nav/aside. Strings are joined with ' ' exactly
+    like BeautifulSoup's get_text(separator=' '), so both paths see the same text.
+    """
+
+    JUNK_TAGS = frozenset(["script", "style", "footer", "header", "nav", "aside"])
+    RAW_TEXT_TAGS = frozenset(["script", "style"])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.content = []
+        self._open_rows = []  # (div depth, row index)
+        self._div_depth = 0
+        self._junk_depth = 0
+        self._raw_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.JUNK_TAGS:
+            self._junk_depth += 1
+            if tag in self.RAW_TEXT_TAGS:
+                self._raw_depth += 1
+        elif tag == 'div':
+            self._div_depth += 1
+            for name, value in attrs:
+                if name == 'class' and value and 'country' in value.split():
+                    self.rows.append([])
+                    self._open_rows.append((self._div_depth, len(self.rows) - 1))
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in self.JUNK_TAGS:
+            if self._junk_depth:
+                self._junk_depth -= 1
+            if tag in self.RAW_TEXT_TAGS and self._raw_depth:
+                self._raw_depth -= 1
+        elif tag == 'div' and self._div_depth:
+            while self._open_rows and self._open_rows[-1][0] >= self._div_depth:
+                self._open_rows.pop()
+            self._div_depth -= 1
+
+    def handle_data(self, data):
+        # get_text() never includes script/style strings, even inside a row
+        if self._raw_depth:
+            return
+        for _, index in self._open_rows:
+            self.rows[index].append(data)
+        if not self._junk_depth:
+            self.content.append(data)
+
+def _match_rows(row_texts, found):
+    """Ashesh widget rows: one 'Tola' row per metal."""
+    for text in row_texts:
+        if "Tola" not in text:
+            continue
+        for metal in METALS:
+            if any(label in text for label in ASHESH_ROW_LABELS[metal]):
+                m = ASHESH_ROW_PRICE_RE[metal].search(text)
+                if m: found[metal].append(int(m.group(1)))
+
+def _match_text(content, metals, found):
+    """Generic fallback: label-anchored numbers in the visible page text."""
+    for metal in metals:
+        pattern, raw_pattern, min_p, max_p = TEXT_PATTERNS[metal]
+        matches = pattern.findall(content)
+        if not matches:
+            matches = raw_pattern.findall(content)
+        for m in matches:
+            val = int(m)
+            if val in CANDIDATE_BLACKLIST: continue
+            if min_p <= val <= max_p:
+                found[metal].append(val)
+
+def extract_candidates_fast(raw_html, url):
+    """Single streaming pass with CountryRowParser. Expects preprocessed HTML."""
+    parser = CountryRowParser()
+    parser.feed(raw_html)
+    parser.close()
+    found = {metal: [] for metal in METALS}
+    if "ashesh.com.np" in url:
+        _match_rows([' '.join(row) for row in parser.rows], found)
+    missing = [metal for metal in METALS if not found[metal]]
+    if missing:
+        _match_text(' '.join(parser.content), missing, found)
+    return found
+
+def extract_candidates_soup(raw_html, url):
+    """BeautifulSoup path. Expects preprocessed HTML."""
+    soup = BeautifulSoup(raw_html, 'html.parser')
+    found = {metal: [] for metal in METALS}
+    if "ashesh.com.np" in url:
+        _match_rows([row.get_text(separator=' ') for row in soup.find_all('div', class_='country')], found)
+    missing = [metal for metal in METALS if not found[metal]]
+    if missing:
+        for junk in soup(["script", "style", "footer", "header", "nav", "aside"]):
+            junk.decompose()
+        _match_text(soup.get_text(separator=' '), missing, found)
+    return found
+
+def preprocess_html(raw_html):
+    return WHITESPACE_RE.sub(' ', raw_html.replace(',', ''))
+
+@metrics.timed('parse.candidates')
+def extract_candidates(raw_html, url):
+    """Extracts price candidates for every metal from one page in a single parse.
+    Uses the streaming parser and falls back to BeautifulSoup for any metal it
+    could not find. Returns {metal: [prices]}.
+    """
+    raw_html = preprocess_html(raw_html)
+    try:
+        found = extract_candidates_fast(raw_html, url)
+    except Exception as e:
+        print(f"DEBUG: Fast HTML extractor failed for {url}: {e}")
+        found = {metal: [] for metal in METALS}
+
+    missing = [metal for metal in METALS if not found[metal]]
+    if missing:
+        fallback = extract_candidates_soup(raw_html, url)
+        for metal in missing:
+            found[metal] = fallback[metal]
+    return found
+
+def get_all_candidates(url):
+    """Fetches `url` once and returns {metal: [prices]} for gold, tejabi and silver."""
     headers = {'User-Agent': 'Mozilla/5.0'}
-    purity = [999, 9999, 9990, 9167, 9583, 916, 750]
-    weights = [1166, 11664]
-    office_nums = [453227, 453228, 4532270]
-    years = list(range(2000, 2101))
-    blacklist = set(purity + weights + office_nums + years)
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            r = requests.get(url, headers=headers, timeout=25, verify=False)
-            r.raise_for_status()
-            raw_html = r.text.replace(',', '')
-            raw_html = re.sub(r'\s+', ' ', raw_html)
-            
-            soup = BeautifulSoup(raw_html, 'html.parser')
-            
-            if "ashesh.com.np" in url:
-                rows = soup.find_all('div', class_='country')
-                prices = []
-                for row in rows:
-                    text = row.get_text(separator=' ')
-                    if "Tola" in text:
-                        if metal == "gold" and ("Gold Hallmark" in text or "छापावाल" in text):
-                            m = re.search(r'(\d{5,6})', text)
-                            if m: prices.append(int(m.group(1)))
-                        elif metal == "tejabi" and ("Gold Tajabi" in text or "Gold Tejabi" in text or "तेजाबी" in text):
-                            m = re.search(r'(\d{5,6})', text)
-                            if m: prices.append(int(m.group(1)))
-                        elif metal == "silver" and ("Silver" in text or "चाँदी" in text):
-                            m = re.search(r'(\d{4,5})', text)
-                            if m: prices.append(int(m.group(1)))
-                if prices: return prices
-
-            for junk in soup(["script", "style", "footer", "header", "nav", "aside"]):
-                junk.decompose()
-            content = soup.get_text(separator=' ')
-
-            if metal == "gold":
-                pattern = r"(?:FINE|Hallmark|Tola|छापावाल).{0,100}?(\d{5,6})"
-                min_p, max_p = 100000, 1000000
-            elif metal == "tejabi":
-                pattern = r"(?:Tejabi|Tajabi|तेजाबी|Tola).{0,100}?(\d{5,6})"
-                min_p, max_p = 100000, 1000000
-            else:
-                pattern = r"(?:SILVER|Tola|चाँदी).{0,100}?(\d{4,5})"
-                min_p, max_p = 1000, 15000
-
-            matches = re.findall(pattern, content, re.IGNORECASE | re.DOTALL)
-            if not matches:
-                raw_p = r"(\d{5,6})" if metal in ["gold", "tejabi"] else r"(\d{4,5})"
-                matches = re.findall(raw_p, content)
-
-            valid = []
-            for m in matches:
-                val = int(m)
-                if val in blacklist: continue
-                if min_p <= val <= max_p:
-                    valid.append(val)
-            if valid: return valid
-            
-            # If no valid prices found but request was successful, don't retry, just return empty
-            return []
-            
-        except Exception as e:
-            print(f"DEBUG: Attempt {attempt+1} failed for {url} ({metal}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(5)
-            else:
-                print(f"ERROR: All {max_retries} attempts failed for {url}")
-                return []
+    try:
+        r = http_client.get(url, headers=headers, timeout=25, verify=False)
+        r.raise_for_status()
+        # If no valid prices are found but the request was successful, that's the answer
+        return extract_candidates(r.text, url)
+    except Exception as e:
+        print(f"ERROR: Could not fetch candidates from {url}: {e}")
+    return {metal: [] for metal in METALS}
+
+def get_candidates(url, metal):
+    """Single-metal wrapper around get_all_candidates()."""
+    return get_all_candidates(url)[metal]
 
 
-def verify_price(primary, backup, tolerance=0.05):
-    if primary > 0 and backup > 0:
-        diff = abs(primary - backup) / primary
-        if diff <= tolerance:
-            return primary, True
-        else:
-            print(f"VERIFICATION WARNING: Primary {primary} and Backup {backup} differ by {diff:.2%}")
-            return primary, False
-    return primary or backup, False
+@metrics.timed('parse.yahoo_usd')
+def parse_usd_history(resp):
+    """Yahoo chart response -> {date: close}."""
+    data = resp.json()
+    result = data.get('chart', {}).get('result', [{}])[0]
+    if not result or 'timestamp' not in result:
+        return {}
+    
+    timestamps = result['timestamp']
+    closes = result.get('indicators', {}).get('quote', [{}])[0].get('close', [])
+    
+    history = {}
+    for i, ts in enumerate(timestamps):
+        if i < len(closes) and closes[i] is not None:
+            date_str = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d")
+            history[date_str] = round(float(closes[i]), 2)
+    return history
 
 def fetch_usd_history(days=90):
     try:
-        url = f"https://query2.finance.yahoo.com/v8/finance/chart/USDNPR=X?interval=1d&range={days}d"
+        url = f"{YAHOO_USD_CHART}?interval=1d&range={days}d"
         headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url, headers=headers, timeout=15)
-        r.raise_for_status()
-        data = r.json()
-        result = data.get('chart', {}).get('result', [{}])[0]
-        if not result or 'timestamp' not in result:
-            return {}
-        
-        timestamps = result['timestamp']
-        closes = result.get('indicators', {}).get('quote', [{}])[0].get('close', [])
-        
-        history = {}
-        for i, ts in enumerate(timestamps):
-            if i < len(closes) and closes[i] is not None:
-                date_str = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m-%d")
-                history[date_str] = round(float(closes[i]), 2)
-        return history
+        return cached_get(url, parse_usd_history, headers=headers, timeout=15)
     except Exception as e:
         print(f"WARNING: Could not fetch USD history: {e}")
         return {}
 
-def update():
-    file = 'public/data.json'
-    timestamp = int(time.time())
-    widget_url = f"https://www.ashesh.com.np/gold/widget.php?api=521224q192&t={timestamp}"
+def fetch_sources(jobs, deadline=None):
+    """Runs the given sources concurrently under a single wall-clock deadline.
+    `jobs` maps name -> (fn, args, default). Returns name -> result; a source
+    that raises or is still running at the deadline counts as failed and
+    yields its default.
+    """
+    deadline = SOURCE_DEADLINE if deadline is None else deadline
+    finished = {}
 
-    f_data = fetch_fenegosida()
-    f_gold = [f_data['gold']] if f_data['gold'] > 0 else []
-    f_silver = [f_data['silver']] if f_data['silver'] > 0 else []
-    f_usd = f_data['usd']
+    def run(name, fn, args):
+        try:
+            with metrics.span(f"fetch.{name}"):
+                finished[name] = fn(*args)
+        except Exception as e:
+            print(f"WARNING: {name} failed: {e}")
+
+    # Daemon threads: a source stuck in its retry loop must not hold the
+    # process open after the deadline has passed.
+    threads = {name: threading.Thread(target=run, args=(name, fn, args), daemon=True)
+               for name, (fn, args, _) in jobs.items()}
+    for t in threads.values():
+        t.start()
+    end = time.monotonic() + deadline
+    for t in threads.values():
+        t.join(max(0, end - time.monotonic()))
+
+    results = {}
+    for name, (_, _, default) in jobs.items():
+        if name in finished:
+            metrics.count('source.result', source=name, result='ok')
+            results[name] = finished[name]
+            continue
+        if threads[name].is_alive():
+            print(f"WARNING: {name} missed the {deadline:g}s source deadline, treating as failed")
+        metrics.count('source.result', source=name, result='late' if threads[name].is_alive() else 'failed')
+        results[name] = default
+    return results
 
-    a_gold = get_candidates(widget_url, "gold")
-    a_tejabi = get_candidates(widget_url, "tejabi")
-    a_silver = get_candidates(widget_url, "silver")
+# Records read from the end of the history log per run. Covers the 95-day
+# NRB backfill window plus the last-record comparisons.
+HISTORY_TAIL = 120
 
-    live_currencies, currency_history = fetch_nrb_currencies(days=95)
-    
-    usd_history_map = fetch_usd_history(days=90)
-    live_usd = 0
-    if usd_history_map:
-        sorted_dates = sorted(usd_history_map.keys(), reverse=True)
-        live_usd = usd_history_map[sorted_dates[0]]
-
-    # Prefer FENEGOSIDA's own dollar rate, then NRB, then Yahoo as last resort
-    if f_usd > 0:
-        live_usd = f_usd
-    elif 'USD' in live_currencies:
-        live_usd = live_currencies['USD']['sell']
-
-    primary_gold = max(f_gold) if f_gold else 0
-    backup_gold = max(a_gold) if a_gold else 0
-    final_gold, gold_verified = verify_price(primary_gold, backup_gold)
-    
-    primary_silver = max(f_silver) if f_silver else 0
-    backup_silver = max(a_silver) if a_silver else 0
-    final_silver, silver_verified = verify_price(primary_silver, backup_silver)
-    
-    # Tejabi logic: Prioritize Ashesh (FENEGOSIDA's new site no longer publishes tejabi)
-    backup_tejabi = max(a_tejabi) if a_tejabi else 0
-    
-    if backup_tejabi > 0:
-        final_tejabi = backup_tejabi
-        tejabi_verified = True
-        tejabi_source = "Ashesh (Tejabi)"
-    else:
-        final_tejabi = int(final_gold * 0.991)
-        tejabi_verified = False
-        tejabi_source = "Calculated"
+def update():
+    """One scrape: fetch, verify, notify, store and publish. Its metrics file
+    is written even when the run fails."""
+    http_client.start_run()
+    with metrics.run('scrape'):
+        _update()
+
+def _update():
+    timestamp = int(time.time())
+    widget_url = f"{ASHESH_WIDGET}&t={timestamp}"
+
+    # Only the recent tail of the append-only log is loaded; every decision
+    # below looks at the last few records or the NRB backfill window.
+    log = open_history_log()
+    try:
+        with metrics.span('history.load') as span:
+            history = log.tail(HISTORY_TAIL)
+            span['records'] = len(history)
+    except Exception as e:
+        print(f"WARNING: Could not read history log: {e}")
+        history = []
+    tail_len = len(history)
+
+    # NRB sync is incremental: only dates after the newest stored rates
+    currency_since = latest_currency_date(history)
+
+    # Sources are fetched lazily in priority order (FENEGOSIDA, NRB, Ashesh,
+    # Yahoo) until a quorum agrees on each value; NRB is always fetched for
+    # the currency table. Each wave runs concurrently under what is left of
+    # the deadline, and a source that misses it counts as failed.
+    decisions, fetched = resolve([
+        Source('fenegosida', fetch_fenegosida, (), {'gold': 0, 'silver': 0, 'usd': 0},
+               ('gold', 'silver', 'usd'), lambda r: r),
+        Source('nrb', fetch_nrb_currencies, (95, currency_since), ({}, {}),
+               ('usd',), lambda r: {'usd': r[0].get('USD', {}).get('sell', 0)}),
+        Source('ashesh', get_all_candidates, (widget_url,), {metal: [] for metal in METALS},
+               METALS, lambda r: {metal: max(r[metal]) for metal in METALS if r[metal]}),
+        Source('yahoo_usd', fetch_usd_history, (90,), {},
+               ('usd',), lambda r: {'usd': r[max(r)]} if r else {}),
+    ], ('gold', 'silver', 'tejabi', 'usd'), history, fetch_sources, required=('nrb',), deadline=SOURCE_DEADLINE)
+
+    # Keep the conditional-GET response cache bounded
+    try:
+        evicted = default_cache().evict()
+        if evicted:
+            print(f"INFO: Evicted {evicted} stale response cache entries")
+    except OSError as e:
+        print(f"WARNING: Could not evict response cache: {e}")
+
+    live_currencies, currency_history = fetched['nrb']
+    live_usd = decisions['usd'][0]
+
+    with metrics.span('verify') as span:
+        final_gold, gold_source, gold_verified = decisions['gold']
+        final_silver, _, silver_verified = decisions['silver']
+
+        # Tejabi logic: Ashesh only (FENEGOSIDA's new site no longer publishes tejabi)
+        final_tejabi, _, tejabi_verified = decisions['tejabi']
+        if final_tejabi > 0:
+            tejabi_source = "Ashesh (Tejabi)"
+        else:
+            final_tejabi = int(final_gold * 0.991)
+            tejabi_verified = False
+            tejabi_source = "Calculated"
+        span.update(gold_verified=gold_verified, silver_verified=silver_verified,
+                    tejabi_source=tejabi_source)
 
     sources = []
-    if f_gold and final_gold == primary_gold: sources.append("FENEGOSIDA")
-    elif a_gold: sources.append("Ashesh")
+    if gold_source == 'fenegosida': sources.append("FENEGOSIDA")
+    elif gold_source == 'ashesh': sources.append("Ashesh")
     sources.append(tejabi_source)
     
     source_info = " / ".join(sources) if sources else "None"
     
-    history = []
-    if os.path.exists(file):
-        try:
-            with open(file, 'r') as f: 
-                content = f.read().strip()
-                if content:
-                    history = json.loads(content)
-        except:
-            history = []
-
     if (final_gold == 0 or final_silver == 0) and history:
         final_gold = final_gold or history[-1].get('gold', 0)
         final_silver = final_silver or history[-1].get('silver', 0)
@@ -517,6 +739,12 @@ def update():
             if key < today_key:
                 fallback_day = currency_history[key]
                 break
+    if fallback_day is None:
+        # Incremental sync may not cover yesterday; use the newest stored rates
+        for entry in reversed(history):
+            if entry.get('currencies'):
+                fallback_day = {c['code']: {k: v for k, v in c.items() if k != 'code'} for c in entry['currencies']}
+                break
     for code in TRACKED_CURRENCIES:
         if code in live_currencies:
             today_currencies.append({'code': code, **live_currencies[code]})
@@ -525,17 +753,10 @@ def update():
             if prev:
                 today_currencies.append({'code': code, **prev})
 
-    # Backfill currency history into past entries (up to 3 months)
-    backfilled = 0
-    for entry in history:
-        date_key = str(entry.get('date', ''))[:10]
-        if 'currencies' in entry:
-            continue
-        day_map = currency_history.get(date_key)
-        if not day_map:
-            continue
-        entry['currencies'] = [{'code': code, **day_map[code]} for code in TRACKED_CURRENCIES if code in day_map]
-        backfilled += 1
+    # Backfill newly synced currency history into past entries
+    with metrics.span('history.backfill') as span:
+        backfilled = backfill_currencies(history, currency_history)
+        span['filled'] = backfilled
     if backfilled:
         print(f"INFO: Backfilled currency history into {backfilled} past entries")
 
@@ -556,12 +777,84 @@ def update():
         if not new_entry['currencies']:
             new_entry['currencies'] = history[-1].get('currencies', [])
         history[-1] = new_entry
+        replaced = 1
     else:
         history.append(new_entry)
+        replaced = 0
+
+    # Backfilled entries rewrite the loaded tail; otherwise only the last line
+    # is replaced or a new one appended.
+    indexed = source_fingerprint(log.path)
+    with metrics.span('history.write', replaced=replaced, backfilled=backfilled):
+        if backfilled:
+            log.replace_tail(tail_len, history)
+        else:
+            log.replace_tail(replaced, history[-1:])
+
+    with metrics.span('history.compact') as span:
+        span['rebuilt'] = log.compact(SNAPSHOT, SNAPSHOT_LIMIT)
+    if span['rebuilt']:
+        print(f"INFO: Rebuilt {SNAPSHOT} from {log.path}")
+
+    # Tiered retention: move records older than the hot window into the
+    # yearly archive partitions instead of dropping them
+    try:
+        with metrics.span('history.archive') as span:
+            moved = span['moved'] = archive_overflow(log)
+        if moved:
+            print(f"INFO: Archived {moved} record(s) into {ARCHIVE_DIR}")
+    except Exception as e:
+        print(f"WARNING: Could not archive old history: {e}")
+
+    # Refresh the memory-mapped history index so later tools open it instantly.
+    # Backfills only touch currencies, so the index changes only at its tail.
+    try:
+        with metrics.span('history.index') as span:
+            span['records'] = len(update_history(history[-1:], replaced, indexed, log=log))
+    except Exception as e:
+        print(f"WARNING: Could not refresh history index: {e}")
+
+    # Columnar, delta-encoded files for the chart ranges
+    try:
+        from chart_ranges import RANGES, RANGES_DIR, write_range_files
+    except ImportError:
+        print("RANGES SKIPPED: numpy not installed.")
+    else:
+        try:
+            with metrics.span('publish.ranges') as span:
+                written = span['written'] = write_range_files(log.tail(max(size for _, size in RANGES)), TRACKED_CURRENCIES)
+            print(f"INFO: Wrote {written} chart range file(s) to {RANGES_DIR}")
+        except Exception as e:
+            print(f"WARNING: Could not write chart range files: {e}")
+
+    try:
+        from fx_matrix import FX_FILE, fx_records, write_fx_file
+    except ImportError:
+        print("FX SKIPPED: numpy not installed.")
+    else:
+        try:
+            # Full history: the archive part comes from a cache that is only
+            # refreshed when the archive changes
+            with metrics.span('publish.fx') as span:
+                span['written'] = write_fx_file(fx_records(log, TRACKED_CURRENCIES), TRACKED_CURRENCIES)
+            if span['written']:
+                print(f"INFO: Wrote cross rates to {FX_FILE}")
+        except Exception as e:
+            print(f"WARNING: Could not write cross rates: {e}")
+
+    try:
+        from analytics import SUMMARY_FILE, update_summary
+    except ImportError:
+        print("ANALYTICS SKIPPED: numpy not installed.")
+    else:
+        try:
+            with metrics.span('publish.summary') as span:
+                span['rebuilt'] = update_summary(log)
+            mode = "Rebuilt" if span['rebuilt'] else "Updated"
+            print(f"INFO: {mode} analytics summary {SUMMARY_FILE}")
+        except Exception as e:
+            print(f"WARNING: Could not update analytics summary: {e}")
 
-    with open(file, 'w') as f:
-        json.dump(history[-1000:], f, indent=4)
-    
     print(f"SUCCESS: Gold {final_gold} (tola), Tejabi {final_tejabi} (tola), Silver {final_silver} (tola), USD {live_usd} via {source_info}")
     if live_currencies:
         print(f"INFO: Stored {len(today_currencies)} currency rates for today")
@@ -570,6 +863,25 @@ if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--test-notify":
         print("RUNNING NOTIFICATION TEST...")
-        send_push_notification(120000, 119000, 1450, 100, 100, 10)
+        with metrics.run('push'):
+            send_push_notification(120000, 119000, 1450, 100, 100, 10, job_key=f"test-{int(time.time())}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "--notify-latest":
+        # Push the change between the two newest history records
+        with metrics.run('push'):
+            latest = load_history().latest(2)
+            if not latest:
+                print("PUSH SKIPPED: No history records.")
+            else:
+                cur, prev = latest[-1], latest[0]
+                diff_g = cur['gold'] - prev['gold']
+                diff_t = cur['tejabi'] - prev['tejabi']
+                diff_s = cur['silver'] - prev['silver']
+                if diff_g != 0 or diff_t != 0 or diff_s != 0:
+                    send_push_notification(cur['gold'], cur['tejabi'], cur['silver'], diff_g, diff_t, diff_s)
+                else:
+                    print("No change detected between last two records. Notification skipped.")
+    elif len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        from poll_daemon import run
+        run(FENEGOSIDA_API, update)
     else:
         update()
@@ -2,11 +2,24 @@
 # This software is proprietary and may not be copied, modified, or distributed.
 # See LICENSE file for details.
 
+import argparse
 import json
+import multiprocessing
 import os
-import requests
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pywebpush import webpush, WebPushException
 
+import http_client
+import metrics
+from broadcast_job import BroadcastJob
+from history_index import load_history
+from push_engine import (FAILURE_THRESHOLD, PUSH_TIMEOUT, PUSH_TTL, THROTTLE_STATUSES, PushThrottled,
+                         delivery_headers, record_send, send_by_shard)
+from subscription_store import SubscriptionStore, open_backend
+from targeting import METALS, moves, reaches, select_targets
+from vapid_signer import VapidSigner
+
 # VAPID Keys - Load from environment
 VAPID_PRIVATE_KEY = os.environ.get("VAPID_PRIVATE_KEY")
 VAPID_PUBLIC_KEY = os.environ.get("VAPID_PUBLIC_KEY", "BK4UiqZsmzcWoQR_JFmuAhQQ2R7JQEIxC83Tppc8VxBwd4a3mXztqyv31Q9XJ3Ab6Yq_aqbExGlNMX2NP2j5zAQ")
@@ -17,25 +30,32 @@ print(f"DEBUG: VAPID_PRIVATE_KEY present: {bool(VAPID_PRIVATE_KEY)}")
 print(f"DEBUG: VAPID_PUBLIC_KEY: {VAPID_PUBLIC_KEY[:20]}...")
 print(f"DEBUG: VAPID_EMAIL: {VAPID_EMAIL}")
 
-def send_web_push(subscription, data):
+def send_web_push(subscription, data, signer):
     """Send web push notification with proper VAPID configuration
+    `data` is the already-serialized payload; `signer` is a shared VapidSigner.
     Returns: tuple (success: bool, failure_count: int)
     """
+    started = time.perf_counter()
     try:
         print(f"DEBUG: Sending push to endpoint: {subscription.get('endpoint', 'unknown')[:50]}...")
         
-        # Ensure VAPID claims include proper email format
-        vapid_claims = {"sub": VAPID_EMAIL}
-        
-        webpush(
+        resp = webpush(
             subscription_info=subscription,
-            data=json.dumps(data),
-            vapid_private_key=VAPID_PRIVATE_KEY,
-            vapid_claims=vapid_claims
+            data=data,
+            headers=delivery_headers(signer.headers_for(subscription['endpoint'])),
+            ttl=PUSH_TTL,
+            requests_session=http_client.session(),
+            timeout=PUSH_TIMEOUT
         )
+        record_send(subscription['endpoint'], started, resp.status_code)
         print(f"DEBUG: Push sent successfully")
         return (True, 0)  # Success, reset failure count to 0
     except WebPushException as ex:
+        response = getattr(ex, 'response', None)
+        record_send(subscription['endpoint'], started, response.status_code if response is not None else 'error')
+        if response is not None and response.status_code in THROTTLE_STATUSES:
+            # Rate limited by the push service: fan_out() requeues, no failure counted
+            raise PushThrottled(response.status_code, http_client.parse_retry_after(response.headers.get('Retry-After')))
         print(f"Push failed for one device: WebPushException: {ex}")
         # Extract more details from the exception
         if hasattr(ex, 'response') and ex.response:
@@ -57,19 +77,32 @@ def send_web_push(subscription, data):
         current_count = subscription.get('failureCount', 0)
         return (False, current_count + 1)
     except Exception as e:
+        record_send(subscription.get('endpoint', ''), started, type(e).__name__)
         print(f"Unexpected push error: {type(e).__name__}: {e}")
         current_count = subscription.get('failureCount', 0)
         return (False, current_count + 1)
 
-def main():
+def broadcast(shard=None, write_manifest=True):
+    """Notifies subscribers about the latest price change.
+
+    `shard` is (index, count): the run then only loads, sends to and writes
+    back store shards s with s % count == index, so several processes or CI
+    runners can share one broadcast without touching each other's shards.
+    Returns a summary dict, or None when nothing was sent.
+    """
+    http_client.start_run()
+    with metrics.run('push' if shard is None else f"push-{shard[0]}of{shard[1]}"):
+        return _broadcast(shard, write_manifest)
+
+
+def _broadcast(shard, write_manifest):
     if not VAPID_PRIVATE_KEY:
         print("VAPID_PRIVATE_KEY not found in environment")
         return
 
-    # Load data
+    # The last two records from the history index (memory-mapped snapshot)
     try:
-        with open("public/data.json", "r") as f:
-            price_data = json.load(f)
+        price_data = load_history().latest(2)
     except Exception as e:
         print(f"Error loading price data: {e}")
         return
@@ -111,96 +144,140 @@ def main():
         "badge": "/logo512.png"
     }
 
-    # Load subscriptions from Vercel Blob
-    blob_token = os.getenv('BLOB_READ_WRITE_TOKEN')
-    if not blob_token:
+    # Subscriptions live in the sharded store (Vercel Blob or SUBSCRIPTION_STORE_DIR)
+    backend = open_backend()
+    if not backend:
         print("Error: BLOB_READ_WRITE_TOKEN missing")
         return
 
-    subscriptions = []
+    # Skip dummy/test endpoints (failureCount is still initialized by apply_results)
+    def is_dummy(sub):
+        endpoint = sub.get('endpoint', '')
+        return 'dummy' in endpoint.lower() or not endpoint
+
+    # Parse the VAPID key once; JWTs are signed once per push-service origin
     try:
-        headers = {"Authorization": f"Bearer {blob_token}"}
-        list_url = "https://blob.vercel-storage.com/"
-        print(f"DEBUG: Fetching subscriptions from Blob...")
-        resp = requests.get(list_url, headers=headers, timeout=10)
-        if resp.status_code == 200:
-            blobs = resp.json().get('blobs', [])
-            target = next((b for b in blobs if 'subscriptions/data.json' in b['pathname']), None)
-            if target:
-                sub_resp = requests.get(target['url'], timeout=10)
-                if sub_resp.status_code == 200:
-                    subscriptions = sub_resp.json()
-                    print(f"DEBUG: Successfully loaded {len(subscriptions)} subscriptions from Blob.")
-        
-        if not subscriptions:
-            print("No subscriptions found in Blob, checking local fallback...")
-            if os.path.exists('subscriptions.json'):
-                with open('subscriptions.json', 'r') as f:
-                    subscriptions = json.load(f)
-                    print(f"DEBUG: Loaded {len(subscriptions)} subscriptions from local file.")
+        signer = VapidSigner(VAPID_PRIVATE_KEY, VAPID_EMAIL)
+    except Exception as e:
+        print(f"Error loading VAPID_PRIVATE_KEY: {e}")
+        return
+    data = json.dumps(notification_data)
+
+    # One job per alert; a rerun after a crash resumes it
+    job = BroadcastJob(backend, current['date'], data, shard=shard)
+    if job.done:
+        print(f"PUSH SKIPPED: Broadcast {job.id} already completed.")
+        return
+
+    # Only subscribers whose metal/threshold preferences this move reaches;
+    # shards nobody in which it reaches are not even read
+    changes = {metal: current[metal] - previous[metal] for metal in METALS}
+    prices = {metal: current[metal] for metal in METALS}
+    moved = moves(changes, prices)
+
+    def select(subscriptions):
+        return select_targets(subscriptions, changes, prices)
+
+    def wanted(reach):
+        return reaches(reach, moved)
+
+    # Each store shard is loaded, sent to and written back before the next
+    store = SubscriptionStore(backend, owner=shard)
+    try:
+        print("DEBUG: Sending to subscriptions from store, one shard at a time...")
+        totals = send_by_shard(store, lambda sub: send_web_push(sub, data, signer), select,
+                               skip=is_dummy, job=job, write_manifest=write_manifest, wanted=wanted)
+        if not totals['subscriptions'] and os.path.exists('subscriptions.json'):
+            print("No subscriptions found in store, checking local fallback...")
+            with open('subscriptions.json', 'r') as f:
+                fallback = [sub for sub in json.load(f) if store.owns_endpoint(sub.get('endpoint', ''))]
+            print(f"DEBUG: Loaded {len(fallback)} subscriptions from local file.")
+            store.save(fallback, write_manifest=False)
+            fallback = None
+            totals = send_by_shard(store, lambda sub: send_web_push(sub, data, signer), select,
+                                   skip=is_dummy, job=job, write_manifest=write_manifest, wanted=wanted)
     except Exception as e:
-        print(f"Error loading subscriptions: {e}")
+        print(f"Error sending to subscriptions: {e}")
         return
 
-    if not subscriptions:
+    if not totals['subscriptions']:
         print("PUSH SKIPPED: No subscriptions available.")
         return
 
-    print(f"Sending push to {len(subscriptions)} devices...")
-    FAILURE_THRESHOLD = 6  # Remove subscription after 6 consecutive failures
-    success_count = 0
-    failed_count = 0
-    updated_subscriptions = []  # Track subscriptions with updated failure counts
-    has_changes = False  # Track if any failure counts changed
-    
-    for sub in subscriptions:
-        # Skip dummy/test endpoints but ensure failureCount is initialized
-        endpoint = sub.get('endpoint', '')
-        if 'dummy' in endpoint.lower() or not endpoint:
-            print(f"DEBUG: Skipping dummy/invalid endpoint")
-            if 'failureCount' not in sub:
-                sub['failureCount'] = 0
-            updated_subscriptions.append(sub)
-            continue
-            
-        success, new_failure_count = send_web_push(sub, notification_data)
-        if success:
-            success_count += 1
-            if sub.get('failureCount', 0) != 0:
-                has_changes = True
-            sub['failureCount'] = 0  # Reset on success
-            updated_subscriptions.append(sub)
-        else:
-            failed_count += 1
-            sub['failureCount'] = new_failure_count
-            has_changes = True
-            if new_failure_count < FAILURE_THRESHOLD:
-                updated_subscriptions.append(sub)
-                print(f"DEBUG: Subscription kept (failures: {new_failure_count}/{FAILURE_THRESHOLD})")
-            else:
-                print(f"DEBUG: Removing subscription after {new_failure_count} consecutive failures")
-
-    print(f"PUSH STATUS: Sent to {success_count} active devices.")
-    if failed_count > 0:
-        print(f"PUSH STATUS: Failed for {failed_count} devices (may be expired subscriptions).")
-    
-    # Save updated subscriptions with failure counts
-    removed_count = len(subscriptions) - len(updated_subscriptions)
-    if removed_count > 0:
-        print(f"Removed {removed_count} subscription(s) after {FAILURE_THRESHOLD}+ consecutive failures")
-    
-    # Save if there are changes (removals or failure count updates)
-    if removed_count > 0 or has_changes:
-        try:
-            headers = {"Authorization": f"Bearer {blob_token}", "Content-Type": "application/json"}
-            put_url = "https://blob.vercel-storage.com/subscriptions/data.json"
-            put_resp = requests.put(put_url, headers=headers, data=json.dumps(updated_subscriptions, indent=2), timeout=10)
-            if put_resp.status_code in [200, 201]:
-                print(f"DEBUG: Successfully updated subscriptions. Total: {len(updated_subscriptions)}")
-            else:
-                print(f"DEBUG: Failed to update subscriptions: {put_resp.status_code}")
-        except Exception as e:
-            print(f"ERROR: Failed to update subscriptions: {e}")
+    print(f"DEBUG: {totals['targeted']} of {totals['subscriptions']} subscribers matched this move's thresholds.")
+    if totals['resumed']:
+        print(f"DEBUG: Skipped {totals['resumed']} subscriber(s) already sent to by an interrupted run.")
+    print(f"PUSH STATUS: Sent to {totals['sent']} active devices.")
+    if totals['failed'] > 0:
+        print(f"PUSH STATUS: Failed for {totals['failed']} devices (may be expired subscriptions).")
+    if totals['removed'] > 0:
+        print(f"Removed {totals['removed']} subscription(s) after {FAILURE_THRESHOLD}+ consecutive failures")
+
+    if totals['deferred']:
+        print(f"PUSH STATUS: {totals['deferred']} device(s) still throttled; a rerun sends to them.")
+    # Shards were written back only where contents changed (removals or failure count updates)
+    if not totals['save_errors'] and not totals['deferred']:
+        job.finish()
+    print(f"DEBUG: Subscriptions updated. Total: {totals['subscriptions'] - totals['removed']}, "
+          f"shards written: {totals['shards_written']}")
+    return {key: totals[key] for key in ('sent', 'failed', 'removed', 'shards_written')}
+
+
+def _broadcast_shard(shard):
+    return broadcast(shard, write_manifest=False)
+
+
+def refresh_manifest(owners):
+    """Coordinator step after `owners` --shard runs: recounts the store
+    shards into the manifest and marks the legacy blob merged once every
+    owner has merged its slice."""
+    backend = open_backend()
+    if not backend:
+        print("Error: BLOB_READ_WRITE_TOKEN missing")
+        return None
+    total = SubscriptionStore(backend).refresh_manifest(owners=owners)
+    print(f"DEBUG: Manifest updated. Total subscriptions: {total}")
+    return total
+
+
+def broadcast_processes(count):
+    """Runs shards 0..count-1 of one broadcast in a local process pool (one
+    core each for payload encryption), then rewrites the manifest once.
+    Workers are spawned, not forked, so none inherits the parent's pooled
+    connections."""
+    with ProcessPoolExecutor(max_workers=count, mp_context=multiprocessing.get_context('spawn')) as pool:
+        summaries = [s for s in pool.map(_broadcast_shard, [(i, count) for i in range(count)]) if s]
+    totals = {key: sum(s[key] for s in summaries) for key in ('sent', 'failed', 'removed', 'shards_written')}
+    refresh_manifest(count)
+    print(f"PUSH STATUS: {count} shard(s): sent {totals['sent']}, failed {totals['failed']}, removed {totals['removed']}.")
+    return totals
+
+
+def parse_shard(value):
+    """'i/n' -> (i, n) with 0 <= i < n."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/n, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}")
+    return index, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send the latest price change to push subscribers.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--shard', type=parse_shard, help="only handle subscribers of shard i of n (e.g. 0/4)")
+    mode.add_argument('--processes', type=int, default=1, help="run n shards in a local process pool")
+    mode.add_argument('--refresh-manifest', type=int, metavar='N',
+                      help="after N --shard runs have finished: recount the manifest and mark the legacy blob merged")
+    args = parser.parse_args()
+    if args.refresh_manifest:
+        refresh_manifest(args.refresh_manifest)
+    elif args.processes > 1:
+        broadcast_processes(args.processes)
+    else:
+        broadcast(args.shard)
 
 if __name__ == "__main__":
     main()
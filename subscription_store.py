@@ -0,0 +1,506 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import hashlib
+import json
+import os
+import time
+
+import http_client
+from targeting import shard_reach
+
+# Layout (shared with api/subscribe.js):
+#   subscriptions/manifest.json      {"version", "shards", "counts", "reach", "versions",
+#                                     "legacyMerged", "updated"}
+#   subscriptions/shards/NNN.json    compact JSON array of subscriptions
+#   subscriptions/data.json          legacy single blob, merged once then ignored
+#   subscriptions/owners/IofN.json   {"counts": {shard: size}, "legacyMerged", "updated"}
+#                                    written by owner I of N in sharded runs
+#
+# Sharded runs (owner I of N) only touch store shards s with s % N == I, so N
+# should divide the shard count: a larger N leaves owners idle and any other
+# N gives some owners more shards. Owners never write the manifest; one
+# refresh_manifest(owners=N) after all of them finish recounts the shards and
+# sets legacyMerged once every owner has merged its slice of the legacy blob.
+#
+# A shard is read and parsed whole, so the largest shard bounds memory. When
+# one holds more than SHARD_MAX subscriptions, an unsharded run (or
+# refresh_manifest()) doubles the shard count until the largest shard fits:
+# with hash % (n * k), store shard i splits into i, i + n, ..., i + (k-1) * n,
+# one old shard at a time. Doubling keeps an owner count that divided the old
+# shard count dividing the new one.
+#
+# reach[i] is targeting.shard_reach() of shard i as last written (null when
+# unknown): the lowest alert thresholds in it per metal. A broadcast skips a
+# shard its move does not reach without reading it. subscribe.js bumps
+# versions[i] whenever it writes shard i, and a run drops the reach it worked
+# out for a shard whose version changed meanwhile.
+PREFIX = 'subscriptions/'
+MANIFEST_PATH = 'subscriptions/manifest.json'
+LEGACY_PATH = 'subscriptions/data.json'
+SHARD_COUNT = int(os.getenv('SUBSCRIPTION_SHARDS', '16'))
+SHARD_MAX = int(os.getenv('SUBSCRIPTION_SHARD_MAX', '5000'))
+
+BLOB_API = 'https://blob.vercel-storage.com'
+
+
+def endpoint_hash(endpoint):
+    return hashlib.sha256(endpoint.encode('utf-8')).hexdigest()
+
+
+def shard_of(endpoint, shard_count):
+    """Stable shard index for an endpoint (first 32 bits of its SHA-256)."""
+    return int(endpoint_hash(endpoint)[:8], 16) % shard_count
+
+
+def split_count(shard_count, counts):
+    """Shard count (shard_count doubled as often as needed) at which the
+    largest of `counts` is expected to hold at most SHARD_MAX subscriptions."""
+    largest = max(counts, default=0)
+    while largest > SHARD_MAX:
+        shard_count *= 2
+        largest = (largest + 1) // 2
+    return shard_count
+
+
+def shard_path(index):
+    return f"{PREFIX}shards/{index:03d}.json"
+
+
+def owner_path(owner):
+    return f"{PREFIX}owners/{owner[0]}of{owner[1]}.json"
+
+
+def _serialize(value):
+    # Compact and byte-identical to JSON.stringify() in api/subscribe.js
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class _ArrayChunks:
+    """Byte chunks of a JSON array of already-serialized items; joined they
+    equal _serialize() of the list. Re-iterable, so an HTTP retry can send
+    the body again."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        yield b'['
+        for i, item in enumerate(self.items):
+            yield b',' + item if i else item
+        yield b']'
+
+
+class LocalBackend:
+    """Stores blobs as files under `root` (offline runs and testing)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, path):
+        full = os.path.join(self.root, path)
+        if not os.path.exists(full):
+            return None
+        with open(full, 'rb') as f:
+            return f.read()
+
+    def write(self, path, body):
+        """`body` is bytes or an iterable of byte chunks."""
+        full = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            if isinstance(body, bytes):
+                f.write(body)
+            else:
+                f.writelines(body)
+        return True
+
+
+class BlobBackend:
+    """Vercel Blob storage. Lists the subscriptions/ prefix once per run to
+    resolve public URLs instead of listing the whole store. Requests are
+    outside the HTTP run budget: write-back must not depend on how long the
+    scrape took."""
+
+    def __init__(self, token):
+        self.token = token
+        self._urls = None
+
+    def _resolve(self, path):
+        if self._urls is None:
+            self._urls = {}
+            headers = {"Authorization": f"Bearer {self.token}"}
+            cursor = None
+            while True:
+                params = {'prefix': PREFIX, 'limit': 1000}
+                if cursor:
+                    params['cursor'] = cursor
+                resp = http_client.get(BLOB_API, headers=headers, params=params, timeout=10, budgeted=False)
+                if resp.status_code != 200:
+                    print(f"DEBUG: Blob API returned error {resp.status_code}")
+                    break
+                body = resp.json()
+                for blob in body.get('blobs', []):
+                    self._urls[blob['pathname']] = blob['url']
+                cursor = body.get('cursor')
+                if not body.get('hasMore') or not cursor:
+                    break
+        return self._urls.get(path)
+
+    def read(self, path):
+        url = self._resolve(path)
+        if not url:
+            return None
+        resp = http_client.get(url, timeout=10, budgeted=False)
+        if resp.status_code != 200:
+            print(f"DEBUG: Failed to read {path}: {resp.status_code}")
+            return None
+        return resp.content
+
+    def write(self, path, body):
+        """`body` is bytes or an iterable of byte chunks (sent chunked)."""
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        resp = http_client.put(f"{BLOB_API}/{path}", headers=headers, data=body, timeout=10, budgeted=False)
+        if resp.status_code not in [200, 201]:
+            print(f"DEBUG: Failed to write {path}: {resp.status_code}")
+            return False
+        # A blob created after the listing is only readable through the URL
+        # the PUT returns
+        try:
+            url = resp.json().get('url')
+        except ValueError:
+            url = None
+        if url:
+            if self._urls is None:
+                self._resolve(path)
+            self._urls[path] = url
+        return True
+
+
+def open_backend():
+    """SUBSCRIPTION_STORE_DIR selects the local backend; otherwise Vercel Blob."""
+    local_dir = os.getenv('SUBSCRIPTION_STORE_DIR')
+    if local_dir:
+        return LocalBackend(local_dir)
+    token = os.getenv('BLOB_READ_WRITE_TOKEN')
+    if token:
+        return BlobBackend(token)
+    return None
+
+
+class SubscriptionStore:
+    """Hash-partitioned subscription store with per-shard dirty tracking.
+
+    Subscriptions are deduplicated by endpoint hash and partitioned into
+    `shard_count` shards. save() rewrites only the shards whose serialized
+    contents differ from what load() read, plus the manifest when any shard
+    changed.
+    """
+
+    def __init__(self, backend, shard_count=SHARD_COUNT, owner=None):
+        self.backend = backend
+        self.shard_count = shard_count
+        self.owner = owner  # (index, count): only store shards s with s % count == index
+        if owner is not None and (owner[1] > self.shard_count or self.shard_count % owner[1]):
+            print(f"WARNING: {owner[1]} owners do not evenly split {self.shard_count} shards")
+        self.manifest = None
+        self._digests = {}  # shard index -> sha256 of the bytes last read/written
+        self._counts = {}   # shard index -> subscriptions last read/written
+        self._reach = {}    # shard index -> shard_reach() of what was last written
+        self.skipped = {}   # shard index -> subscriptions in a shard iter_shards() did not read
+        self._legacy = {}
+        self._failed = set()  # shards whose last write failed (legacy merge incomplete)
+
+    def owns(self, shard):
+        return self.owner is None or shard % self.owner[1] == self.owner[0]
+
+    def owns_endpoint(self, endpoint):
+        return self.owns(shard_of(endpoint, self.shard_count))
+
+    def _read_json(self, path):
+        body = self.backend.read(path)
+        if body is None:
+            return None, None
+        return json.loads(body), hashlib.sha256(body).hexdigest()
+
+    def open(self):
+        """Reads the manifest, and the legacy blob while it is not merged yet
+        (grouped by shard, so iter_shards() can fold it in)."""
+        self.manifest, _ = self._read_json(MANIFEST_PATH)
+        if self.manifest:
+            # Keep the existing partitioning; re-sharding would move everyone
+            self.shard_count = self.manifest.get('shards', self.shard_count)
+        self._counts = {}
+        self._reach = {}
+        self.skipped = {}
+        self._legacy = {}
+        self._failed = set()
+        merged = self.manifest and self.manifest.get('legacyMerged')
+        if not merged and self.owner is not None:
+            status, _ = self._read_json(owner_path(self.owner))
+            merged = bool(status and status.get('legacyMerged'))
+        if not merged:
+            legacy, _ = self._read_json(LEGACY_PATH)
+            if legacy:
+                legacy = [sub for sub in legacy if self.owns_endpoint(sub.get('endpoint', ''))]
+                print(f"DEBUG: Merging {len(legacy)} subscriptions from legacy {LEGACY_PATH}")
+                for sub in legacy:
+                    self._legacy.setdefault(shard_of(sub.get('endpoint', ''), self.shard_count), []).append(sub)
+        elif self.owner is None:
+            target = split_count(self.shard_count, self.manifest.get('counts') or [])
+            if target > self.shard_count:
+                self.split(target)
+
+    def split(self, shard_count):
+        """Re-partitions the store into `shard_count` shards (a multiple of the
+        current count), reading one old shard at a time.
+
+        The manifest switches to the new count first, so subscribe.js places
+        new subscribers in the new layout. An old shard is only trimmed after
+        all of its moved subscriptions were written, and iter_shards() moves
+        anything still left in the wrong shard forward, so an interrupted
+        split loses nobody. Returns True if every shard was split.
+        """
+        old = self.shard_count
+        counts = list((self.manifest or {}).get('counts') or [])[:old]
+        counts += [0] * (shard_count - len(counts))
+        print(f"INFO: Splitting {old} subscription shards into {shard_count} (largest {max(counts, default=0)} > {SHARD_MAX})")
+        manifest = dict(self.manifest or {}, shards=shard_count, counts=counts, updated=int(time.time()))
+        manifest.pop('reach', None)  # Unknown until each new shard is written
+        if not self.backend.write(MANIFEST_PATH, _serialize(manifest)):
+            print("WARNING: Could not write the split manifest; keeping the current shards")
+            return False
+        self.manifest = manifest
+        self.shard_count = shard_count
+        complete = True
+        for i in range(old):
+            shard, _ = self._read_json(shard_path(i))
+            parts = {}
+            for sub in shard or []:
+                parts.setdefault(shard_of(sub.get('endpoint', ''), shard_count), []).append(sub)
+            shard = None
+            moved = True
+            for j in sorted(parts):
+                if j == i:
+                    continue
+                # subscribe.js may already have added someone to the new shard
+                existing, _ = self._read_json(shard_path(j))
+                merged = self._dedupe((existing or []) + parts.pop(j))
+                counts[j] = len(merged)
+                if not self.backend.write(shard_path(j), _ArrayChunks([_serialize(sub) for sub in merged])):
+                    moved = False
+                merged = existing = None
+            if moved:
+                kept = parts.get(i, [])
+                counts[i] = len(kept)
+                moved = self.backend.write(shard_path(i), _ArrayChunks([_serialize(sub) for sub in kept]))
+            if not moved:
+                print(f"WARNING: Could not split shard {i}; the next run moves its subscriptions")
+                complete = False
+            parts = None
+
+        # A subscribe.js request that read the old manifest may have written it back
+        current, _ = self._read_json(MANIFEST_PATH)
+        manifest = dict(current or manifest, shards=shard_count, counts=counts, updated=int(time.time()))
+        manifest.pop('reach', None)
+        if self.backend.write(MANIFEST_PATH, _serialize(manifest)):
+            self.manifest = manifest
+        return complete
+
+    def _recorded(self, key, index):
+        values = (self.manifest or {}).get(key)
+        return values[index] if isinstance(values, list) and index < len(values) else None
+
+    def iter_shards(self, wanted=None):
+        """Yields (index, subscriptions) for every non-empty owned shard,
+        reading one shard at a time, so a caller that handles and saves each
+        shard before asking for the next holds only one shard in memory.
+
+        With `wanted(reach)`, a shard whose recorded reach it rejects is not
+        read at all (see targeting.reaches()); its subscriber count goes to
+        `skipped` and carries over to the manifest.
+        """
+        self.open()
+        strays = {}  # shard index -> subscriptions found in an earlier shard (interrupted split)
+        for i in range(self.shard_count):
+            if not self.owns(i):
+                continue
+            reach = self._recorded('reach', i)
+            if wanted is not None and reach is not None and i not in self._legacy and i not in strays:
+                if not wanted(reach):
+                    self._counts[i] = self.skipped[i] = self._recorded('counts', i) or 0
+                    self._reach[i] = reach
+                    continue
+            subscriptions = []
+            # Read even without a manifest: shard owners never write one, so
+            # shards saved in a sharded run exist before the manifest does
+            shard, digest = self._read_json(shard_path(i))
+            if shard is not None:
+                self._digests[i] = digest
+                subscriptions = shard
+            legacy = self._legacy.pop(i, []) + strays.pop(i, [])
+            if legacy:
+                subscriptions = self._dedupe(subscriptions + legacy)
+            kept = []
+            for sub in subscriptions:
+                j = shard_of(sub.get('endpoint', ''), self.shard_count)
+                if j > i and self.owns(j):
+                    strays.setdefault(j, []).append(sub)
+                else:
+                    kept.append(sub)
+            subscriptions = kept
+            self._counts[i] = len(subscriptions)
+            if subscriptions:
+                yield i, subscriptions
+            shard = subscriptions = legacy = kept = None  # Release before reading the next shard
+
+    def load(self):
+        """Returns all subscriptions (or the owner's slice), deduplicated, in
+        shard order."""
+        subscriptions = []
+        for _, shard in self.iter_shards():
+            subscriptions.extend(shard)
+        return subscriptions
+
+    def _dedupe(self, subscriptions):
+        seen = set()
+        unique = []
+        for sub in subscriptions:
+            endpoint = sub.get('endpoint', '')
+            h = endpoint_hash(endpoint)
+            if h in seen:
+                continue
+            seen.add(h)
+            unique.append(sub)
+        return unique
+
+    def save_shard(self, index, subscriptions):
+        """Writes one shard if its contents changed. The body is serialized one
+        subscription at a time and handed to the backend as chunks, so there
+        is never a second full copy of the shard as one string.
+        Returns True if the shard was written."""
+        unique = self._dedupe(subscriptions)
+        self._reach[index] = shard_reach(unique)
+        chunks = [_serialize(sub) for sub in unique]
+        self._counts[index] = len(chunks)
+        digest = hashlib.sha256()
+        for chunk in _ArrayChunks(chunks):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        if self._digests.get(index) == digest:
+            return False
+        if not chunks and index not in self._digests:
+            return False  # Never existed and still empty
+        try:
+            written = self.backend.write(shard_path(index), _ArrayChunks(chunks))
+        except Exception:
+            self._failed.add(index)
+            self._reach.pop(index, None)
+            raise
+        if written:
+            self._digests[index] = digest
+            self._failed.discard(index)
+            return True
+        self._failed.add(index)
+        self._reach.pop(index, None)  # The stored shard is whatever was there before
+        return False
+
+    def _reach_list(self, opened, current):
+        """reach for the manifest: what this run worked out, except for shards
+        subscribe.js wrote (versions changed) between `opened` and `current`."""
+        before = (opened or {}).get('versions') or []
+        after = (current or {}).get('versions') or []
+        reach = []
+        for i in range(self.shard_count):
+            changed = (before[i] if i < len(before) else 0) != (after[i] if i < len(after) else 0)
+            reach.append(None if changed else self._reach.get(i))
+        return reach
+
+    def save(self, subscriptions, write_manifest=True):
+        """Writes back only changed shards. Returns the number of shards written.
+
+        With an owner, only the owned shards are written (subscriptions that
+        belong elsewhere are ignored), so shard owners never overwrite each
+        other, and save_manifest() writes the owner's status file instead of
+        the manifest.
+        """
+        shards = [[] for _ in range(self.shard_count)]
+        for sub in self._dedupe(subscriptions):
+            shards[shard_of(sub.get('endpoint', ''), self.shard_count)].append(sub)
+
+        written = 0
+        for i, shard in enumerate(shards):
+            if self.owns(i) and self.save_shard(i, shard):
+                written += 1
+        if write_manifest:
+            self.save_manifest(written)
+        return written
+
+    def save_manifest(self, written):
+        """Writes the shard counts recorded by iter_shards()/save_shard() after
+        `written` shards were saved (skipped when nothing changed). An owner
+        writes only its own status file: concurrent owners never share a
+        read-modify-write, and refresh_manifest() combines them."""
+        if self.owner is not None:
+            self.backend.write(owner_path(self.owner), _serialize({
+                'counts': {str(i): n for i, n in self._counts.items() if self.owns(i)},
+                'legacyMerged': not self._failed,
+                'updated': int(time.time()),
+            }))
+            return
+
+        current, _ = self._read_json(MANIFEST_PATH)
+        manifest = dict(self.manifest or {})
+        manifest.update({
+            'version': 1,
+            'shards': self.shard_count,
+            'counts': [self._counts.get(i, 0) for i in range(self.shard_count)],
+            'reach': self._reach_list(self.manifest, current),
+            'versions': (current or {}).get('versions', manifest.get('versions', [])),
+            'legacyMerged': bool(manifest.get('legacyMerged')) or not self._failed,
+        })
+        unchanged = self.manifest and all(manifest.get(k) == self.manifest.get(k) for k in manifest if k != 'updated')
+        if written or not unchanged:
+            manifest['updated'] = int(time.time())
+            if self.backend.write(MANIFEST_PATH, _serialize(manifest)):
+                self.manifest = manifest
+
+    def refresh_manifest(self, owners=None):
+        """Recounts every shard and rewrites the manifest once all owners of a
+        sharded run have finished. With `owners` (the N of the run),
+        legacyMerged is only set when every owner's status file says it
+        merged its slice; otherwise a failed owner's legacy subscribers would
+        be dropped. Returns the total subscription count."""
+        manifest, _ = self._read_json(MANIFEST_PATH)
+        if manifest:
+            self.shard_count = manifest.get('shards', self.shard_count)
+        counts = []
+        self._reach = {}
+        for i in range(self.shard_count):
+            shard, _ = self._read_json(shard_path(i))
+            counts.append(len(shard or []))
+            self._reach[i] = shard_reach(shard or [])
+        current, _ = self._read_json(MANIFEST_PATH)
+        merged = True
+        if owners is not None:
+            for index in range(owners):
+                status, _ = self._read_json(owner_path((index, owners)))
+                merged = merged and bool(status and status.get('legacyMerged'))
+        reach = self._reach_list(manifest, current)
+        manifest = dict(manifest or {})
+        manifest.update({
+            'version': 1,
+            'shards': self.shard_count,
+            'counts': counts,
+            'reach': reach,
+            'versions': (current or {}).get('versions', manifest.get('versions', [])),
+            'legacyMerged': bool(manifest.get('legacyMerged')) or merged,
+            'updated': int(time.time()),
+        })
+        if self.backend.write(MANIFEST_PATH, _serialize(manifest)):
+            self.manifest = manifest
+            target = split_count(self.shard_count, counts)
+            if target > self.shard_count:
+                self.split(target)
+        return sum(counts)
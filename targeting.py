@@ -0,0 +1,108 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+# Subscribers may store per-metal interests with api/subscribe.js:
+#   "prefs": {"gold": {"abs": 500}, "silver": {"pct": 1.5}, "tejabi": {}}
+# Only the listed metals are of interest. A move qualifies when it reaches
+# either threshold given for that metal (abs in rupees per tola, pct in
+# percent); an empty object means any change. No prefs means every metal,
+# any change (the behaviour before preferences existed).
+METALS = ('gold', 'tejabi', 'silver')
+MAX_ABS = 1000000
+MAX_PCT = 100
+
+
+def _threshold(value, limit):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if value < 0 or value > limit:
+        return None
+    return float(value)
+
+
+def normalize_prefs(prefs):
+    """Validated {metal: {'abs': x, 'pct': y}} (either key optional), or None
+    for missing or unusable prefs, which means every metal, any change."""
+    if not isinstance(prefs, dict):
+        return None
+    result = {}
+    for metal, rule in prefs.items():
+        if metal not in METALS or not isinstance(rule, dict):
+            continue
+        clean = {}
+        for key, limit in (('abs', MAX_ABS), ('pct', MAX_PCT)):
+            value = _threshold(rule.get(key), limit)
+            if value is not None:
+                clean[key] = value
+        result[metal] = clean
+    return result or None
+
+
+def moves(changes, prices):
+    """{metal: (rupee size, percent size)} for every metal that moved.
+    `changes` and `prices` map metal -> rupee change / new price."""
+    result = {}
+    for metal in METALS:
+        change = changes.get(metal, 0)
+        if not change:
+            continue
+        size = abs(change)
+        previous = prices.get(metal, 0) - change
+        result[metal] = (size, size / previous * 100 if previous else 0.0)
+    return result
+
+
+def interested(sub, moved):
+    """True if `sub`'s preferences are reached by any of `moved` (see moves())."""
+    prefs = normalize_prefs(sub.get('prefs'))
+    if prefs is None:
+        return bool(moved)
+    for metal, rule in prefs.items():
+        if metal not in moved:
+            continue
+        size, pct = moved[metal]
+        if not rule:
+            return True
+        if size >= rule.get('abs', float('inf')) or pct >= rule.get('pct', float('inf')):
+            return True
+    return False
+
+
+def shard_reach(subscriptions):
+    """Lowest thresholds over `subscriptions` per metal: {metal: [abs, pct]},
+    None where nobody set that kind and [0, 0] where someone wants any
+    change. A move that reaches none of them (see reaches()) interests
+    nobody in the list, so a shard can be skipped without reading it."""
+    reach = {}
+    for sub in subscriptions:
+        prefs = normalize_prefs(sub.get('prefs'))
+        if prefs is None:
+            return {metal: [0.0, 0.0] for metal in METALS}  # Nothing is lower
+        for metal, rule in prefs.items():
+            low = reach.setdefault(metal, [None, None])
+            if not rule:
+                low[:] = [0.0, 0.0]
+            for i, kind in enumerate(('abs', 'pct')):
+                if kind in rule and (low[i] is None or rule[kind] < low[i]):
+                    low[i] = rule[kind]
+    return reach
+
+
+def reaches(reach, moved):
+    """True if a move (see moves()) reaches a shard_reach() summary."""
+    for metal, (size, pct) in moved.items():
+        low_abs, low_pct = reach.get(metal) or (None, None)
+        if (low_abs is not None and size >= low_abs) or (low_pct is not None and pct >= low_pct):
+            return True
+    return False
+
+
+def select_targets(subscriptions, changes, prices):
+    """Positions of the subscribers interested in this move, in order. A
+    single pass over the loaded shard batch, which is read in full anyway
+    to send the pushes."""
+    moved = moves(changes, prices)
+    if not moved:
+        return []
+    return [i for i, sub in enumerate(subscriptions) if interested(sub, moved)]
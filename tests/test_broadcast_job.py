@@ -0,0 +1,116 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+
+import pytest
+
+import broadcast_job
+import push_engine
+from broadcast_job import BroadcastJob, merge_results, segment_path
+from push_engine import send_by_shard
+from subscription_store import LocalBackend, SubscriptionStore
+
+PAYLOAD = json.dumps({'title': 'Current Rates'})
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalBackend(str(tmp_path))
+
+
+def subscriptions(n):
+    return [{'endpoint': f"https://push.example/{i}", 'keys': {'p256dh': 'p', 'auth': 'a'}} for i in range(n)]
+
+
+def interrupted_job(backend, subs, sent):
+    """A job that recorded results for `sent` and flushed, then crashed."""
+    job = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    for sub in sent:
+        job.record(sub, (True, 0) if subs.index(sub) % 2 else (False, 1))
+    job.flush()
+    return job
+
+
+def test_resumed_job_skips_what_was_sent(backend):
+    subs = subscriptions(10)
+    interrupted_job(backend, subs, subs[:4])
+
+    job = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    assert not job.done
+    remaining, previous = job.pending(subs, range(10))
+    assert remaining == list(range(4, 10))
+    assert job.resumed == 4
+    assert previous[:4] == [(False, 1), (True, 0), (False, 1), (True, 0)]
+    assert previous[4:] == [None] * 6
+
+
+def test_merge_results_fills_in_resumed_results():
+    assert merge_results([None, (True, 0), None], [(False, 2), None, None]) == [(False, 2), (True, 0), None]
+
+
+def test_finished_job_is_done(backend):
+    job = interrupted_job(backend, subscriptions(3), subscriptions(3))
+    job.finish()
+    assert BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD).done
+
+
+def test_another_alert_starts_a_new_job(backend):
+    subs = subscriptions(3)
+    interrupted_job(backend, subs, subs).finish()
+    for key, data in (('2026-01-03 11:00', PAYLOAD), ('2026-01-02 11:00', '{"title": "Other"}')):
+        job = BroadcastJob(backend, key, data)
+        assert not job.done
+        assert job.pending(subs, range(3))[0] == [0, 1, 2]
+
+
+def test_each_flush_appends_one_segment(backend, monkeypatch):
+    monkeypatch.setattr(broadcast_job, 'CHECKPOINT_EVERY', 3)
+    job = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    for sub in subscriptions(7):
+        job.record(sub, (True, 0))
+    job.flush()
+    assert job.segments == 3
+    sizes = [len(json.loads(backend.read(segment_path(job.path, seq)))['results']) for seq in range(3)]
+    assert sizes == [3, 3, 1]
+    assert len(BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD).results) == 7
+
+
+def test_segments_left_by_an_older_job_are_ignored(backend):
+    subs = subscriptions(6)
+    old = BroadcastJob(backend, '2026-01-01 11:00', PAYLOAD)
+    for sub in subs:
+        old.record(sub, (True, 0))
+    old.flush()
+    # The new job crashed after writing its header but before its first segment landed
+    job = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    job.segments = 1
+    job._write(job.path, {'job': job.id, 'payloadHash': job.payload_hash, 'done': False, 'segments': 1})
+
+    resumed = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    assert resumed.pending(subs, range(6))[0] == list(range(6))
+
+
+def test_send_by_shard_resumes_without_sending_twice(backend, monkeypatch):
+    monkeypatch.setattr(push_engine, 'ORIGIN_RATE', 0)
+    subs = subscriptions(20)
+    SubscriptionStore(backend).save(subs)
+    # A crashed run already sent to the first 8 (two of them failed)
+    first = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    for i, sub in enumerate(subs[:8]):
+        first.record(sub, (False, 1) if i < 2 else (True, 0))
+    first.flush()
+
+    sent = []
+    job = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    totals = send_by_shard(SubscriptionStore(backend), lambda sub: sent.append(sub['endpoint']) or (True, 0),
+                           job=job)
+    assert sorted(sent) == sorted(s['endpoint'] for s in subs[8:])
+    assert (totals['resumed'], totals['sent'], totals['failed']) == (8, 18, 2)
+    counts = {s['endpoint']: s['failureCount'] for s in SubscriptionStore(backend).load()}
+    assert [counts[s['endpoint']] for s in subs[:3]] == [1, 1, 0]
+
+    job.finish()
+    rerun = BroadcastJob(backend, '2026-01-02 11:00', PAYLOAD)
+    assert rerun.done
@@ -0,0 +1,97 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import pytest
+
+from consensus import Source, is_outlier, resolve, vote
+
+# Ten days of gold rising steadily by 100, ending at 100900
+HISTORY = [{'gold': 100000 + 100 * i} for i in range(10)]
+
+
+class FakeFetch:
+    """fetch(jobs, deadline) as scraper.fetch_sources(): a source that raises
+    reports its default. Records the names fetched in each wave."""
+
+    def __init__(self):
+        self.waves = []
+
+    def __call__(self, jobs, deadline):
+        self.waves.append(sorted(jobs))
+        results = {}
+        for name, (fn, args, default) in jobs.items():
+            try:
+                results[name] = fn(*args)
+            except Exception:
+                results[name] = default
+        return results
+
+
+def gold_source(name, value):
+    def fetch():
+        if value is None:
+            raise ConnectionError(f"{name} is down")
+        return value
+    return Source(name, fetch, (), None, ('gold',), lambda result: {'gold': result})
+
+
+def run(values, history=(), quorum=2):
+    sources = [gold_source(name, value) for name, value in values]
+    fetch = FakeFetch()
+    decisions, fetched = resolve(sources, ('gold',), list(history), fetch, quorum=quorum)
+    return decisions['gold'], fetched, fetch.waves
+
+
+def test_agreeing_sources_settle_without_the_rest():
+    decision, fetched, waves = run([('a', 100000), ('b', 100500), ('c', 99000)])
+    assert decision == (100000, 'a', True)
+    assert waves == [['a', 'b']]
+    assert fetched['c'] is None  # Never fetched; reports its default
+
+
+def test_disagreement_fetches_the_next_source():
+    decision, _, waves = run([('a', 100000), ('b', 130000), ('c', 100200)])
+    assert decision == (100000, 'a', True)
+    assert waves == [['a', 'b'], ['c']]
+
+
+def test_disagreement_without_more_sources_is_unverified():
+    decision, _, _ = run([('a', 100000), ('b', 130000)])
+    assert decision == (100000, 'a', False)
+
+
+def test_failed_primary_is_replaced_by_the_next_source():
+    decision, fetched, waves = run([('a', None), ('b', 100000), ('c', 100100)])
+    assert decision == (100000, 'b', True)
+    assert waves == [['a', 'b'], ['c']]
+    assert fetched['a'] is None
+
+
+def test_lone_outlier_is_rejected():
+    decision, _, waves = run([('a', 150000), ('b', None), ('c', None)], HISTORY)
+    assert decision == (0, None, False)
+    assert waves == [['a', 'b'], ['c']]
+
+
+def test_lone_outlier_loses_to_an_unconfirmed_plausible_value():
+    decision, _, _ = run([('a', 150000), ('b', 101000), ('c', None)], HISTORY)
+    assert decision == (101000, 'b', False)
+
+
+def test_agreed_large_move_is_accepted():
+    decision, _, _ = run([('a', 150000), ('b', 150500), ('c', 101000)], HISTORY)
+    assert decision == (150000, 'a', True)
+
+
+@pytest.mark.parametrize('value, expected', [(101000, False), (150000, True), (60000, True)])
+def test_is_outlier(value, expected):
+    assert is_outlier(value, [r['gold'] for r in HISTORY]) is expected
+
+
+def test_is_outlier_needs_history():
+    assert not is_outlier(150000, [100000, 100100])
+
+
+def test_vote_prefers_priority_among_agreeing_sources():
+    assert vote([('a', 100), ('b', 200), ('c', 201)], 2, 0.05) == (200, 'b', True)
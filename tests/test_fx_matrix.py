@@ -0,0 +1,57 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import itertools
+
+import numpy as np
+
+from fx_matrix import RATE_SCALE, build_fx_payload
+
+CURRENCIES = ['USD', 'JPY', 'KRW']
+
+
+def record(day, usd, jpy, krw=None):
+    quotes = [{'code': 'USD', 'unit': 1, 'buy': usd - 0.5, 'sell': usd + 0.5},
+              {'code': 'JPY', 'unit': 10, 'buy': jpy - 0.05, 'sell': jpy + 0.05}]
+    if krw is not None:
+        quotes.append({'code': 'KRW', 'unit': 100, 'buy': krw - 0.1, 'sell': krw + 0.1})
+    return {'date': f"2026-01-{day:02d} 11:00", 'gold': 150000, 'tejabi': 149000, 'silver': 2000,
+            'usd': usd, 'currencies': quotes}
+
+
+def decode(column):
+    out, last = [], 0
+    for value in column:
+        if value is None:
+            out.append(None)
+        else:
+            last += value
+            out.append(last)
+    return out
+
+
+def test_cross_rates_are_spelled_out_for_every_day():
+    records = [record(1, 135.0, 9.0, 10.0), record(2, 136.2, 9.1), record(3, 137.5, 8.95, 10.3)]
+    payload = build_fx_payload(records, CURRENCIES)
+    rates = {code: decode(payload['rates'][code]) for code in CURRENCIES}
+
+    assert sorted(payload['cross']) == sorted(f"{a}/{b}" for a, b in itertools.combinations(CURRENCIES, 2))
+    for pair, column in payload['cross'].items():
+        a, b = pair.split('/')
+        values = decode(column['v'])
+        assert len(values) == 3
+        for day, value in enumerate(values):
+            if rates[a][day] is None or rates[b][day] is None:
+                assert value is None
+                continue
+            expected = rates[a][day] / rates[b][day]
+            assert np.isclose(value / column['scale'], expected, rtol=1e-4)
+            assert len(str(abs(value))) <= 6  # Six significant digits, whatever the magnitude
+
+    # The newest day's matrix agrees with the columns
+    latest = payload['latest']['cross']
+    codes = payload['codes']
+    usd_jpy = decode(payload['cross']['USD/JPY']['v'])[-1] / payload['cross']['USD/JPY']['scale']
+    assert np.isclose(latest[codes.index('USD')][codes.index('JPY')], usd_jpy, rtol=1e-5)
+    assert np.isclose(decode(payload['rates']['JPY'])[-1] / RATE_SCALE, 0.895)
@@ -0,0 +1,88 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import datetime
+import json
+
+import pytest
+
+from history_archive import HistoryArchive, archive_overflow, query_range
+from history_log import HistoryLog
+
+START = datetime.date(2024, 11, 1)
+
+
+def records(n, start=0):
+    return [{'date': (START + datetime.timedelta(days=i)).strftime('%Y-%m-%d') + ' 11:00', 'gold': 100000 + i}
+            for i in range(start, start + n)]
+
+
+def lines(recs):
+    return [json.dumps(r).encode('utf-8') + b'\n' for r in recs]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return HistoryArchive(str(tmp_path / 'archive'))
+
+
+@pytest.fixture
+def log(tmp_path):
+    return HistoryLog(str(tmp_path / 'data' / 'history.ndjson'))
+
+
+def test_append_partitions_by_year(archive):
+    assert archive.append(lines(records(90))) == 90
+    index = archive.load_index()
+    assert sorted(index['partitions']) == ['2024', '2025']
+    assert index['partitions']['2024']['count'] == 61
+    assert index['partitions']['2025']['first'] == '2025-01-01'
+    assert archive.last_date() == '2025-01-29'
+
+
+def test_append_skips_what_is_already_archived(archive):
+    archive.append(lines(records(40)))
+    # An interrupted run repeats with an overlapping batch
+    assert archive.append(lines(records(50, start=30))) == 40
+    assert list(archive.query('0000-01-01', '9999-12-31')) == records(80)
+
+
+def test_append_accepts_lines_without_newlines(archive):
+    archive.append([line.rstrip(b'\n') for line in lines(records(3))])
+    assert list(archive.query('0000-01-01', '9999-12-31')) == records(3)
+
+
+@pytest.mark.parametrize('start, end', [
+    ('2024-11-01', '2024-11-30'),
+    ('2024-12-15', '2025-01-05'),
+    ('2025-01-20', '2025-03-01'),
+    ('2024-01-01', '2024-10-31'),
+])
+def test_query_returns_the_range(archive, start, end):
+    archive.append(lines(records(90)))
+    expected = [r for r in records(90) if start <= r['date'][:10] <= end]
+    assert list(archive.query(start, end)) == expected
+
+
+def test_archive_overflow_waits_for_a_full_batch(log, archive):
+    log.seed(records(12))
+    assert archive_overflow(log, archive, hot_records=10, batch=2) == 0
+    log.append(records(1, start=12)[0])
+    assert archive_overflow(log, archive, hot_records=10, batch=2) == 3
+    assert list(log.iter_records()) == records(10, start=3)
+    assert list(archive.query('0000-01-01', '9999-12-31')) == records(3)
+
+
+def test_query_range_spans_archive_and_log(log, archive):
+    log.seed(records(80))
+    archive_overflow(log, archive, hot_records=30, batch=5)
+    assert archive.last_date() == '2024-12-20'
+    assert list(query_range('0000-01-01', '9999-12-31', log=log, archive=archive)) == records(80)
+    expected = [r for r in records(80) if '2024-12-10' <= r['date'][:10] <= '2024-12-31']
+    assert list(query_range('2024-12-10', '2024-12-31', log=log, archive=archive)) == expected
+
+
+def test_query_range_without_a_log_reads_only_the_archive(archive):
+    archive.append(lines(records(10)))
+    assert list(query_range('0000-01-01', '9999-12-31', archive=archive)) == records(10)
@@ -0,0 +1,140 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import datetime
+import os
+
+import pytest
+
+import history_index
+from history_archive import HistoryArchive, archive_overflow, query_range
+from history_index import HistoryIndex, load_history, source_fingerprint, to_minutes, update_history
+from history_log import HistoryLog
+
+START = datetime.datetime(2024, 12, 20, 11, 0)
+
+
+def records(n, start=0):
+    return [{'date': (START + datetime.timedelta(days=i)).strftime('%Y-%m-%d %H:%M'),
+             'gold': 100000 + i, 'tejabi': 99000 + i, 'silver': 1000 + i, 'usd': 133.5}
+            for i in range(start, start + n)]
+
+
+def rows(index):
+    return [index.record(i) for i in range(len(index))]
+
+
+def full(log, archive):
+    return rows(HistoryIndex.from_records(query_range('0000-01-01', '9999-12-31', log=log, archive=archive)))
+
+
+@pytest.fixture
+def history(tmp_path):
+    """(log, archive, snapshot path) with 40 records, 20 of them archived."""
+    log = HistoryLog(str(tmp_path / 'data' / 'history.ndjson'))
+    archive = HistoryArchive(str(tmp_path / 'archive'))
+    log.seed(records(40))
+    archive_overflow(log, archive, hot_records=20, batch=5)
+    return log, archive, str(tmp_path / 'history.bin')
+
+
+@pytest.fixture
+def no_rebuild(monkeypatch):
+    def rebuild(*args, **kwargs):
+        raise AssertionError("full rebuild")
+    monkeypatch.setattr(history_index, 'query_range', rebuild)
+
+
+def test_to_minutes():
+    assert to_minutes('1970-01-02') == 24 * 60
+    assert to_minutes('1970-01-01 01:30') == 90
+    for bad in ('2026-1-01', '2026-01-01 25:00', '2026/01/01'):
+        with pytest.raises(ValueError):
+            to_minutes(bad)
+
+
+def test_load_builds_and_saves_the_snapshot(history):
+    log, archive, path = history
+    index = load_history(path, log=log, archive=archive)
+    assert len(index) == 40
+    assert rows(index) == [{k: r[k] for k in ('date', 'gold', 'tejabi', 'silver', 'usd')} for r in records(40)]
+    assert HistoryIndex.open_snapshot(path).fingerprint == source_fingerprint(log.path, archive.root)
+
+
+def test_current_snapshot_is_opened_not_rebuilt(history, monkeypatch):
+    log, archive, path = history
+    load_history(path, log=log, archive=archive)
+    monkeypatch.setattr(history_index, 'query_range', None)  # Any rebuild would fail
+    assert len(load_history(path, log=log, archive=archive)) == 40
+
+
+def test_touching_files_keeps_the_snapshot(history, no_rebuild):
+    log, archive, path = history
+    HistoryIndex.from_records(records(40), source_fingerprint(log.path, archive.root)).save(path)
+    os.utime(log.path, (0, 0))
+    os.utime(os.path.join(archive.root, 'index.json'), (0, 0))
+    assert len(load_history(path, log=log, archive=archive)) == 40
+
+
+@pytest.mark.parametrize('change', ['append', 'replace', 'archive'])
+def test_source_changes_invalidate_the_snapshot(history, change):
+    log, archive, path = history
+    load_history(path, log=log, archive=archive)
+    if change == 'append':
+        log.append(records(1, start=40)[0])
+    elif change == 'replace':
+        log.replace_tail(1, [dict(records(40)[-1], gold=1)])
+    else:
+        archive_overflow(log, archive, hot_records=10, batch=5)
+    index = load_history(path, log=log, archive=archive)
+    assert rows(index) == full(log, archive)
+
+
+def test_incompatible_snapshot_is_rebuilt(history):
+    log, archive, path = history
+    load_history(path, log=log, archive=archive)
+    with open(path, 'r+b') as f:
+        f.write(b'XXXX')
+    assert len(load_history(path, log=log, archive=archive)) == 40
+    with open(path, 'wb') as f:
+        f.write(b'GVHX')
+    assert len(load_history(path, log=log, archive=archive)) == 40
+
+
+@pytest.mark.parametrize('replaced', [0, 1])
+def test_update_history_patches_the_tail(history, monkeypatch, replaced):
+    log, archive, path = history
+    load_history(path, log=log, archive=archive)
+    previous = source_fingerprint(log.path, archive.root)
+    new = dict(records(1, start=40 - replaced)[0], gold=1)
+    log.replace_tail(replaced, [new])
+    archive_overflow(log, archive, hot_records=10, batch=5)
+    expected = full(log, archive)
+
+    monkeypatch.setattr(history_index, 'query_range', None)  # Any rebuild would fail
+    index = update_history([new], replaced, previous, path, log=log, archive=archive)
+    assert rows(index) == expected
+    assert rows(load_history(path, log=log, archive=archive)) == expected
+
+
+def test_update_history_rebuilds_a_stale_snapshot(history):
+    log, archive, path = history
+    load_history(path, log=log, archive=archive)
+    log.append(records(1, start=40)[0])  # Not reflected in `previous` below
+    previous = source_fingerprint(log.path, archive.root)
+    new = records(1, start=41)[0]
+    log.append(new)
+    index = update_history([new], 0, previous, path, log=log, archive=archive)
+    assert rows(index) == full(log, archive)
+    assert len(index) == 42
+
+
+def test_range_latest_and_resample(history):
+    log, archive, path = history
+    index = load_history(path, log=log, archive=archive)
+    assert [r['date'] for r in index.range('2024-12-30', '2025-01-01')] == [
+        '2024-12-30 11:00', '2024-12-31 11:00', '2025-01-01 11:00']
+    assert [r['gold'] for r in index.latest(2)] == [100038, 100039]
+    weekly = index.resample('weekly', start='2024-12-23', end='2024-12-29')
+    assert weekly == [['2024-12-23', 100003, 100009, 100003, 100009]]
@@ -0,0 +1,96 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+
+import pytest
+
+from history_log import HistoryLog, open_history_log
+
+
+def records(n, start=0, pad=0):
+    return [{'date': f"2026-01-{(i % 28) + 1:02d} 11:00", 'gold': 100000 + i, 'note': 'x' * pad}
+            for i in range(start, start + n)]
+
+
+@pytest.fixture
+def log(tmp_path):
+    return HistoryLog(str(tmp_path / 'data' / 'history.ndjson'))
+
+
+def test_missing_log_is_empty(log):
+    assert log.tail(5) == []
+    assert log.last() is None
+    assert list(log.iter_records()) == []
+
+
+@pytest.mark.parametrize('n', [0, 1, 3, 10, 50])
+def test_tail_returns_the_last_records_oldest_first(log, n):
+    log.seed(records(10))
+    assert log.tail(n) == (records(10)[-n:] if n else [])
+
+
+def test_tail_reads_across_block_boundaries(log):
+    # Records larger than the 8 KiB read block
+    log.seed(records(6, pad=5000))
+    assert log.tail(4) == records(6, pad=5000)[2:]
+    assert log.last() == records(6, pad=5000)[-1]
+
+
+def test_tail_without_a_final_newline(log):
+    log.seed(records(3))
+    with open(log.path, 'rb+') as f:
+        f.seek(-1, 2)
+        f.truncate()
+    assert log.tail(2) == records(3)[1:]
+
+
+def test_append_and_iter_records(log):
+    for record in records(3):
+        log.append(record)
+    assert list(log.iter_records()) == records(3)
+
+
+def test_replace_tail_replaces_the_last_line(log):
+    log.seed(records(5))
+    replaced = dict(records(5)[-1], gold=1)
+    log.replace_tail(1, [replaced])
+    assert list(log.iter_records()) == records(4) + [replaced]
+
+
+def test_replace_tail_with_zero_appends(log):
+    log.seed(records(2))
+    log.replace_tail(0, records(1, start=2))
+    assert list(log.iter_records()) == records(3)
+
+
+def test_replace_tail_rewrites_several_lines(log):
+    log.seed(records(6))
+    log.replace_tail(3, records(2, start=10))
+    assert list(log.iter_records()) == records(3) + records(2, start=10)
+
+
+def test_replace_tail_on_a_missing_log_seeds_it(log):
+    log.replace_tail(1, records(2))
+    assert list(log.iter_records()) == records(2)
+
+
+def test_compact_rewrites_the_snapshot_only_after_changes(log, tmp_path):
+    snapshot = str(tmp_path / 'data.json')
+    log.seed(records(5))
+    assert log.compact(snapshot, limit=3)
+    with open(snapshot) as f:
+        assert json.load(f) == records(5)[-3:]
+    assert not log.compact(snapshot, limit=3)
+    log.append(records(1, start=5)[0])
+    assert log.compact(snapshot, limit=3)
+    with open(snapshot) as f:
+        assert json.load(f) == records(6)[-3:]
+
+
+def test_open_history_log_seeds_from_the_snapshot(tmp_path):
+    snapshot = tmp_path / 'data.json'
+    snapshot.write_text(json.dumps(records(4)))
+    log = open_history_log(str(tmp_path / 'data' / 'history.ndjson'), str(snapshot))
+    assert list(log.iter_records()) == records(4)
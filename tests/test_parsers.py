@@ -0,0 +1,70 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import os
+
+import pytest
+
+import scraper
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures',
+                       'ashesh_widget.html')
+ASHESH = scraper.ASHESH_WIDGET
+OTHER = 'https://rates.example/'
+
+
+def row(label, price):
+    return (f'<div class="country"><div class="name"><strong>{label}</strong></div>'
+            f'<div class="rate_buying">Nrs. <span class="price">{price}</span></div></div>')
+
+
+ROWS = row('Gold Hallmark - Tola', '3,16,700') + row('Gold Tajabi - Tola', '3,13,500') + row('Silver - Tola', '4,985')
+
+# (page, URL, expected candidates); both extractors must return exactly this
+PAGES = {
+    'widget rows': (f'<div class="rates">{ROWS}</div>', ASHESH,
+                    {'gold': [316700], 'tejabi': [313500], 'silver': [4985]}),
+    'nepali labels': (row('छापावाल Tola', '316700') + row('तेजाबी Tola', '313500') + row('चाँदी Tola', '4985'), ASHESH,
+                      {'gold': [316700], 'tejabi': [313500], 'silver': [4985]}),
+    'script inside a row': ('<div class="country">Gold Hallmark <script>var x = 999999;</script>Tola 316700</div>',
+                            ASHESH, {'gold': [316700], 'tejabi': [316700], 'silver': []}),
+    'multiple classes and nesting': ('<div class="country odd"><div><div>Silver</div> Tola</div> 4,985</div>',
+                                     ASHESH, {'gold': [], 'tejabi': [], 'silver': [4985]}),
+    'unclosed row': ('<div class="rates"><div class="country">Silver - Tola 4,985', ASHESH,
+                     {'gold': [], 'tejabi': [], 'silver': [4985]}),
+    'entities': ('<div class="country">Gold&nbsp;Hallmark&nbsp;-&nbsp;Tola &#51;16700</div>', ASHESH,
+                 {'gold': [316700], 'tejabi': [316700], 'silver': []}),
+    'junk tags ignored by the text fallback': (
+        '<header>Tola 453227 2026</header><nav>Tola 999999</nav><main>FINE gold per Tola 316700 '
+        'Tejabi 313500 SILVER 4985</main><aside>Tola 123456</aside><footer>Tola 654321</footer>',
+        OTHER, {'gold': [316700], 'tejabi': [316700, 313500], 'silver': [4985]}),
+    'rows ignored for other sites': (f'<div class="rates">{ROWS}</div>', OTHER,
+                                     {'gold': [316700, 313500], 'tejabi': [316700, 313500], 'silver': [4985]}),
+    'blacklisted numbers': ('<p>Purity 9999 Tola 11664 Silver 2026 Hallmark 453228</p>', OTHER,
+                            {'gold': [], 'tejabi': [], 'silver': []}),
+}
+
+
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_fast_and_soup_extractors_agree(name):
+    page, url, expected = PAGES[name]
+    raw_html = scraper.preprocess_html(page)
+    assert scraper.extract_candidates_soup(raw_html, url) == expected
+    assert scraper.extract_candidates_fast(raw_html, url) == expected
+
+
+def test_fixture_page():
+    with open(FIXTURE, encoding='utf-8') as f:
+        raw_html = scraper.preprocess_html(f.read())
+    fast = scraper.extract_candidates_fast(raw_html, ASHESH)
+    assert fast == scraper.extract_candidates_soup(raw_html, ASHESH)
+    assert fast == {'gold': [316700], 'tejabi': [313500], 'silver': [4985]}
+
+
+def test_extract_candidates_falls_back_to_soup(monkeypatch):
+    def broken(raw_html, url):
+        raise ValueError("parser error")
+    monkeypatch.setattr(scraper, 'extract_candidates_fast', broken)
+    page, url, expected = PAGES['widget rows']
+    assert scraper.extract_candidates(page, url) == expected
@@ -0,0 +1,149 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import random
+import time
+
+import pytest
+from pywebpush import WebPushException
+
+import push_engine
+import send_notifications
+from push_engine import FAILURE_THRESHOLD, apply_results, fan_out
+
+
+@pytest.fixture(autouse=True)
+def unlimited_rate(monkeypatch):
+    monkeypatch.setattr(push_engine, 'ORIGIN_RATE', 0)
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+        self.headers = {}
+
+
+def subscription(name, failures=None, origin='https://fcm.example'):
+    sub = {'endpoint': f"{origin}/{name}", 'keys': {'p256dh': 'p', 'auth': 'a'}}
+    if failures is not None:
+        sub['failureCount'] = failures
+    return sub
+
+
+@pytest.fixture
+def push_one(monkeypatch):
+    """send_notifications.send_web_push() with webpush() answering by
+    endpoint name: ok, 404, 410, 500 or error (no response)."""
+    def webpush(subscription_info, **kwargs):
+        outcome = subscription_info['endpoint'].rsplit('/', 1)[1].split('-')[0]
+        if outcome == 'ok':
+            return FakeResponse(201)
+        if outcome == 'error':
+            raise WebPushException('connection reset')
+        raise WebPushException(f"HTTP {outcome}", response=FakeResponse(int(outcome)))
+
+    class Signer:
+        def headers_for(self, endpoint):
+            return {}
+
+    monkeypatch.setattr(send_notifications, 'webpush', webpush)
+    return lambda sub: send_notifications.send_web_push(sub, '{}', Signer())
+
+
+def test_success_resets_the_failure_count(push_one):
+    subs = [subscription('ok-1', failures=3), subscription('ok-2')]
+    kept, sent, failed, changed = apply_results(subs, fan_out(subs, push_one))
+    assert (sent, failed, changed) == (2, 0, True)
+    assert [s['failureCount'] for s in kept] == [0, 0]
+
+
+@pytest.mark.parametrize('outcome', ['404', '410', '500', 'error'])
+def test_failures_increment_the_count(push_one, outcome):
+    subs = [subscription(f"{outcome}-a"), subscription(f"{outcome}-b", failures=2)]
+    kept, sent, failed, changed = apply_results(subs, fan_out(subs, push_one))
+    assert (sent, failed, changed) == (0, 2, True)
+    assert [s['failureCount'] for s in kept] == [1, 3]
+
+
+@pytest.mark.parametrize('outcome', ['404', '410', '500'])
+def test_reaching_the_threshold_prunes_the_device(push_one, outcome):
+    subs = [subscription(f"{outcome}-dead", failures=FAILURE_THRESHOLD - 1),
+            subscription(f"{outcome}-alive", failures=FAILURE_THRESHOLD - 2)]
+    kept, _, failed, _ = apply_results(subs, fan_out(subs, push_one))
+    assert failed == 2
+    assert [s['endpoint'] for s in kept] == [subs[1]['endpoint']]
+    assert kept[0]['failureCount'] == FAILURE_THRESHOLD - 1
+
+
+def test_skipped_and_untargeted_are_kept_unchanged(push_one):
+    subs = [subscription('dummy-1'), subscription('ok-1', failures=2), subscription('500-1', failures=1)]
+    results = fan_out(subs, push_one, skip=lambda s: 'dummy' in s['endpoint'], indices=[0, 1])
+    assert results[0] is None and results[2] is None
+    kept, sent, failed, _ = apply_results(subs, results)
+    assert (sent, failed) == (1, 0)
+    assert [s['failureCount'] for s in kept] == [0, 0, 1]
+
+
+def test_results_stay_aligned_with_the_input_order():
+    rng = random.Random(7)
+    subs = [subscription(str(i), failures=rng.randrange(3), origin=f"https://push{i % 3}.example")
+            for i in range(60)]
+
+    def send(sub):
+        time.sleep(rng.random() / 500)
+        number = int(sub['endpoint'].rsplit('/', 1)[1])
+        return (True, 0) if number % 2 else (False, number)
+
+    results = fan_out(subs, send, workers=8)
+    assert results == [(True, 0) if i % 2 else (False, i) for i in range(60)]
+
+
+def test_on_result_sees_every_final_result():
+    subs = [subscription(str(i)) for i in range(10)]
+    seen = {}
+    fan_out(subs, lambda sub: (True, 0), on_result=lambda sub, result: seen.update({sub['endpoint']: result}))
+    assert seen == {s['endpoint']: (True, 0) for s in subs}
+
+
+def test_throttled_give_up_is_deferred_not_failed(monkeypatch):
+    monkeypatch.setattr(push_engine, 'MAX_REQUEUES', 1)
+    subs = [subscription('ok-1'), subscription('throttled', failures=2)]
+    deferred = []
+    recorded = []
+
+    def send(sub):
+        if 'throttled' in sub['endpoint']:
+            raise push_engine.PushThrottled(429, retry_after=0)
+        return (True, 0)
+
+    results = fan_out(subs, send, on_result=lambda sub, result: recorded.append(sub['endpoint']),
+                      on_deferred=deferred.append)
+    assert results == [(True, 0), push_engine.DEFERRED]
+    assert deferred == [subs[1]]
+    assert recorded == [subs[0]['endpoint']]
+
+    kept, sent, failed, changed = apply_results(subs, results)
+    assert (sent, failed, changed) == (1, 0, False)
+    assert kept[1]['failureCount'] == 2
+
+
+def test_send_by_shard_skips_unreached_shards(tmp_path):
+    from subscription_store import LocalBackend, SubscriptionStore, shard_of
+    from targeting import moves, reaches, select_targets
+    backend = LocalBackend(str(tmp_path))
+    subs = [dict(subscription(f"ok-{i}"), prefs={'gold': {'abs': 1000 if i % 2 else 100}}) for i in range(8)]
+    SubscriptionStore(backend, shard_count=16).save(subs)
+    changes, prices = {'gold': 500}, {'gold': 150000}
+    moved = moves(changes, prices)
+    sent = []
+
+    totals = push_engine.send_by_shard(SubscriptionStore(backend), lambda sub: sent.append(sub) or (True, 0),
+                                       lambda shard: select_targets(shard, changes, prices),
+                                       wanted=lambda reach: reaches(reach, moved))
+    assert sorted(s['endpoint'] for s in sent) == sorted(s['endpoint'] for s in subs[0::2])
+    assert totals['subscriptions'] == 8
+    assert totals['sent'] == 4
+    # Only shards holding a low threshold are read; empty ones are skipped too
+    assert totals['shards_skipped'] == 16 - len({shard_of(s['endpoint'], 16) for s in subs[0::2]})
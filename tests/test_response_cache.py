@@ -0,0 +1,151 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+from response_cache import ResponseCache, cached_get
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Local stand-in for an upstream API. The test sets `body`, `etag` and
+    `statuses` (served first, one per request) on the server; every request's
+    headers are recorded in `server.seen`."""
+
+    def do_GET(self):
+        server = self.server
+        server.seen.append(dict(self.headers))
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200 and server.etag and self.headers.get('If-None-Match') == server.etag:
+            status = 304
+        self.send_response(status)
+        if status == 503:
+            self.send_header('Retry-After', '0')
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        body = server.body if status == 200 else b''
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    server.body, server.etag, server.statuses, server.seen = b'{"gold": 1}', None, [], []
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/rates"
+    http_client.start_run()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / 'http'))
+
+
+class Parser:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, resp):
+        self.calls += 1
+        return resp.json()
+
+
+def test_first_fetch_is_a_plain_get(upstream, cache):
+    parse = Parser()
+    assert cached_get(upstream.url, parse, cache=cache) == {'gold': 1}
+    assert parse.calls == 1
+    assert 'If-None-Match' not in upstream.seen[0]
+    assert cache.get(upstream.url)['parsed'] == {'gold': 1}
+
+
+def test_not_modified_reuses_the_parsed_result(upstream, cache):
+    upstream.etag = '"v1"'
+    parse = Parser()
+    cached_get(upstream.url, parse, cache=cache)
+    assert cached_get(upstream.url, parse, cache=cache) == {'gold': 1}
+    assert upstream.seen[1]['If-None-Match'] == '"v1"'
+    assert parse.calls == 1
+
+
+def test_unchanged_body_without_validators_is_not_reparsed(upstream, cache):
+    parse = Parser()
+    cached_get(upstream.url, parse, cache=cache)
+    assert cached_get(upstream.url, parse, cache=cache) == {'gold': 1}
+    assert 'If-None-Match' not in upstream.seen[1]
+    assert parse.calls == 1
+
+
+def test_changed_body_is_parsed_again(upstream, cache):
+    upstream.etag = '"v1"'
+    parse = Parser()
+    cached_get(upstream.url, parse, cache=cache)
+    upstream.body, upstream.etag = b'{"gold": 2}', '"v2"'
+    assert cached_get(upstream.url, parse, cache=cache) == {'gold': 2}
+    assert parse.calls == 2
+    assert cache.get(upstream.url)['etag'] == '"v2"'
+
+
+def test_expired_entry_is_not_used(upstream, tmp_path):
+    cache = ResponseCache(str(tmp_path / 'http'), max_age=0)
+    upstream.etag = '"v1"'
+    parse = Parser()
+    cached_get(upstream.url, parse, cache=cache)
+    time.sleep(0.01)
+    cached_get(upstream.url, parse, cache=cache)
+    assert 'If-None-Match' not in upstream.seen[1]
+    assert parse.calls == 2
+
+
+def test_error_keeps_the_previous_entry(upstream, cache):
+    parse = Parser()
+    cached_get(upstream.url, parse, cache=cache)
+    upstream.statuses = [404]
+    with pytest.raises(requests.HTTPError):
+        cached_get(upstream.url, parse, cache=cache)
+    assert cache.get(upstream.url)['parsed'] == {'gold': 1}
+
+
+def test_retry_after_is_honoured(upstream, cache):
+    upstream.statuses = [503]
+    assert cached_get(upstream.url, Parser(), cache=cache) == {'gold': 1}
+    assert len(upstream.seen) == 2
+
+
+def test_spent_budget_stops_requests(upstream, cache):
+    http_client.start_run(budget=0)
+    with pytest.raises(http_client.BudgetExceeded):
+        cached_get(upstream.url, Parser(), cache=cache)
+    assert upstream.seen == []
+    # Storage requests are exempt from the budget
+    assert http_client.get(upstream.url, budgeted=False).status_code == 200
+
+
+def test_evict_drops_expired_then_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'http'), max_age=3600, max_bytes=1)
+    for i, url in enumerate(('a', 'b', 'c')):
+        cache.put(url, {'stored': time.time(), 'parsed': i})
+        os.utime(cache._path(url), (time.time() - 100 + i, time.time() - 100 + i))
+    cache.max_bytes = os.path.getsize(cache._path('b')) + os.path.getsize(cache._path('c'))
+    assert cache.evict() == 1
+    assert cache.get('a') is None and cache.get('b') and cache.get('c')
+    os.utime(cache._path('b'), (time.time() - 7200, time.time() - 7200))
+    assert cache.evict() == 1
+    assert cache.get('b') is None
+    assert json.loads(open(cache._path('c')).read())['parsed'] == 2
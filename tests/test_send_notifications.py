@@ -0,0 +1,59 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+
+import pytest
+
+import push_engine
+import send_notifications
+from history_index import HistoryIndex
+from subscription_store import LocalBackend
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """broadcast() against a local store, a two-record history and a fake
+    send. Returns the list of endpoints sent to."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path / '.metrics'))
+    monkeypatch.setattr(push_engine, 'ORIGIN_RATE', 0)
+    backend = LocalBackend(str(tmp_path / 'store'))
+    history = HistoryIndex.from_records([
+        {'date': '2026-01-01 11:00', 'gold': 316700, 'tejabi': 313500, 'silver': 4985},
+        {'date': '2026-01-02 11:00', 'gold': 316800, 'tejabi': 313600, 'silver': 4990},
+    ])
+    sent = []
+
+    def send(sub, data, signer):
+        sent.append(sub['endpoint'])
+        return (True, 0)
+
+    monkeypatch.setattr(send_notifications, 'VAPID_PRIVATE_KEY', 'key')
+    monkeypatch.setattr(send_notifications, 'VapidSigner', lambda key, email: None)
+    monkeypatch.setattr(send_notifications, 'load_history', lambda: history)
+    monkeypatch.setattr(send_notifications, 'open_backend', lambda: backend)
+    monkeypatch.setattr(send_notifications, 'send_web_push', send)
+    subs = [{'endpoint': f"https://push.example/{i}", 'keys': {'p256dh': 'p', 'auth': 'a'}} for i in range(5)]
+    (tmp_path / 'subscriptions.json').write_text(json.dumps(subs))
+    return sent
+
+
+@pytest.mark.parametrize('shard', [None, (0, 1)])
+def test_empty_store_falls_back_to_the_local_file(offline, shard):
+    summary = send_notifications.broadcast(shard)
+    assert summary['sent'] == 5
+    assert len(offline) == 5
+
+
+def test_owners_split_the_local_file_between_them(offline):
+    sent = [send_notifications.broadcast((i, 2)) for i in range(2)]
+    assert sum(s['sent'] for s in sent if s) == 5
+    assert sorted(offline) == sorted(f"https://push.example/{i}" for i in range(5))
+
+
+def test_completed_broadcast_is_not_sent_again(offline):
+    assert send_notifications.broadcast()['sent'] == 5
+    assert send_notifications.broadcast() is None
+    assert len(offline) == 5
@@ -0,0 +1,238 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import json
+
+import pytest
+
+import subscription_store
+from subscription_store import (LEGACY_PATH, MANIFEST_PATH, SHARD_COUNT, LocalBackend, SubscriptionStore, shard_of,
+                                shard_path)
+
+
+def subscriptions(n, prefix='https://push.example/'):
+    return [{'endpoint': f"{prefix}{i}", 'keys': {'p256dh': 'p', 'auth': 'a'}} for i in range(n)]
+
+
+def read(backend, path):
+    return json.loads(backend.read(path))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalBackend(str(tmp_path))
+
+
+def test_save_and_load_round_trip_in_shard_order(backend):
+    subs = subscriptions(50)
+    SubscriptionStore(backend, shard_count=4).save(subs)
+    loaded = SubscriptionStore(backend).load()
+    assert sorted(s['endpoint'] for s in loaded) == sorted(s['endpoint'] for s in subs)
+    shards = [shard_of(s['endpoint'], 4) for s in loaded]
+    assert shards == sorted(shards)
+    manifest = read(backend, MANIFEST_PATH)
+    assert manifest['shards'] == 4
+    assert sum(manifest['counts']) == 50
+    assert manifest['legacyMerged'] is True
+
+
+def test_duplicate_endpoints_are_saved_once(backend):
+    subs = subscriptions(10)
+    first = dict(subs[3], prefs={'gold': 1})
+    SubscriptionStore(backend, shard_count=4).save([first] + subs)
+    loaded = SubscriptionStore(backend).load()
+    assert len(loaded) == 10
+    assert [s for s in loaded if s['endpoint'] == first['endpoint']] == [first]  # First occurrence wins
+
+
+def test_unchanged_shards_are_not_rewritten(backend):
+    SubscriptionStore(backend, shard_count=4).save(subscriptions(40))
+    store = SubscriptionStore(backend)
+    assert all(store.save_shard(i, shard) is False for i, shard in store.iter_shards())
+
+
+def test_only_the_changed_shard_is_written(backend):
+    SubscriptionStore(backend, shard_count=4).save(subscriptions(40))
+    store = SubscriptionStore(backend)
+    subs = store.load()
+    subs[0]['failureCount'] = 1
+    changed = shard_of(subs[0]['endpoint'], 4)
+    before = {i: backend.read(shard_path(i)) for i in range(4)}
+
+    assert store.save(subs) == 1
+    after = {i: backend.read(shard_path(i)) for i in range(4)}
+    assert [i for i in range(4) if before[i] != after[i]] == [changed]
+
+
+def test_legacy_blob_is_merged_once(backend):
+    SubscriptionStore(backend, shard_count=4).save(subscriptions(5))
+    manifest = read(backend, MANIFEST_PATH)
+    manifest['legacyMerged'] = False
+    backend.write(MANIFEST_PATH, json.dumps(manifest).encode())
+    # Two new legacy subscribers, one already in a shard
+    legacy = subscriptions(7)[4:]
+    backend.write(LEGACY_PATH, json.dumps(legacy).encode())
+
+    store = SubscriptionStore(backend)
+    subs = store.load()
+    assert len(subs) == 7
+    store.save(subs)
+    assert read(backend, MANIFEST_PATH)['legacyMerged'] is True
+
+    # Later edits to the legacy blob are ignored
+    backend.write(LEGACY_PATH, json.dumps(subscriptions(3, 'https://late.example/')).encode())
+    assert len(SubscriptionStore(backend).load()) == 7
+
+
+def test_failed_shard_write_keeps_the_legacy_blob_pending(backend, monkeypatch):
+    backend.write(LEGACY_PATH, json.dumps(subscriptions(20)).encode())
+    store = SubscriptionStore(backend, shard_count=4)
+    subs = store.load()
+    write = backend.write
+    monkeypatch.setattr(backend, 'write', lambda path, body: path != shard_path(0) and write(path, body))
+    store.save(subs)
+    assert read(backend, MANIFEST_PATH)['legacyMerged'] is False
+
+    monkeypatch.setattr(backend, 'write', write)
+    assert len(SubscriptionStore(backend).load()) == 20
+
+
+def test_oversized_shards_are_split(backend, monkeypatch):
+    monkeypatch.setattr(subscription_store, 'SHARD_MAX', 30)
+    SubscriptionStore(backend, shard_count=4).save(subscriptions(400))
+    store = SubscriptionStore(backend)
+    seen = []
+    for i, shard in store.iter_shards():
+        assert len(shard) <= 45
+        assert all(shard_of(s['endpoint'], store.shard_count) == i for s in shard)
+        seen.extend(s['endpoint'] for s in shard)
+    assert store.shard_count == 16
+    assert sorted(seen) == sorted(s['endpoint'] for s in subscriptions(400))
+    assert read(backend, MANIFEST_PATH)['shards'] == 16
+
+
+def test_interrupted_split_moves_leftovers_forward(backend):
+    SubscriptionStore(backend, shard_count=4).save(subscriptions(100))
+    # The manifest switched to 8 shards but no old shard was split yet
+    manifest = read(backend, MANIFEST_PATH)
+    manifest.update(shards=8, counts=manifest['counts'] + [0] * 4)
+    backend.write(MANIFEST_PATH, json.dumps(manifest).encode())
+
+    store = SubscriptionStore(backend)
+    for i, shard in store.iter_shards():
+        assert all(shard_of(s['endpoint'], 8) == i for s in shard)
+        store.save_shard(i, shard)
+    store.save_manifest(1)
+    assert len(SubscriptionStore(backend).load()) == 100
+    assert sum(read(backend, MANIFEST_PATH)['counts']) == 100
+
+
+@pytest.mark.parametrize('owner', [(0, 1), (0, 2), (1, 2)])
+def test_owner_reads_shards_saved_without_a_manifest(backend, owner):
+    # The send_notifications fallback: an owner saves subscriptions.json into
+    # an empty store and reads it back before any manifest exists
+    subs = subscriptions(40)
+    store = SubscriptionStore(backend, owner=owner)
+    mine = [s for s in subs if store.owns_endpoint(s['endpoint'])]
+    store.save(mine, write_manifest=False)
+    assert backend.read(MANIFEST_PATH) is None
+
+    loaded = SubscriptionStore(backend, owner=owner).load()
+    assert sorted(s['endpoint'] for s in loaded) == sorted(s['endpoint'] for s in mine)
+    assert loaded
+
+
+def run_owner(backend, owner, fail_shards=()):
+    store = SubscriptionStore(backend, owner=owner)
+    write = backend.write
+    backend.write = lambda path, body: path not in [shard_path(i) for i in fail_shards] and write(path, body)
+    try:
+        for i, shard in store.iter_shards():
+            store.save_shard(i, shard)
+        store.save_manifest(0)
+    finally:
+        backend.write = write
+    return store
+
+
+def test_owners_write_status_files_not_the_manifest(backend):
+    backend.write(LEGACY_PATH, json.dumps(subscriptions(30)).encode())
+    for index in range(2):
+        run_owner(backend, (index, 2))
+    assert backend.read(MANIFEST_PATH) is None
+    statuses = [read(backend, subscription_store.owner_path((i, 2))) for i in range(2)]
+    assert all(status['legacyMerged'] for status in statuses)
+    assert sorted(int(s) for status in statuses for s in status['counts']) == list(range(SHARD_COUNT))
+    assert sum(n for status in statuses for n in status['counts'].values()) == 30
+
+    assert SubscriptionStore(backend).refresh_manifest(owners=2) == 30
+    manifest = read(backend, MANIFEST_PATH)
+    assert manifest['legacyMerged'] is True
+    assert sum(manifest['counts']) == 30
+
+
+def test_refresh_waits_for_every_owner_to_merge(backend):
+    backend.write(LEGACY_PATH, json.dumps(subscriptions(30)).encode())
+    run_owner(backend, (0, 2))
+    run_owner(backend, (1, 2), fail_shards=[1])
+    assert read(backend, subscription_store.owner_path((1, 2)))['legacyMerged'] is False
+    SubscriptionStore(backend).refresh_manifest(owners=2)
+    assert read(backend, MANIFEST_PATH)['legacyMerged'] is False
+
+    # The failed owner retries: its legacy slice is merged again, the other owner's is not needed
+    run_owner(backend, (1, 2))
+    assert read(backend, subscription_store.owner_path((1, 2)))['legacyMerged'] is True
+    SubscriptionStore(backend).refresh_manifest(owners=2)
+    assert read(backend, MANIFEST_PATH)['legacyMerged'] is True
+    assert len(SubscriptionStore(backend).load()) == 30
+
+
+def gold_only(n, abs_threshold):
+    return [dict(sub, prefs={'gold': {'abs': abs_threshold}}) for sub in subscriptions(n)]
+
+
+def test_shards_a_move_does_not_reach_are_not_read(backend, monkeypatch):
+    SubscriptionStore(backend, shard_count=4).save(gold_only(40, 500))
+    manifest = read(backend, MANIFEST_PATH)
+    assert manifest['reach'] == [{'gold': [500.0, None]}] * 4
+
+    read_paths = []
+    original = backend.read
+    monkeypatch.setattr(backend, 'read', lambda path: read_paths.append(path) or original(path))
+    store = SubscriptionStore(backend)
+    assert list(store.iter_shards(lambda reach: reach['gold'][0] <= 100)) == []
+    assert not [path for path in read_paths if path.startswith('subscriptions/shards/')]
+    assert sum(store.skipped.values()) == 40
+
+    # Skipped shards keep their counts and summaries
+    store.save_manifest(0)
+    assert read(backend, MANIFEST_PATH)['counts'] == manifest['counts']
+    assert read(backend, MANIFEST_PATH)['reach'] == manifest['reach']
+
+
+def test_shards_without_a_summary_are_read(backend):
+    SubscriptionStore(backend, shard_count=4).save(gold_only(40, 500))
+    manifest = read(backend, MANIFEST_PATH)
+    manifest['reach'][2] = None
+    backend.write(MANIFEST_PATH, json.dumps(manifest).encode())
+    store = SubscriptionStore(backend)
+    assert [i for i, _ in store.iter_shards(lambda reach: False)] == [2]
+
+
+def test_subscribe_write_during_a_run_drops_the_summary(backend):
+    SubscriptionStore(backend, shard_count=4).save(gold_only(40, 500))
+    store = SubscriptionStore(backend)
+    shards = list(store.iter_shards())
+    # api/subscribe.js adds a subscriber to shard 1 while the run is sending
+    manifest = read(backend, MANIFEST_PATH)
+    manifest.update(reach=[manifest['reach'][i] if i != 1 else None for i in range(4)], versions=[0, 1, 0, 0])
+    backend.write(MANIFEST_PATH, json.dumps(manifest).encode())
+    for i, shard in shards:
+        store.save_shard(i, shard)
+    store.save_manifest(0)
+
+    manifest = read(backend, MANIFEST_PATH)
+    assert manifest['reach'][1] is None
+    assert manifest['versions'] == [0, 1, 0, 0]
+    assert all(manifest['reach'][i] == {'gold': [500.0, None]} for i in (0, 2, 3))
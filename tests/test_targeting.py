@@ -0,0 +1,41 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import random
+
+from targeting import METALS, interested, moves, reaches, select_targets, shard_reach
+
+PRICES = {'gold': 150000, 'tejabi': 140000, 'silver': 2000}
+
+
+def random_prefs(rng):
+    if rng.random() < 0.1:
+        return None
+    prefs = {}
+    for metal in rng.sample(METALS, rng.randint(1, len(METALS))):
+        rule = {}
+        if rng.random() < 0.6:
+            rule['abs'] = rng.choice([10, 100, 500, 1000, 2500])
+        if rng.random() < 0.6:
+            rule['pct'] = rng.choice([0.1, 0.5, 1, 2.5])
+        prefs[metal] = rule
+    return prefs
+
+
+def test_select_targets_follows_prefs():
+    subs = [{'endpoint': 'a'}, {'endpoint': 'b', 'prefs': {'gold': {'abs': 500}}},
+            {'endpoint': 'c', 'prefs': {'silver': {}}}, {'endpoint': 'd', 'prefs': {'gold': {'pct': 0.2}}}]
+    assert select_targets(subs, {'gold': 400}, PRICES) == [0, 3]
+    assert select_targets(subs, {'gold': 600}, PRICES) == [0, 1, 3]
+    assert select_targets(subs, {'silver': -5}, PRICES) == [0, 2]
+    assert select_targets(subs, {}, PRICES) == []
+
+
+def test_shard_summary_is_reached_exactly_when_someone_is_interested():
+    rng = random.Random(7)
+    for _ in range(300):
+        shard = [{'prefs': random_prefs(rng)} for _ in range(rng.randint(0, 4))]
+        changes = {metal: rng.choice([0, 5, 50, 300, 800, 3000]) * rng.choice([1, -1]) for metal in METALS}
+        moved = moves(changes, PRICES)
+        assert reaches(shard_reach(shard), moved) == any(interested(sub, moved) for sub in shard)
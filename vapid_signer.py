@@ -0,0 +1,56 @@
+# Copyright (c) 2024-2026 Timeswantstocode. All Rights Reserved.
+# This software is proprietary and may not be copied, modified, or distributed.
+# See LICENSE file for details.
+
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# pywebpush signs tokens for 12 hours; re-sign a little before they lapse so
+# a token never expires while a broadcast is still in flight.
+TOKEN_LIFETIME = 12 * 60 * 60
+REFRESH_MARGIN = 10 * 60
+
+
+def load_vapid_key(private_key):
+    """Parses VAPID_PRIVATE_KEY once. Accepts a key file path, a PEM string,
+    base64url DER (see `generate_vapid.py --format der`) or the raw 32-byte key.
+    """
+    from py_vapid import Vapid
+
+    if os.path.isfile(private_key):
+        return Vapid.from_file(private_key_file=private_key)
+    if "-----BEGIN" in private_key:
+        return Vapid.from_pem(private_key.encode("utf8"))
+    return Vapid.from_string(private_key=private_key)
+
+
+class VapidSigner:
+    """Signs VAPID Authorization headers once per push-service origin.
+
+    Every subscriber on the same push service (fcm.googleapis.com,
+    updates.push.services.mozilla.com, web.push.apple.com, ...) shares the
+    same `aud` claim, so a single signed JWT covers all of them until it
+    nears expiry. Safe to share between fan-out worker threads.
+    """
+
+    def __init__(self, private_key, subject):
+        self.vapid = load_vapid_key(private_key)
+        self.subject = subject
+        self._cache = {}  # origin -> (exp, headers)
+        self._lock = threading.Lock()
+
+    def headers_for(self, endpoint):
+        url = urlparse(endpoint)
+        origin = f"{url.scheme}://{url.netloc}"
+        now = int(time.time())
+        with self._lock:
+            cached = self._cache.get(origin)
+            if cached is None or cached[0] - REFRESH_MARGIN <= now:
+                exp = now + TOKEN_LIFETIME
+                claims = {"sub": self.subject, "aud": origin, "exp": exp}
+                cached = (exp, self.vapid.sign(claims))
+                self._cache[origin] = cached
+        # Callers may add their own headers; never hand out the cached dict
+        return dict(cached[1])